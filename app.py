@@ -5,15 +5,65 @@ Flask application with modern interface for military/vintage tag analysis
 Updated for Railway deployment with fallback HTML
 """
 
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from flask import Flask, Request, Response, g, render_template, request, jsonify, send_file, stream_with_context
 import os
 import base64
+import hashlib
+import io
 import requests
 import json
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
 from datetime import datetime
+from urllib.parse import urlencode
+import metrics
+import provider_client
+from provider_routing import CircuitBreaker, HedgedRunner, LatencyTracker, hedge_delay
+from result_cache import ResultCache, make_key
+from upload_store import DeferredWriter, UploadStore
+from preprocessing import prepare_image, sniff_mime_type
+from job_queue import JobQueue, JobWorkerPool
+from bulk import BatchClient, BulkRunner, BulkStore
+from rate_limiter import ProviderRateLimiter
+from near_duplicates import NearDuplicateIndex, dhash
+from history import HistoryStore, HistoryWriter
+from singleflight import SingleFlight
+from cascade import CASCADE_PROMPT, assess, assess_structured
+from prescreen import DecisionLog, screen_image
+from structured_output import RESPONSE_FORMAT, STRUCTURED_PROMPT, InvalidAnalysis, format_analysis, parse_analysis
+
+# Upload persistence:
+#   'sync'     - write the upload to disk before analysing it
+#   'deferred' - analyse from memory, a background thread writes the upload
+#   'off'      - analyse from memory, never write the upload
+UPLOAD_PERSIST_MODE = os.environ.get('UPLOAD_PERSIST_MODE', 'deferred').lower()
+# Request bodies larger than this (batch / bulk uploads) are spooled to temp files
+IN_MEMORY_REQUEST_MAX_BYTES = int(os.environ.get('IN_MEMORY_REQUEST_MAX_BYTES', str(16 * 1024 * 1024)))
+# Total size of stored uploads; least recently used images are evicted beyond it
+UPLOAD_STORE_MAX_BYTES = int(os.environ.get('UPLOAD_STORE_MAX_BYTES', str(512 * 1024 * 1024)))
+# Blob / alias index, kept outside the folder that /uploads/<filename> serves
+UPLOAD_INDEX_PATH = os.environ.get('UPLOAD_INDEX_PATH', os.path.join('cache', 'uploads.sqlite3'))
+# Fixed sizes (longest side, px) of the thumbnails served by /uploads/<name>?size=
+THUMBNAIL_SIZES = sorted(int(size) for size in os.environ.get('THUMBNAIL_SIZES', '160,480,1024').split(','))
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', '80'))
+# Report per-request peak Python allocations (tracemalloc adds overhead, measurement only)
+TRACK_ALLOCATIONS = os.environ.get('TRACK_ALLOCATIONS', 'off').lower() == 'on'
+
+class InMemoryRequest(Request):
+    """Request that keeps multipart file uploads in memory instead of spooling them to temp
+    files, unless the request is larger than IN_MEMORY_REQUEST_MAX_BYTES (or of unknown size)"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if (UPLOAD_PERSIST_MODE == 'sync' or total_content_length is None
+                or total_content_length > IN_MEMORY_REQUEST_MAX_BYTES):
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        return io.BytesIO()
 
 app = Flask(__name__)
+app.request_class = InMemoryRequest
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['UPLOAD_FOLDER'] = 'uploads'
 
@@ -24,6 +74,23 @@ app.config['FLASK_DEBUG'] = False
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+upload_store = None
+if UPLOAD_PERSIST_MODE != 'off':
+    legacy_index = os.path.join(app.config['UPLOAD_FOLDER'], 'index.sqlite3')
+    if os.path.exists(legacy_index) and not os.path.exists(UPLOAD_INDEX_PATH):
+        # Move an index written inside the upload folder by earlier versions
+        os.makedirs(os.path.dirname(UPLOAD_INDEX_PATH) or '.', exist_ok=True)
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.replace(legacy_index + suffix, UPLOAD_INDEX_PATH + suffix)
+            except FileNotFoundError:
+                pass
+    upload_store = UploadStore(app.config['UPLOAD_FOLDER'], UPLOAD_STORE_MAX_BYTES, UPLOAD_INDEX_PATH)
+upload_writer = DeferredWriter(upload_store) if UPLOAD_PERSIST_MODE == 'deferred' else None
+
+if TRACK_ALLOCATIONS:
+    tracemalloc.start()
+
 # Get API keys from environment variables (Railway)
 XAI_API_KEY = os.environ.get('XAI_API_KEY', '')
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
@@ -34,132 +101,570 @@ if not OPENAI_API_KEY and not XAI_API_KEY:
     print("   The app will use demo analysis only")
     print("   Set OPENAI_API_KEY or XAI_API_KEY in Railway dashboard")
 
+ANALYSIS_PROMPT = "Analyze this image of a military or vintage tag: extract text, identify the item, estimate age, historical context, and current market value. Format your response with clear sections for each analysis."
+# Prepended when several photos of one item are sent in a single request
+MULTI_PHOTO_PROMPT = "These {count} photos show the same item (for example the front and back of a tag, or its care label). Combine what they show into a single analysis."
+# Photos of one item accepted per /analyze request (repeated `file` fields)
+MAX_PHOTOS_PER_ITEM = int(os.environ.get('MAX_PHOTOS_PER_ITEM', '4'))
+# Output mode:
+#   'text' - free-form analysis with clear sections
+#   'json' - schema-bound JSON (structured_output.py), validated into typed `analysis` fields
+OUTPUT_MODE = os.environ.get('OUTPUT_MODE', 'text').lower()
+STRUCTURED_OUTPUT = OUTPUT_MODE == 'json'
+STRUCTURED_MAX_TOKENS = int(os.environ.get('STRUCTURED_MAX_TOKENS', '400'))
+XAI_MODEL = os.environ.get('XAI_MODEL', 'grok-1')
+OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-4o')
+XAI_API_URL = os.environ.get('XAI_API_URL', 'https://api.x.ai/v1/chat/completions')
+OPENAI_API_URL = os.environ.get('OPENAI_API_URL', 'https://api.openai.com/v1/chat/completions')
+
+# Provider hedging:
+#   'off'      - serial xAI -> OpenAI fallback
+#   'delay'    - start OpenAI once xAI is slower than its observed latency percentile
+#   'parallel' - start both providers at once
+HEDGE_MODE = os.environ.get('HEDGE_MODE', 'delay').lower()
+HEDGE_PERCENTILE = float(os.environ.get('HEDGE_PERCENTILE', '95'))
+HEDGE_DELAY_SECONDS = float(os.environ.get('HEDGE_DELAY_SECONDS', '8'))  # used until enough samples exist
+HEDGE_MIN_DELAY_SECONDS = float(os.environ.get('HEDGE_MIN_DELAY_SECONDS', '1'))
+HEDGE_MAX_DELAY_SECONDS = float(os.environ.get('HEDGE_MAX_DELAY_SECONDS', '20'))
+
+HEDGE_POOL_SIZE = int(os.environ.get('HEDGE_POOL_SIZE', '32'))
+
+latency_tracker = LatencyTracker()
+hedged_runner = HedgedRunner(max_workers=HEDGE_POOL_SIZE)
+
+# Model cascade: the cheap model answers first, the full models only on weak confidence
+CASCADE_ENABLED = os.environ.get('CASCADE', 'on').lower() != 'off' and bool(OPENAI_API_KEY)  # first tier is an OpenAI model
+CASCADE_MODEL = os.environ.get('CASCADE_MODEL', 'gpt-4o-mini')
+CASCADE_MIN_CONFIDENCE = float(os.environ.get('CASCADE_MIN_CONFIDENCE', '70'))  # self-reported, 0-100
+CASCADE_MAX_TOKENS = int(os.environ.get('CASCADE_MAX_TOKENS', '400'))
+CASCADE_PROVIDER = "OpenAI-mini"  # breaker / rate limit / metrics name of the first tier
+
+cascade_latency = LatencyTracker()
+cascade_counts = {"accepted": 0, "escalated": 0}
+cascade_counts_lock = threading.Lock()
+
+# Per-provider circuit breaker; route order follows rolling provider health
+CIRCUIT_WINDOW_SECONDS = float(os.environ.get('CIRCUIT_WINDOW_SECONDS', '60'))
+CIRCUIT_MIN_CALLS = int(os.environ.get('CIRCUIT_MIN_CALLS', '5'))
+CIRCUIT_ERROR_THRESHOLD = float(os.environ.get('CIRCUIT_ERROR_THRESHOLD', '0.5'))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get('CIRCUIT_OPEN_SECONDS', '30'))
+
+circuit_breaker = CircuitBreaker(CIRCUIT_WINDOW_SECONDS, CIRCUIT_MIN_CALLS,
+                                 CIRCUIT_ERROR_THRESHOLD, CIRCUIT_OPEN_SECONDS)
+
+# Provider quotas shared by all gunicorn workers through a SQLite file (0 = unlimited)
+RATE_LIMITS = {
+    "xAI": (int(os.environ.get('XAI_RPM', '0')), int(os.environ.get('XAI_TPM', '0'))),
+    "OpenAI": (int(os.environ.get('OPENAI_RPM', '0')), int(os.environ.get('OPENAI_TPM', '0'))),
+}
+# The cascade's first tier uses the same OpenAI key and organisation quota
+QUOTA_BUCKETS = {CASCADE_PROVIDER: "OpenAI"}
+RATE_LIMIT_PATH = os.environ.get('RATE_LIMIT_PATH', os.path.join('cache', 'ratelimit.sqlite3'))
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get('RATE_LIMIT_MAX_WAIT_SECONDS', '2'))
+# Prompt + max_tokens + a high-detail image at the preprocessing limits (8 tiles)
+RATE_LIMIT_TOKENS_PER_REQUEST = int(os.environ.get('RATE_LIMIT_TOKENS_PER_REQUEST', '2500'))
+RATE_LIMIT_COOLDOWN_SECONDS = float(os.environ.get('RATE_LIMIT_COOLDOWN_SECONDS', '20'))
+
+rate_limiter = None
+if any(rpm or tpm for rpm, tpm in RATE_LIMITS.values()):
+    rate_limiter = ProviderRateLimiter(RATE_LIMIT_PATH, RATE_LIMITS)
+
+# /analyze/batch limits
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', '8'))
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', '200'))
+BATCH_MAX_CONTENT_LENGTH = int(os.environ.get('BATCH_MAX_CONTENT_LENGTH', str(256 * 1024 * 1024)))
+
+# Image preprocessing before provider calls (orientation, downscale, re-encode)
+IMAGE_PREPROCESS = os.environ.get('IMAGE_PREPROCESS', 'on').lower() != 'off'
+IMAGE_MAX_LONG_SIDE = int(os.environ.get('IMAGE_MAX_LONG_SIDE', '2048'))
+IMAGE_MAX_SHORT_SIDE = int(os.environ.get('IMAGE_MAX_SHORT_SIDE', '768'))
+IMAGE_OUTPUT_FORMAT = os.environ.get('IMAGE_OUTPUT_FORMAT', 'jpeg').upper()  # JPEG or WEBP
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '85'))
+# Crop to the detected tag region before downscaling; the full photo is sent when the
+# detection is not confident or the tag fills most of the photo anyway
+TAG_CROP = os.environ.get('TAG_CROP', 'off').lower() == 'on'
+TAG_CROP_MIN_CONFIDENCE = float(os.environ.get('TAG_CROP_MIN_CONFIDENCE', '0.6'))
+TAG_CROP_MAX_RATIO = float(os.environ.get('TAG_CROP_MAX_RATIO', '0.6'))
+
+crop_latency = LatencyTracker()
+# The web UI downscales photos to the same limits before uploading them
+CLIENT_DOWNSCALE = os.environ.get('CLIENT_DOWNSCALE', 'on').lower() != 'off'
+CLIENT_UPLOAD_QUALITY = int(os.environ.get('CLIENT_UPLOAD_QUALITY', str(IMAGE_QUALITY)))
+
+# Job mode: /analyze enqueues a job and returns its id, local worker threads run it
+JOB_MODE = os.environ.get('JOB_MODE', 'off').lower() == 'on'
+JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', os.path.join('cache', 'jobs.sqlite3'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '4'))  # per gunicorn worker process
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '300'))
+
+# Bulk mode: /bulk submits uploads as OpenAI Batch API jobs (results within 24h at batch
+# pricing, outside the interactive rate limits)
+BULK_ENABLED = os.environ.get('BULK', 'on').lower() != 'off' and bool(OPENAI_API_KEY)
+BULK_PATH = os.environ.get('BULK_PATH', os.path.join('cache', 'bulk.sqlite3'))
+BULK_STAGING_DIR = os.environ.get('BULK_STAGING_DIR', os.path.join('cache', 'bulk-staging'))
+BULK_POLL_SECONDS = float(os.environ.get('BULK_POLL_SECONDS', '60'))
+BULK_MAX_FILES = int(os.environ.get('BULK_MAX_FILES', '5000'))
+BULK_MAX_CONTENT_LENGTH = int(os.environ.get('BULK_MAX_CONTENT_LENGTH', str(1024 * 1024 * 1024)))
+OPENAI_BATCH_BASE_URL = os.environ.get('OPENAI_BATCH_BASE_URL', OPENAI_API_URL.rsplit('/chat/completions', 1)[0])
+
+# Result cache shared by all gunicorn workers through a SQLite file
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE', 'on').lower() != 'off'
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', os.path.join('cache', 'results.sqlite3'))
+RESULT_CACHE_MEMORY_ENTRIES = int(os.environ.get('RESULT_CACHE_MEMORY_ENTRIES', '256'))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get('RESULT_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+result_cache = None
+if RESULT_CACHE_ENABLED:
+    result_cache = ResultCache(RESULT_CACHE_PATH, RESULT_CACHE_MEMORY_ENTRIES,
+                               RESULT_CACHE_TTL_SECONDS, RESULT_CACHE_MAX_BYTES)
+
+# Coalesce concurrent analyses of the same upload (across workers) onto one provider call
+COALESCE_ENABLED = os.environ.get('COALESCE', 'on').lower() != 'off'
+COALESCE_PATH = os.environ.get('COALESCE_PATH', os.path.join('cache', 'singleflight.sqlite3'))
+COALESCE_LEASE_SECONDS = float(os.environ.get('COALESCE_LEASE_SECONDS', '90'))
+
+single_flight = SingleFlight(COALESCE_PATH, COALESCE_LEASE_SECONDS) if COALESCE_ENABLED else None
+
+# Searchable history of provider analyses, written off the request path
+HISTORY_ENABLED = os.environ.get('HISTORY', 'on').lower() != 'off'
+HISTORY_PATH = os.environ.get('HISTORY_PATH', os.path.join('cache', 'history.sqlite3'))
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+history_store = HistoryStore(HISTORY_PATH) if HISTORY_ENABLED else None
+history_writer = HistoryWriter(history_store) if history_store is not None else None
+
+# Near-duplicate reuse: perceptual hashes of analysed uploads, pointing at cached results
+NEAR_DUPLICATES_ENABLED = os.environ.get('NEAR_DUPLICATES', 'on').lower() != 'off'
+NEAR_DUPLICATE_PATH = os.environ.get('NEAR_DUPLICATE_PATH', os.path.join('cache', 'phash.sqlite3'))
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get('NEAR_DUPLICATE_DISTANCE', '6'))  # of 64 bits
+
+near_duplicates = None
+if NEAR_DUPLICATES_ENABLED and result_cache is not None:
+    near_duplicates = NearDuplicateIndex(NEAR_DUPLICATE_PATH, NEAR_DUPLICATE_DISTANCE)
+
+# Local pre-screen before provider calls:
+#   'advisory' - annotate results with the decision
+#   'blocking' - reject uploads that are clearly not tags without a provider call
+#   'off'      - skip it
+PRESCREEN_MODE = os.environ.get('PRESCREEN_MODE', 'advisory').lower()
+PRESCREEN_MIN_TEXT_REGIONS = float(os.environ.get('PRESCREEN_MIN_TEXT_REGIONS', '0.01'))
+PRESCREEN_MAX_ASPECT_RATIO = float(os.environ.get('PRESCREEN_MAX_ASPECT_RATIO', '8'))
+# Every decision as a JSON line, to measure precision against the provider answers
+PRESCREEN_LOG_PATH = os.environ.get('PRESCREEN_LOG_PATH', os.path.join('cache', 'prescreen.jsonl'))
+
+prescreen_log = DecisionLog(PRESCREEN_LOG_PATH) if PRESCREEN_MODE in ('advisory', 'blocking') else None
+
 @app.before_request
 def allow_healthcheck_host():
     """Allow Railway's health check hostname to prevent potential 400 errors."""
     if request.host == 'healthcheck.railway.app':
         pass  # Flask doesn't block by default, but this makes it explicit.
 
-def analyze_with_xai(base64_image):
-    """Analyze image with xAI Grok"""
-    url = "https://api.x.ai/v1/chat/completions"
-    
+@app.before_request
+def track_request_start():
+    g.metrics_endpoint = request.endpoint or "unknown"
+    metrics.HTTP_IN_FLIGHT.labels(g.metrics_endpoint).inc()
+
+@app.after_request
+def track_request_status(response):
+    metrics.HTTP_REQUESTS.labels(request.endpoint or "unknown", response.status_code).inc()
+    return response
+
+@app.teardown_request
+def track_request_end(exc):
+    # Runs after a streamed response has finished
+    if "metrics_endpoint" in g:
+        metrics.HTTP_IN_FLIGHT.labels(g.metrics_endpoint).dec()
+
+def provider_request(provider):
+    """URL, headers and model for a provider's chat-completions endpoint"""
+    if provider == CASCADE_PROVIDER:
+        url, headers, _ = provider_request("OpenAI")
+        return url, headers, CASCADE_MODEL
+    if provider == "xAI":
+        return XAI_API_URL, {
+            "Authorization": f"Bearer {XAI_API_KEY}",
+            "Content-Type": "application/json",
+            "User-Agent": "xAI-Client/1.0"  # Add user agent
+        }, XAI_MODEL
+    return OPENAI_API_URL, {
+        "Authorization": f"Bearer {OPENAI_API_KEY}",
+        "Content-Type": "application/json"
+    }, OPENAI_MODEL
+
+IMAGE_PLACEHOLDER = "__IMAGE_BASE64__"
+
+def build_chat_body(model, base64_image, mime_type="image/jpeg", stream=False, prompt=None, max_tokens=1000,
+                    response_format=None):
+    """JSON request body asking `model` to analyze the base64 image (ANALYSIS_PROMPT
+    unless another `prompt` is given, constrained by `response_format` if given).
+
+    `base64_image` and `mime_type` may also be lists, for several photos of one item
+    (see encode_photos()); each becomes an image_url part of the same message.
+
+    The base64 bytes are spliced into the serialized payload rather than embedded in
+    the dict and re-escaped by json.dumps, so each image is copied only once.
+    """
+    if isinstance(base64_image, list):
+        images, mime_types = base64_image, mime_type
+    else:
+        images, mime_types = [base64_image], [mime_type]
+    text = prompt or ANALYSIS_PROMPT
+    if len(images) > 1:
+        text = f"{MULTI_PHOTO_PROMPT.format(count=len(images))} {text}"
     payload = {
-        "model": "grok-1",  # Try different xAI model
+        "model": model,
         "messages": [
             {
                 "role": "user",
-                "content": [
-                    {"type": "text", "text": "Analyze this image of a military or vintage tag: extract text, identify the item, estimate age, historical context, and current market value. Format your response with clear sections for each analysis."},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
+                "content": [{"type": "text", "text": text}] + [
+                    {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{IMAGE_PLACEHOLDER}"}}
+                    for mime in mime_types
                 ]
             }
         ],
-        "max_tokens": 1000
-    }
-    headers = {
-        "Authorization": f"Bearer {XAI_API_KEY}",
-        "Content-Type": "application/json",
-        "User-Agent": "xAI-Client/1.0"  # Add user agent
+        "max_tokens": max_tokens
     }
+    if stream:
+        payload["stream"] = True
+    if response_format:
+        payload["response_format"] = response_format
+    parts = json.dumps(payload).encode('utf-8').split(IMAGE_PLACEHOLDER.encode('ascii'))
+    chunks = [parts[0]]
+    for image, part in zip(images, parts[1:]):
+        chunks.append(image.encode('ascii') if isinstance(image, str) else image)
+        chunks.append(part)
+    return b"".join(chunks)
+
+def provider_chat_body(provider, model, base64_image, mime_type="image/jpeg", stream=False):
+    """Request body for `provider`: the JSON schema in OUTPUT_MODE=json, and the short
+    prompt and token cap of the cascade tier"""
+    if STRUCTURED_OUTPUT:
+        max_tokens = CASCADE_MAX_TOKENS if provider == CASCADE_PROVIDER else STRUCTURED_MAX_TOKENS
+        return build_chat_body(model, base64_image, mime_type, stream, prompt=STRUCTURED_PROMPT,
+                               max_tokens=max_tokens, response_format=RESPONSE_FORMAT)
+    if provider == CASCADE_PROVIDER:
+        return build_chat_body(model, base64_image, mime_type, stream, prompt=CASCADE_PROMPT,
+                               max_tokens=CASCADE_MAX_TOKENS)
+    return build_chat_body(model, base64_image, mime_type, stream)
+
+def with_structured_fields(result):
+    """In OUTPUT_MODE=json, validate a successful result's JSON into typed `analysis`
+    fields (with a plain-text `result`); an invalid answer becomes a failed result"""
+    if not STRUCTURED_OUTPUT or not result["success"]:
+        return result
+    try:
+        fields = parse_analysis(result["result"])
+    except InvalidAnalysis as e:
+        print(f"❌ {result['provider']} returned invalid structured output: {e}")
+        metrics.INVALID_OUTPUTS.labels(result["provider"]).inc()
+        return {"success": False, "error": f"{result['provider']} returned invalid structured output: {e}"}
+    return dict(result, result=format_analysis(fields), analysis=fields)
+
+def xai_result(response):
+    """Turn an xAI chat-completions response into an analysis result dict"""
+    if response.status_code == 200:
+        result = response.json()["choices"][0]["message"]["content"]
+        return with_structured_fields({"success": True, "result": result, "provider": "xAI"})
+    elif response.status_code == 401:
+        print(f"❌ xAI: Invalid API key")
+        return {"success": False, "error": "Invalid xAI API key. Please check your xAI API key."}
+    elif response.status_code == 429:
+        print(f"❌ xAI: Rate limit exceeded")
+        return {"success": False, "error": "xAI rate limit exceeded. Falling back to OpenAI...", "rate_limited": True}
+    else:
+        print(f"❌ xAI: HTTP {response.status_code}")
+        try:
+            # Try to parse JSON, but handle cases where it's not JSON
+            error_data = response.json()
+            if isinstance(error_data, dict):
+                error_message = error_data.get('error', {}).get('message', str(error_data))
+            else:
+                error_message = str(error_data)
+        except json.JSONDecodeError:
+            error_message = response.text if response.text else 'Unknown error with no body.'
+        
+        print(f"❌ xAI Error: {error_message}")
+        return {"success": False, "error": f"xAI API Error ({response.status_code}): {error_message}"}
+
+def openai_result(response):
+    """Turn an OpenAI chat-completions response into an analysis result dict"""
+    if response.status_code == 200:
+        result = response.json()["choices"][0]["message"]["content"]
+        return with_structured_fields({"success": True, "result": result, "provider": "OpenAI"})
+    elif response.status_code == 429:
+        print(f"❌ OpenAI: Rate limit exceeded")
+        return {"success": False, "error": "Rate limit exceeded. Please try again in a few minutes.", "rate_limited": True}
+    elif response.status_code == 401:
+        print(f"❌ OpenAI: Invalid API key")
+        return {"success": False, "error": "Invalid API key. Please check your OpenAI API key."}
+    elif response.status_code == 402:
+        print(f"❌ OpenAI: Payment required")
+        return {"success": False, "error": "Payment required. Please add billing information to your OpenAI account."}
+    else:
+        print(f"❌ OpenAI: HTTP {response.status_code}")
+        error_data = response.json()
+        error_message = error_data.get('error', {}).get('message', 'Unknown error')
+        print(f"❌ OpenAI Error: {error_message}")
+        return {"success": False, "error": f"OpenAI API Error ({response.status_code}): {error_message}"}
+
+def analyze_with_xai(base64_image, mime_type="image/jpeg"):
+    """Analyze image with xAI Grok"""
+    url, headers, model = provider_request("xAI")
+    body = provider_chat_body("xAI", model, base64_image, mime_type)
     
     try:
         print(f"🔍 Trying xAI API call...")
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
+        response = provider_client.post(url, headers=headers, data=body, timeout=30)
         print(f"📡 xAI Response Status: {response.status_code}")
-        
-        if response.status_code == 200:
-            result = response.json()["choices"][0]["message"]["content"]
-            print(f"✅ xAI analysis successful")
-            return {"success": True, "result": result, "provider": "xAI"}
-        elif response.status_code == 401:
-            print(f"❌ xAI: Invalid API key")
-            return {"success": False, "error": "Invalid xAI API key. Please check your xAI API key."}
-        elif response.status_code == 429:
-            print(f"❌ xAI: Rate limit exceeded")
-            return {"success": False, "error": "xAI rate limit exceeded. Falling back to OpenAI..."}
-        else:
-            print(f"❌ xAI: HTTP {response.status_code}")
-            try:
-                # Try to parse JSON, but handle cases where it's not JSON
-                error_data = response.json()
-                if isinstance(error_data, dict):
-                    error_message = error_data.get('error', {}).get('message', str(error_data))
-                else:
-                    error_message = str(error_data)
-            except json.JSONDecodeError:
-                error_message = response.text if response.text else 'Unknown error with no body.'
-            
-            print(f"❌ xAI Error: {error_message}")
-            return {"success": False, "error": f"xAI API Error ({response.status_code}): {error_message}"}
+        metrics.PROVIDER_RESPONSES.labels("xAI", response.status_code).inc()
+        return xai_result(response)
             
     except requests.exceptions.Timeout:
         print(f"❌ xAI: Request timeout")
+        metrics.PROVIDER_RESPONSES.labels("xAI", "timeout").inc()
         return {"success": False, "error": "xAI request timed out. Falling back to OpenAI..."}
     except requests.exceptions.RequestException as e:
         print(f"❌ xAI: Network error - {e}")
+        metrics.PROVIDER_RESPONSES.labels("xAI", "network_error").inc()
         return {"success": False, "error": f"xAI network error: {e}. Falling back to OpenAI..."}
     except Exception as e:
         print(f"❌ xAI: Unexpected error - {e}")
         return {"success": False, "error": f"xAI unexpected error: {e}. Falling back to OpenAI..."}
 
-def analyze_with_openai(base64_image):
+def analyze_with_openai(base64_image, mime_type="image/jpeg"):
     """Analyze image with OpenAI GPT-4o"""
-    url = "https://api.openai.com/v1/chat/completions"
-    
-    payload = {
-        "model": "gpt-4o",
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": "Analyze this image of a military or vintage tag: extract text, identify the item, estimate age, historical context, and current market value. Format your response with clear sections for each analysis."},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                ]
-            }
-        ],
-        "max_tokens": 1000
-    }
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
+    url, headers, model = provider_request("OpenAI")
+    body = provider_chat_body("OpenAI", model, base64_image, mime_type)
     
     try:
         print(f"🔍 Trying OpenAI API call...")
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
+        response = provider_client.post(url, headers=headers, data=body, timeout=30)
         print(f"📡 OpenAI Response Status: {response.status_code}")
-        
-        if response.status_code == 200:
-            result = response.json()["choices"][0]["message"]["content"]
-            print(f"✅ OpenAI analysis successful")
-            return {"success": True, "result": result, "provider": "OpenAI"}
-        elif response.status_code == 429:
-            print(f"❌ OpenAI: Rate limit exceeded")
-            return {"success": False, "error": "Rate limit exceeded. Please try again in a few minutes."}
-        elif response.status_code == 401:
-            print(f"❌ OpenAI: Invalid API key")
-            return {"success": False, "error": "Invalid API key. Please check your OpenAI API key."}
-        elif response.status_code == 402:
-            print(f"❌ OpenAI: Payment required")
-            return {"success": False, "error": "Payment required. Please add billing information to your OpenAI account."}
-        else:
-            print(f"❌ OpenAI: HTTP {response.status_code}")
-            error_data = response.json()
-            error_message = error_data.get('error', {}).get('message', 'Unknown error')
-            print(f"❌ OpenAI Error: {error_message}")
-            return {"success": False, "error": f"OpenAI API Error ({response.status_code}): {error_message}"}
+        metrics.PROVIDER_RESPONSES.labels("OpenAI", response.status_code).inc()
+        return openai_result(response)
             
     except requests.exceptions.Timeout:
         print(f"❌ OpenAI: Request timeout")
+        metrics.PROVIDER_RESPONSES.labels("OpenAI", "timeout").inc()
         return {"success": False, "error": "Request timed out. Please try again."}
     except requests.exceptions.RequestException as e:
         print(f"❌ OpenAI: Network error - {e}")
+        metrics.PROVIDER_RESPONSES.labels("OpenAI", "network_error").inc()
         return {"success": False, "error": f"Network error: {e}"}
     except Exception as e:
         print(f"❌ OpenAI: Unexpected error - {e}")
         return {"success": False, "error": f"Unexpected error: {e}"}
 
+def cascade_result(response):
+    """openai_result() for the cascade tier, tagged with its model"""
+    result = openai_result(response)
+    if result["success"]:
+        result["model"] = CASCADE_MODEL
+    return result
+
+def analyze_with_cascade_model(base64_image, mime_type="image/jpeg"):
+    """First cascade tier: the cheap OpenAI model with the short structured prompt"""
+    url, headers, model = provider_request(CASCADE_PROVIDER)
+    body = provider_chat_body(CASCADE_PROVIDER, model, base64_image, mime_type)
+    
+    try:
+        print(f"🔍 Trying OpenAI {CASCADE_MODEL} API call...")
+        response = provider_client.post(url, headers=headers, data=body, timeout=30)
+        print(f"📡 OpenAI {CASCADE_MODEL} Response Status: {response.status_code}")
+        metrics.PROVIDER_RESPONSES.labels(CASCADE_PROVIDER, response.status_code).inc()
+        return cascade_result(response)
+    except requests.exceptions.Timeout:
+        metrics.PROVIDER_RESPONSES.labels(CASCADE_PROVIDER, "timeout").inc()
+        return {"success": False, "error": f"OpenAI {CASCADE_MODEL} request timed out."}
+    except requests.exceptions.RequestException as e:
+        metrics.PROVIDER_RESPONSES.labels(CASCADE_PROVIDER, "network_error").inc()
+        return {"success": False, "error": f"OpenAI {CASCADE_MODEL} network error: {e}"}
+    except Exception as e:
+        return {"success": False, "error": f"OpenAI {CASCADE_MODEL} unexpected error: {e}"}
+
+PROVIDERS = {
+    "xAI": analyze_with_xai,
+    "OpenAI": analyze_with_openai,
+    CASCADE_PROVIDER: analyze_with_cascade_model,  # only called by run_cascade
+}
+PROVIDER_PREFERENCE = ["xAI", "OpenAI"]
+
+def shed_result(provider):
+    print(f"🚦 {provider} quota exhausted, shedding the call")
+    metrics.PROVIDER_RESPONSES.labels(provider, "shed").inc()
+    return {"success": False, "error": f"{provider} rate limit reached, skipping", "skipped": True, "shed": True}
+
+def quota_bucket(provider):
+    """Rate-limit bucket a provider's calls are charged to"""
+    return QUOTA_BUCKETS.get(provider, provider)
+
+def acquire_quota(provider):
+    """Wait briefly for `provider` quota; False when the call should be shed"""
+    if rate_limiter is None:
+        return True
+    return rate_limiter.acquire(quota_bucket(provider), RATE_LIMIT_TOKENS_PER_REQUEST, RATE_LIMIT_MAX_WAIT_SECONDS)
+
+def record_rate_limited(provider, result):
+    """Pause every worker's calls to a provider that answered 429 despite retries"""
+    if rate_limiter is not None and result.get("rate_limited"):
+        print(f"🚦 {provider} returned 429, pausing it for {RATE_LIMIT_COOLDOWN_SECONDS:.0f}s")
+        rate_limiter.penalize(quota_bucket(provider), RATE_LIMIT_COOLDOWN_SECONDS)
+
+def circuit_open_result(provider):
+    metrics.PROVIDER_RESPONSES.labels(provider, "circuit_open").inc()
+    return {"success": False, "error": f"{provider} circuit is open, skipping", "skipped": True}
+
+def record_provider_outcome(provider, result, elapsed):
+    """Feed a finished provider call into the circuit breaker, rate limiter, latency
+    tracker and metrics"""
+    circuit_breaker.record(provider, result["success"], elapsed, result.get("error"))
+    record_rate_limited(provider, result)
+    if result["success"]:
+        latency_tracker.record(provider, elapsed)
+    metrics.PROVIDER_LATENCY.labels(provider, "success" if result["success"] else "error").observe(elapsed)
+
+def call_provider(provider, base64_image, mime_type="image/jpeg"):
+    """Call a provider through its circuit breaker and shared quota, recording outcome
+    and latency"""
+    if not circuit_breaker.allow(provider):
+        return circuit_open_result(provider)
+    if not acquire_quota(provider):
+        circuit_breaker.release(provider)
+        return shed_result(provider)
+    started = time.monotonic()
+    with metrics.PROVIDER_IN_FLIGHT.labels(provider).track_inprogress():
+        result = PROVIDERS[provider](base64_image, mime_type)
+    record_provider_outcome(provider, result, time.monotonic() - started)
+    return result
+
+def route_providers():
+    """Providers in current route order: healthy first, open circuits left out"""
+    return circuit_breaker.route(PROVIDER_PREFERENCE)
+
+def current_hedge_delay(provider="xAI"):
+    """Hedge delay in seconds for the primary provider"""
+    if HEDGE_MODE == 'parallel':
+        return 0
+    return hedge_delay(latency_tracker, provider, HEDGE_PERCENTILE, HEDGE_DELAY_SECONDS,
+                       HEDGE_MIN_DELAY_SECONDS, HEDGE_MAX_DELAY_SECONDS)
+
+def run_providers(base64_image, mime_type="image/jpeg"):
+    """Run the providers in route order according to HEDGE_MODE and return the first
+    successful result.
+
+    Returns the last failure when no provider succeeds.
+    """
+    order = route_providers()
+    if not order:
+        print(f"🔴 All provider circuits are open")
+        return {"success": False, "error": "All providers are unavailable (circuits open)"}
+    
+    if HEDGE_MODE == 'off' or len(order) == 1:
+        result = call_provider(order[0], base64_image, mime_type)
+        for previous, provider in zip(order, order[1:]):
+            if result["success"]:
+                break
+            print(f"❌ {previous} failed: {result['error']}")
+            print(f"🔄 Falling back to {provider}...")
+            result = call_provider(provider, base64_image, mime_type)
+            if result["success"]:
+                metrics.FALLBACKS.labels(order[0], provider).inc()
+        return result
+
+    primary, secondary = order[:2]
+    result, failures = hedged_runner.run(
+        (primary, lambda: call_provider(primary, base64_image, mime_type)),
+        (secondary, lambda: call_provider(secondary, base64_image, mime_type)),
+        current_hedge_delay(primary),
+    )
+    for provider, failure in failures:
+        print(f"❌ {provider} failed: {failure['error']}")
+    if result is None:
+        return failures[-1][1]
+    count_hedge_outcome(primary, result, [provider for provider, _ in failures])
+    return result
+
+def count_hedge_outcome(primary, result, failed):
+    if result["hedged"]:
+        metrics.HEDGES.inc()
+    if primary in failed:
+        metrics.FALLBACKS.labels(primary, result["provider"]).inc()
+
+def run_cascade(base64_image, mime_type="image/jpeg"):
+    """Try the cheap model first and escalate to run_providers() (the full models) only
+    when its answer's confidence signals are weak.
+
+    The result carries a `cascade` dict with the tier that answered, the escalation
+    reasons and per-tier latency.
+    """
+    started = time.monotonic()
+    first = call_provider(CASCADE_PROVIDER, base64_image, mime_type)
+    first_elapsed = time.monotonic() - started
+    reasons = judge_first_tier(first, first_elapsed)
+    if not reasons:
+        return first
+    
+    started = time.monotonic()
+    result = run_providers(base64_image, mime_type)
+    return escalated_result(first, result, reasons, first_elapsed, time.monotonic() - started)
+
+def judge_first_tier(first, elapsed):
+    """Escalation reasons for a first-tier result; an accepted result (no reasons) gets
+    its `cascade` dict here"""
+    record_cascade_tier("mini", elapsed)
+    if first["success"]:
+        if "analysis" in first:
+            assessment = assess_structured(first["analysis"], CASCADE_MIN_CONFIDENCE)
+        else:
+            assessment = assess(first["result"], CASCADE_MIN_CONFIDENCE)
+        if not assessment["reasons"]:
+            record_cascade_outcome("accepted")
+            first["cascade"] = {"tier": "mini", "escalated": False, "confidence": assessment["confidence"],
+                                "tier_latency": {"mini": round(elapsed, 3)}}
+            return []
+        reasons = assessment["reasons"]
+    else:
+        reasons = [f"{CASCADE_MODEL} failed: {first['error']}"]
+    print(f"🪜 Escalating from {CASCADE_MODEL}: {'; '.join(reasons)}")
+    record_cascade_outcome("escalated")
+    return reasons
+
+def escalated_result(first, result, reasons, first_elapsed, full_elapsed):
+    record_cascade_tier("full", full_elapsed)
+    if not result["success"] and first["success"]:
+        # A weak answer beats the demo analysis
+        print(f"⚠️ Full models failed, keeping the {CASCADE_MODEL} answer")
+        result = dict(first, full_error=result["error"])
+    result["cascade"] = {"tier": "mini" if "full_error" in result else "full", "escalated": True,
+                         "reasons": reasons,
+                         "tier_latency": {"mini": round(first_elapsed, 3), "full": round(full_elapsed, 3)}}
+    return result
+
+def record_cascade_tier(tier, elapsed):
+    cascade_latency.record(tier, elapsed)
+    metrics.CASCADE_TIER_LATENCY.labels(tier).observe(elapsed)
+
+def record_cascade_outcome(outcome):
+    with cascade_counts_lock:
+        cascade_counts[outcome] += 1
+    metrics.CASCADE_OUTCOMES.labels(outcome).inc()
+
+def cascade_snapshot():
+    """Per-tier latency percentiles and the escalation rate seen by this worker"""
+    with cascade_counts_lock:
+        counts = dict(cascade_counts)
+    total = counts["accepted"] + counts["escalated"]
+    return {
+        "model": CASCADE_MODEL,
+        "min_confidence": CASCADE_MIN_CONFIDENCE,
+        "counts": counts,
+        "escalation_rate": round(counts["escalated"] / total, 3) if total else None,
+        "tier_latency": cascade_latency.snapshot(),
+    }
+
 def create_mock_analysis(filename):
     """Create a realistic mock analysis based on the filename"""
     if "towel" in filename.lower():
@@ -230,10 +735,25 @@ def create_mock_analysis(filename):
 - [Recommendations for preservation]"""
         }
 
+def client_upload_limits():
+    """Downscaling the page applies before upload (per CLIENT_DOWNSCALE), or None.
+
+    With TAG_CROP the bounds are doubled, so that a tag covering a quarter of the photo
+    still fills the provider limits after the server crops it, rather than keeping only
+    the pixels left by a full-frame downscale.
+    """
+    if not CLIENT_DOWNSCALE:
+        return None
+    scale = 2 if TAG_CROP else 1
+    return {"max_long_side": IMAGE_MAX_LONG_SIDE * scale, "max_short_side": IMAGE_MAX_SHORT_SIDE * scale,
+            "quality": CLIENT_UPLOAD_QUALITY}
+
 @app.route('/')
 def index():
     try:
-        return render_template('index.html')
+        # Job mode queues single photos only
+        return render_template('index.html', job_mode=JOB_MODE, max_photos=1 if JOB_MODE else MAX_PHOTOS_PER_ITEM,
+                               upload_limits=client_upload_limits())
     except Exception as e:
         print(f"❌ Template error: {e}")
         # Fallback HTML response
@@ -322,58 +842,799 @@ def index():
         """
         return fallback_html
 
+def upload_filename(file):
+    """Timestamped, sanitised name an upload is stored and reported under"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{timestamp}_{secure_filename(file.filename)}"
+
+def read_upload(file):
+    """Read an upload into memory, persist it per UPLOAD_PERSIST_MODE and return (filename, bytes)"""
+    filename = upload_filename(file)
+    image_bytes = file.read()
+    return filename, persist_upload(filename, image_bytes)
+
+def persist_upload(filename, image_bytes):
+    """Count an upload and store it per UPLOAD_PERSIST_MODE; returns its bytes"""
+    metrics.UPLOAD_BYTES.observe(len(image_bytes))
+    if UPLOAD_PERSIST_MODE == 'sync':
+        upload_store.put(filename, image_bytes)
+    elif upload_writer is not None:
+        upload_writer.submit(filename, image_bytes)
+    return image_bytes
+
+def read_item_upload(files):
+    """read_upload() for the photos of one item: (first photo's filename, its bytes,
+    list of the other photos' bytes)"""
+    uploads = [read_upload(file) for file in files]
+    filename, image_bytes = uploads[0]
+    return filename, image_bytes, [photo for _, photo in uploads[1:]]
+
+def begin_allocation_tracking():
+    """Reset the tracemalloc peak and return the currently traced bytes as a baseline"""
+    if not TRACK_ALLOCATIONS:
+        return None
+    tracemalloc.reset_peak()
+    current, _ = tracemalloc.get_traced_memory()
+    return current
+
+def with_allocation_report(result, baseline):
+    """Add the peak bytes allocated above `baseline` to the result.
+
+    tracemalloc is process-wide, so concurrent requests in the same worker are included.
+    """
+    if baseline is None:
+        return result
+    _, peak = tracemalloc.get_traced_memory()
+    result["peak_alloc_bytes"] = peak - baseline
+    print(f"📏 Peak allocation for {result.get('filename')}: {(peak - baseline) / 1024:.0f} KiB")
+    return result
+
+
+def encode_for_provider(filename, image_bytes):
+    """Preprocess (per IMAGE_PREPROCESS) and base64-encode an upload; returns (base64 bytes,
+    mime type, tag crop detection or None)"""
+    crop = None
+    if IMAGE_PREPROCESS:
+        image_bytes, mime_type, info = prepare_image(image_bytes, IMAGE_MAX_LONG_SIDE, IMAGE_MAX_SHORT_SIDE,
+                                                     IMAGE_OUTPUT_FORMAT, IMAGE_QUALITY, TAG_CROP,
+                                                     TAG_CROP_MIN_CONFIDENCE, TAG_CROP_MAX_RATIO)
+        crop = info.get("crop")
+        if crop is not None:
+            metrics.CROP_RATIO.observe(crop["ratio"] if crop["applied"] else 1.0)
+            if crop["applied"]:
+                print(f"✂️ Cropped {filename} to its tag: {crop['ratio']:.0%} of the photo "
+                      f"(confidence {crop['confidence']:.2f})")
+            else:
+                print(f"✂️ Not cropping {filename}: {crop['reason']}")
+        if info["processed"]:
+            print(f"🖼️ Preprocessed {filename}: {info['original_bytes']} → {info['bytes']} bytes, "
+                  f"{info['original_size'][0]}x{info['original_size'][1]} → {info['size'][0]}x{info['size'][1]} "
+                  f"({info['original_mime']} → {mime_type})")
+        else:
+            print(f"🖼️ Sending {filename} unchanged: {info['bytes']} bytes ({mime_type})")
+    else:
+        mime_type = sniff_mime_type(image_bytes) or "image/jpeg"
+    metrics.ENCODED_BYTES.observe(len(image_bytes))
+    return base64.b64encode(image_bytes), mime_type, crop
+
+def encode_photos(filename, photos):
+    """encode_for_provider() for the photos of one item: (base64, mime type, crops) for a
+    single photo, (list of base64, list of mime types, crops) for several; `crops` lists
+    each photo's tag crop detection"""
+    encoded = [encode_for_provider(filename, photo) for photo in photos]
+    crops = [crop for _, _, crop in encoded]
+    if len(encoded) == 1:
+        return encoded[0][0], encoded[0][1], crops
+    return [b64 for b64, _, _ in encoded], [mime for _, mime, _ in encoded], crops
+
+def with_crop_report(result, crops, elapsed):
+    """Add the tag crop detection to a result and record the provider latency of cropped
+    and uncropped uploads (per TAG_CROP)"""
+    if not TAG_CROP or crops[0] is None:
+        return result
+    image = "cropped" if any(crop["applied"] for crop in crops) else "full"
+    if result["success"]:
+        crop_latency.record(image, elapsed)
+        metrics.CROP_PROVIDER_LATENCY.labels(image).observe(elapsed)
+    result["crop"] = crops[0] if len(crops) == 1 else crops
+    return result
+
+def crop_snapshot():
+    """Provider latency percentiles of cropped and uncropped uploads, and the p50 delta
+    (negative when cropped uploads are answered faster)"""
+    latency = crop_latency.snapshot()
+    cropped, full = crop_latency.percentile("cropped", 50), crop_latency.percentile("full", 50)
+    return {
+        "min_confidence": TAG_CROP_MIN_CONFIDENCE,
+        "latency": latency,
+        "p50_delta": round(cropped - full, 3) if cropped is not None and full is not None else None,
+    }
+
+def analysis_config():
+    """(prompt, models): everything besides the image that an analysis depends on"""
+    prompt, models = ANALYSIS_PROMPT, f"{XAI_MODEL}|{OPENAI_MODEL}"
+    if STRUCTURED_OUTPUT:
+        prompt = f"{STRUCTURED_PROMPT}\0{json.dumps(RESPONSE_FORMAT, sort_keys=True)}"
+    if CASCADE_ENABLED:
+        prompt = f"{CASCADE_PROMPT}\0{prompt}"
+        models = f"{CASCADE_MODEL}|{models}|{CASCADE_MIN_CONFIDENCE}"
+    return prompt, models
+
+def analysis_cache_key(image_bytes, extra_photos=()):
+    if extra_photos:
+        # Photos of one item: the key covers every photo, in order
+        image_bytes = b"".join(hashlib.sha256(photo).digest() for photo in (image_bytes, *extra_photos))
+    return make_key(image_bytes, *analysis_config())
+
+def analysis_scope():
+    """Near-duplicate scope of the current configuration, so a hit is never a result
+    produced under another output mode, prompt or cascade setting"""
+    return hashlib.sha256("\0".join(analysis_config()).encode("utf-8")).hexdigest()
+
+def lookup_cached(cache_key, filename):
+    """Return the cached result marked as a cache hit, or None"""
+    if result_cache is None:
+        return None
+    started = time.monotonic()
+    cached, tier = result_cache.get(cache_key)
+    if cached is None:
+        return None
+    print(f"⚡ Cache hit ({tier}) for {filename}")
+    cached.update({
+        "cached": True,
+        "cache_tier": tier,
+        "elapsed": round(time.monotonic() - started, 4),
+        "filename": filename,
+    })
+    return cached
+
+def lookup_similar(image_bytes, filename):
+    """Return (result, image_hash): the cached result of a near-duplicate upload (or None)
+    and this upload's perceptual hash for store_cached()"""
+    if near_duplicates is None:
+        return None, None
+    started = time.monotonic()
+    image_hash = dhash(image_bytes)
+    if image_hash is None:
+        return None, None
+    for distance, key in near_duplicates.search(image_hash, scope=analysis_scope()):
+        cached, tier = result_cache.get(key)
+        if cached is None:
+            near_duplicates.remove(key)  # its result has been evicted
+            continue
+        print(f"⚡ Near-duplicate hit (distance {distance}) for {filename}")
+        cached.update({
+            "cached": True,
+            "cache_tier": "similar",
+            "near_duplicate": {"distance": distance, "max_distance": NEAR_DUPLICATE_DISTANCE},
+            "elapsed": round(time.monotonic() - started, 4),
+            "filename": filename,
+        })
+        return cached, image_hash
+    return None, image_hash
+
+def lookup_analysis(cache_key, image_bytes, filename, reuse_similar=True):
+    """Exact then (unless `reuse_similar` is off) near-duplicate lookup, counted in the
+    cache metrics; returns (cached result or None, image hash for store_cached()).
+
+    Multi-photo items pass `image_bytes=None`: they are only looked up exactly.
+    """
+    cached = lookup_cached(cache_key, filename)
+    if cached is not None:
+        metrics.CACHE_LOOKUPS.labels(cached["cache_tier"]).inc()
+        return cached, None
+    similar, image_hash = lookup_similar(image_bytes, filename) if image_bytes is not None else (None, None)
+    if similar is not None and reuse_similar:
+        metrics.CACHE_LOOKUPS.labels("similar").inc()
+        return similar, image_hash
+    metrics.CACHE_LOOKUPS.labels("miss").inc()
+    return None, image_hash
+
+def store_cached(cache_key, result, image_hash=None):
+    if result_cache is not None:
+        entry = {"success": True, "result": result["result"], "provider": result["provider"]}
+        if "analysis" in result:
+            entry["analysis"] = result["analysis"]
+        result_cache.set(cache_key, entry)
+        if near_duplicates is not None and image_hash is not None:
+            near_duplicates.add(image_hash, cache_key, analysis_scope())
+
+def record_history(filename, image_bytes, result, elapsed, image_sha256=None):
+    """Queue a provider analysis for the history store (never blocks the request); pass
+    `image_sha256` instead of the bytes when they are no longer at hand"""
+    if history_writer is not None:
+        history_writer.submit({
+            "filename": filename,
+            "image_hash": image_sha256 or hashlib.sha256(image_bytes).hexdigest(),
+            "provider": result["provider"],
+            "result": result["result"],
+            "elapsed": round(elapsed, 3),
+            "hedged": bool(result.get("hedged")),
+            "analysis": json.dumps(result["analysis"]) if "analysis" in result else None,
+        })
+
+def prescreen_upload(filename, image_bytes):
+    """Pre-screen decision for an upload (logged and counted), or None when PRESCREEN_MODE
+    is off; `blocked` is set when the upload must not reach a provider"""
+    if prescreen_log is None:
+        return None
+    screening = screen_image(image_bytes, PRESCREEN_MIN_TEXT_REGIONS, PRESCREEN_MAX_ASPECT_RATIO)
+    screening["blocked"] = PRESCREEN_MODE == 'blocking' and screening["decision"] == "not_tag"
+    detail = f" ({'; '.join(screening['reasons'])})" if screening["reasons"] else ""
+    print(f"🧐 Pre-screen for {filename}: {screening['decision']}{detail} in {screening['elapsed_ms']} ms"
+          f"{' - blocked' if screening['blocked'] else ''}")
+    metrics.PRESCREEN_DECISIONS.labels(screening["decision"], PRESCREEN_MODE).inc()
+    prescreen_log.write(dict(screening, filename=filename, mode=PRESCREEN_MODE,
+                             image_hash=hashlib.sha256(image_bytes).hexdigest()))
+    return screening
+
+def prescreen_photos(filename, photos):
+    """prescreen_upload() for the photos of one item: an item is a tag when any photo is,
+    and blocked only when every photo is"""
+    screenings = [prescreen_upload(filename, photo) for photo in photos]
+    if len(screenings) == 1 or screenings[0] is None:
+        return screenings[0]
+    not_tag = all(screening["decision"] == "not_tag" for screening in screenings)
+    return {
+        "decision": "not_tag" if not_tag else "tag",
+        "reasons": [f"photo {i}: {reason}" for i, screening in enumerate(screenings, 1)
+                    for reason in screening["reasons"]] if not_tag else [],
+        "blocked": all(screening["blocked"] for screening in screenings),
+        "elapsed_ms": round(sum(screening["elapsed_ms"] for screening in screenings), 2),
+        "photos": screenings,
+    }
+
+def prescreen_rejection(filename, screening):
+    """Result for an upload blocked by the pre-screen"""
+    return {
+        "success": False,
+        "error": f"This doesn't look like a tag or label ({'; '.join(screening['reasons'])}). "
+                 f"Analyze it anyway to ask the AI providers.",
+        "prescreen": screening,
+        "filename": filename,
+    }
+
+def run_coalesced(cache_key, fn):
+    """(fn() result, coalesced): at most one fn() per cache key runs at a time across
+    workers; duplicates get a copy of its result marked `coalesced`"""
+    if single_flight is None:
+        return fn(), False
+    result, shared = single_flight.do(cache_key, fn)
+    if shared:
+        print(f"🔗 Coalesced with an in-flight analysis of the same upload")
+        metrics.COALESCED.inc()
+        result = dict(result, coalesced=True)
+    return result, shared
+
+def analyze_image(filename, image_bytes, demo_fallback=True, reuse_similar=True, screen=True, extra_photos=()):
+    """Analyze one upload: result cache, near-duplicates, the local pre-screen, then
+    providers, then (optionally) the demo analysis.
+
+    Returns the JSON-ready result dict; without `demo_fallback` a provider failure is
+    returned as {"success": False, "error": ...}. Without `reuse_similar` only an exact
+    cache hit is reused; without `screen` the pre-screen is skipped. `extra_photos` are
+    further photos of the same item, analysed together with `image_bytes` in one
+    provider request (such items skip the near-duplicate lookup).
+    """
+    started = time.monotonic()
+    photos = [image_bytes, *extra_photos]
+    # Serve repeated uploads and re-shots of an already analysed tag from the result cache
+    cache_key = analysis_cache_key(image_bytes, extra_photos)
+    cached, image_hash = lookup_analysis(cache_key, None if extra_photos else image_bytes, filename, reuse_similar)
+    if cached is not None:
+        return cached
+    
+    # Obvious non-tags are flagged (or rejected, per PRESCREEN_MODE) before any provider call
+    screening = prescreen_photos(filename, photos) if screen else None
+    if screening is not None and screening["blocked"]:
+        return prescreen_rejection(filename, screening)
+    
+    def analyze_with_providers():
+        # Downscale/re-encode and encode the image(s)
+        base64_image, mime_type, crops = encode_photos(filename, photos)
+        
+        # Cheap model first (per CASCADE), then the providers in route order (hedged or
+        # serial fallback)
+        print(f"🔄 Starting analysis for {filename}")
+        provider_started = time.monotonic()
+        if CASCADE_ENABLED:
+            result = run_cascade(base64_image, mime_type)
+        else:
+            result = run_providers(base64_image, mime_type)
+        return with_crop_report(result, crops, time.monotonic() - provider_started)
+    
+    # Identical uploads in flight elsewhere wait for that call instead of making their own
+    result, coalesced = run_coalesced(cache_key, analyze_with_providers)
+    
+    if not result["success"]:
+        if demo_fallback:
+            print(f"🔄 Using demo analysis...")
+            # Final fallback to mock analysis
+            result = create_mock_analysis(filename)
+            result["demo"] = True
+            metrics.DEMO_RESULTS.inc()
+    else:
+        print(f"✅ {result['provider']} analysis successful")
+        if not coalesced:
+            store_cached(cache_key, result, image_hash)
+            record_history(filename, image_bytes, result, time.monotonic() - started)
+    
+    result["cached"] = False
+    result["filename"] = filename
+    if extra_photos:
+        result["photos"] = len(photos)
+    if screening is not None:
+        result["prescreen"] = screening
+    return result
+
+job_queue = None
+if JOB_MODE:
+    job_queue = JobQueue(JOB_QUEUE_PATH, lease_seconds=JOB_LEASE_SECONDS)
+    if JOB_WORKERS > 0:
+        # Near-duplicates are checked before a job is queued (unless `fresh` was asked for)
+        # and so is the pre-screen
+        JobWorkerPool(job_queue, lambda filename, image_bytes: analyze_image(filename, image_bytes, reuse_similar=False,
+                                                                             screen=False),
+                      workers=JOB_WORKERS)
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     try:
+        alloc_baseline = begin_allocation_tracking()
+        
         if 'file' not in request.files:
             return jsonify({"success": False, "error": "No file uploaded"})
         
-        file = request.files['file']
-        if file.filename == '':
+        # Several `file` fields are photos of the same item (front, back, care label)
+        files = [f for f in request.files.getlist('file') if f.filename]
+        if not files:
             return jsonify({"success": False, "error": "No file selected"})
+        if len(files) > MAX_PHOTOS_PER_ITEM:
+            return jsonify({"success": False, "error": f"Too many photos ({len(files)}); the limit is {MAX_PHOTOS_PER_ITEM} per item"})
         
-        if file:
-            # Save the uploaded file
-            filename = secure_filename(file.filename)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{timestamp}_{filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
+        if files:
+            # Read the uploads (persisted per UPLOAD_PERSIST_MODE)
+            filename, image_bytes, extra_photos = read_item_upload(files)
+            # `fresh=1` asks for a new analysis even when a near-duplicate was analysed before
+            # or the pre-screen would block the upload
+            reuse_similar = request.form.get('fresh') != '1'
             
-            # Encode the image
-            with open(filepath, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+            if job_queue is not None and extra_photos:
+                return jsonify({"success": False, "error": "Multi-photo items are not supported in job mode"}), 400
+            if job_queue is not None:
+                # Answer cache hits directly, queue everything else
+                cached = lookup_cached(analysis_cache_key(image_bytes), filename)
+                if cached is None and reuse_similar:
+                    cached, _ = lookup_similar(image_bytes, filename)
+                if cached is not None:
+                    return jsonify(cached)
+                screening = prescreen_upload(filename, image_bytes) if reuse_similar else None
+                if screening is not None and screening["blocked"]:
+                    return jsonify(prescreen_rejection(filename, screening))
+                job_id = job_queue.enqueue(filename, image_bytes)
+                print(f"📥 Queued job {job_id} for {filename}")
+                return jsonify({"success": True, "job_id": job_id, "status": "queued",
+                                "status_url": f"/jobs/{job_id}", "filename": filename}), 202
             
-            # Try xAI first, then fallback to OpenAI
-            print(f"🔄 Starting analysis for {filename}")
-            result = analyze_with_xai(base64_image)
-            
-            if not result["success"]:
-                print(f"❌ xAI failed: {result['error']}")
-                print(f"🔄 Falling back to OpenAI...")
-                # Fallback to OpenAI
-                result = analyze_with_openai(base64_image)
-                
-                if not result["success"]:
-                    print(f"❌ OpenAI failed: {result['error']}")
-                    print(f"🔄 Using demo analysis...")
-                    # Final fallback to mock analysis
-                    result = create_mock_analysis(filename)
-                    result["demo"] = True
-                else:
-                    print(f"✅ OpenAI analysis successful")
-            else:
-                print(f"✅ xAI analysis successful")
-            
-            result["filename"] = filename
-            return jsonify(result)
+            result = analyze_image(filename, image_bytes, reuse_similar=reuse_similar, screen=reuse_similar,
+                                   extra_photos=extra_photos)
+            return jsonify(with_allocation_report(result, alloc_baseline))
             
     except Exception as e:
         return jsonify({"success": False, "error": f"Error processing image: {str(e)}"})
 
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Analyze many uploads (multipart field `files`) with at most BATCH_CONCURRENCY in flight.
+
+    Every item goes through the same cache and provider fallback as /analyze, except
+    that provider failures are reported per item instead of replaced by a demo result.
+    """
+    request.max_content_length = BATCH_MAX_CONTENT_LENGTH
+    try:
+        files = [f for f in request.files.getlist('files') if f.filename]
+    except Exception as e:
+        return jsonify({"success": False, "error": f"Error reading upload: {str(e)}"})
+    if not files:
+        return jsonify({"success": False, "error": "No files uploaded"})
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({"success": False, "error": f"Too many files ({len(files)}); the limit is {BATCH_MAX_FILES}"})
+    
+    def run_item(file):
+        # Read inside the worker so that at most BATCH_CONCURRENCY uploads are in memory
+        item_started = time.monotonic()
+        try:
+            filename, image_bytes = read_upload(file)
+        except Exception as e:
+            return {"success": False, "filename": secure_filename(file.filename), "error": f"Error reading upload: {e}"}
+        try:
+            result = analyze_image(filename, image_bytes, demo_fallback=False)
+        except Exception as e:
+            result = {"success": False, "filename": filename, "error": f"Error processing image: {str(e)}"}
+        result["elapsed"] = round(time.monotonic() - item_started, 3)
+        return result
+    
+    print(f"📦 Starting batch of {len(files)} files (concurrency {BATCH_CONCURRENCY})")
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(files))) as executor:
+        results = list(executor.map(run_item, files))
+    elapsed = time.monotonic() - started
+    
+    succeeded = sum(1 for r in results if r["success"])
+    summary = {
+        "count": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "cached": sum(1 for r in results if r.get("cached")),
+        "concurrency": BATCH_CONCURRENCY,
+        "elapsed": round(elapsed, 3),
+        "items_per_second": round(len(results) / elapsed, 3) if elapsed > 0 else None,
+    }
+    print(f"📦 Batch done: {succeeded}/{len(results)} succeeded in {elapsed:.2f}s")
+    return jsonify({"success": succeeded > 0, "summary": summary, "results": results})
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Status of a queued analysis; `result` is present once the job is done"""
+    if job_queue is None:
+        return jsonify({"success": False, "error": "Job mode is not enabled"}), 404
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown job"}), 404
+    job["success"] = job["status"] != "failed"
+    return jsonify(job)
+
+def bulk_answer(item, response, error=None):
+    """Turn one batch output line into a result; successful answers are stored in the
+    result cache and history like an interactive analysis"""
+    if response is None:
+        result = {"success": False, "error": f"Batch request failed: {(error or {}).get('message', 'no response')}"}
+    elif response["status_code"] != 200:
+        message = (response.get("body") or {}).get("error", {}).get("message", "Unknown error")
+        result = {"success": False, "error": f"OpenAI API Error ({response['status_code']}): {message}"}
+    else:
+        content = response["body"]["choices"][0]["message"]["content"]
+        result = with_structured_fields({"success": True, "result": content, "provider": "OpenAI", "bulk": True})
+    metrics.BULK_ITEMS.labels("done" if result["success"] else "failed").inc()
+    if result["success"]:
+        store_cached(item["cache_key"], result, item["phash"])
+        record_history(item["filename"], None, result, time.time() - item["created"],
+                       image_sha256=item["image_sha256"])
+    return result
+
+def bulk_prepare(filename, path):
+    """Turn a staged bulk upload into (item fields, batch request body); exact cache hits
+    are answered without a request"""
+    with open(path, 'rb') as f:
+        image_bytes = persist_upload(filename, f.read())
+    cache_key = analysis_cache_key(image_bytes)
+    fields = {"cache_key": cache_key, "image_sha256": hashlib.sha256(image_bytes).hexdigest(), "phash": None}
+    cached = lookup_cached(cache_key, filename)
+    if cached is not None:
+        metrics.BULK_ITEMS.labels("cached").inc()
+        return dict(fields, status="done", result=cached), None
+    if near_duplicates is not None:
+        fields["phash"] = dhash(image_bytes)
+    base64_image, mime_type, _ = encode_for_provider(filename, image_bytes)
+    metrics.BULK_ITEMS.labels("submitted").inc()
+    return fields, provider_chat_body("OpenAI", OPENAI_MODEL, base64_image, mime_type)
+
+bulk_runner = None
+if BULK_ENABLED:
+    bulk_runner = BulkRunner(BulkStore(BULK_PATH), BatchClient(OPENAI_BATCH_BASE_URL, OPENAI_API_KEY), bulk_prepare,
+                             bulk_answer, BULK_STAGING_DIR, poll_seconds=BULK_POLL_SECONDS)
+
+@app.route('/bulk', methods=['POST'])
+def submit_bulk():
+    """Stage many uploads (multipart field `files`) for deferred analysis through the
+    OpenAI Batch API and return 202 with a `bulk_id`; poll /bulk/<bulk_id> for results.
+
+    The uploads are only saved here: a background thread preprocesses them, answers
+    exact cache hits and submits the rest. Nothing takes interactive rate-limit quota:
+    batch requests run on the provider's separate batch quota.
+    """
+    if bulk_runner is None:
+        return jsonify({"success": False, "error": "Bulk mode is not enabled (it needs an OpenAI API key)"}), 404
+    request.max_content_length = BULK_MAX_CONTENT_LENGTH
+    try:
+        files = [f for f in request.files.getlist('files') if f.filename]
+    except Exception as e:
+        return jsonify({"success": False, "error": f"Error reading upload: {str(e)}"})
+    if not files:
+        return jsonify({"success": False, "error": "No files uploaded"})
+    if len(files) > BULK_MAX_FILES:
+        return jsonify({"success": False, "error": f"Too many files ({len(files)}); the limit is {BULK_MAX_FILES}"})
+
+    try:
+        bulk_id = bulk_runner.stage([(upload_filename(file), file) for file in files])
+    except Exception as e:
+        return jsonify({"success": False, "error": f"Error staging bulk job: {str(e)}"})
+    print(f"📦 Bulk {bulk_id}: {len(files)} files staged")
+    return jsonify({"success": True, "bulk_id": bulk_id, "status": "running", "count": len(files),
+                    "status_url": f"/bulk/{bulk_id}"}), 202
+
+@app.route('/bulk/<bulk_id>')
+def bulk_status(bulk_id):
+    """Status, counts and per-item results of a bulk job"""
+    if bulk_runner is None:
+        return jsonify({"success": False, "error": "Bulk mode is not enabled (it needs an OpenAI API key)"}), 404
+    bulk = bulk_runner.store.get(bulk_id)
+    if bulk is None:
+        return jsonify({"success": False, "error": "Unknown bulk job"}), 404
+    bulk["success"] = True
+    return jsonify(bulk)
+
+def sse_event(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def open_provider_stream(provider, base64_image, mime_type="image/jpeg"):
+    """Start a streaming completion and return (response, error)"""
+    url, headers, model = provider_request(provider)
+    body = provider_chat_body(provider, model, base64_image, mime_type, stream=True)
+    try:
+        print(f"🔍 Trying {provider} streaming API call...")
+        response = provider_client.post(url, headers=headers, data=body, timeout=30, stream=True)
+    except requests.exceptions.RequestException as e:
+        metrics.PROVIDER_RESPONSES.labels(provider, "network_error").inc()
+        return None, f"{provider} network error: {e}"
+    print(f"📡 {provider} Response Status: {response.status_code}")
+    metrics.PROVIDER_RESPONSES.labels(provider, response.status_code).inc()
+    if response.status_code != 200:
+        response.close()
+        record_rate_limited(provider, {"rate_limited": response.status_code == 429})
+        return None, f"{provider} API Error ({response.status_code})"
+    return response, None
+
+def iter_stream_deltas(response):
+    """Yield the content deltas of an OpenAI-style `stream: true` completion"""
+    for line in response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        choices = json.loads(data).get("choices") or [{}]
+        delta = choices[0].get("delta", {}).get("content")
+        if delta:
+            yield delta
+
+def stream_done(result, screening, crops):
+    """Payload of the `done` event for a provider result"""
+    done = {"provider": result["provider"], "cached": False, "prescreen": screening}
+    if TAG_CROP and crops[0] is not None:
+        done["crop"] = crops[0] if len(crops) == 1 else crops
+    if "analysis" in result:
+        # Relayed tokens may be raw JSON: send the rendering to show instead
+        done.update(result=result["result"], analysis=result["analysis"])
+    if "cascade" in result:
+        done["cascade"] = result["cascade"]
+    return done
+
+@app.route('/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """Analyze an upload (or several photos of one item) and relay the provider's tokens
+    as Server-Sent Events.
+
+    Events: `meta` (filename), `token` ({"text"}), `status` (fallback notices),
+    `done` (provider/cached/demo flags) and `error`. Providers are tried serially;
+    a provider can only be replaced before its first token has been relayed. With the
+    cascade on, an accepted first-tier answer is sent as a single token and only an
+    escalation to the full models is streamed.
+    """
+    if 'file' not in request.files:
+        return jsonify({"success": False, "error": "No file uploaded"})
+    
+    files = [f for f in request.files.getlist('file') if f.filename]
+    if not files:
+        return jsonify({"success": False, "error": "No file selected"})
+    if len(files) > MAX_PHOTOS_PER_ITEM:
+        return jsonify({"success": False, "error": f"Too many photos ({len(files)}); the limit is {MAX_PHOTOS_PER_ITEM} per item"})
+    
+    try:
+        filename, image_bytes, extra_photos = read_item_upload(files)
+    except Exception as e:
+        return jsonify({"success": False, "error": f"Error processing image: {str(e)}"})
+    photos = [image_bytes, *extra_photos]
+    cache_key = analysis_cache_key(image_bytes, extra_photos)
+    reuse_similar = request.form.get('fresh') != '1'
+    
+    def events():
+        stream_started = time.monotonic()
+        yield sse_event("meta", {"filename": filename})
+        
+        cached, image_hash = lookup_analysis(cache_key, None if extra_photos else image_bytes, filename,
+                                             reuse_similar)
+        if cached is not None:
+            yield sse_event("token", {"text": cached["result"]})
+            yield sse_event("done", {"provider": cached["provider"], "cached": True,
+                                     "cache_tier": cached["cache_tier"], "analysis": cached.get("analysis"),
+                                     "near_duplicate": cached.get("near_duplicate")})
+            return
+        
+        screening = prescreen_photos(filename, photos) if reuse_similar else None
+        if screening is not None and screening["blocked"]:
+            rejection = prescreen_rejection(filename, screening)
+            yield sse_event("error", {"error": rejection["error"], "prescreen": screening})
+            return
+        
+        base64_image, mime_type, crops = encode_photos(filename, photos)
+        cascade = None
+        if CASCADE_ENABLED:
+            # The short first-tier answer is not streamed; only an escalation streams
+            first_started = time.monotonic()
+            first = call_provider(CASCADE_PROVIDER, base64_image, mime_type)
+            first_elapsed = time.monotonic() - first_started
+            reasons = judge_first_tier(first, first_elapsed)
+            if not reasons:
+                store_cached(cache_key, first, image_hash)
+                record_history(filename, image_bytes, first, time.monotonic() - stream_started)
+                yield sse_event("token", {"text": first["result"]})
+                yield sse_event("done", stream_done(first, screening, crops))
+                return
+            cascade = (first, reasons, first_elapsed, time.monotonic())
+            yield sse_event("status", {"message": f"Escalating from {CASCADE_MODEL} to the full models..."})
+        print(f"🔄 Starting streaming analysis for {filename}")
+        for provider in route_providers():
+            if not circuit_breaker.allow(provider):
+                circuit_open_result(provider)
+                continue
+            if not acquire_quota(provider):
+                circuit_breaker.release(provider)
+                shed_result(provider)
+                yield sse_event("status", {"message": f"{provider} rate limit reached. Trying next provider..."})
+                continue
+            started = time.monotonic()
+            response, error = open_provider_stream(provider, base64_image, mime_type)
+            if error:
+                print(f"❌ {error}")
+                circuit_breaker.record(provider, False, time.monotonic() - started, error)
+                metrics.PROVIDER_LATENCY.labels(provider, "error").observe(time.monotonic() - started)
+                yield sse_event("status", {"message": f"{error}. Trying next provider..."})
+                continue
+            
+            chunks = []
+            try:
+                for delta in iter_stream_deltas(response):
+                    chunks.append(delta)
+                    yield sse_event("token", {"text": delta})
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"❌ {provider} stream interrupted: {e}")
+                circuit_breaker.record(provider, False, time.monotonic() - started, str(e))
+                metrics.PROVIDER_LATENCY.labels(provider, "error").observe(time.monotonic() - started)
+                if chunks:
+                    yield sse_event("error", {"error": f"{provider} stream interrupted: {e}"})
+                    return
+                yield sse_event("status", {"message": f"{provider} stream failed. Trying next provider..."})
+                continue
+            finally:
+                response.close()
+            
+            circuit_breaker.record(provider, bool(chunks), time.monotonic() - started)
+            metrics.PROVIDER_LATENCY.labels(provider, "success" if chunks else "error").observe(time.monotonic() - started)
+            if not chunks:
+                yield sse_event("status", {"message": f"{provider} returned no content. Trying next provider..."})
+                continue
+            
+            analysis = with_structured_fields({"success": True, "result": "".join(chunks), "provider": provider})
+            if not analysis["success"]:
+                # The JSON tokens have been relayed already, so there is no falling back
+                yield sse_event("error", {"error": analysis["error"]})
+                return
+            print(f"✅ {provider} streaming analysis successful")
+            if cascade is not None:
+                first, reasons, first_elapsed, full_started = cascade
+                analysis = escalated_result(first, analysis, reasons, first_elapsed, time.monotonic() - full_started)
+            store_cached(cache_key, analysis, image_hash)
+            record_history(filename, image_bytes, analysis, time.monotonic() - stream_started)
+            yield sse_event("done", stream_done(analysis, screening, crops))
+            return
+        
+        if cascade is not None and cascade[0]["success"]:
+            # A weak first-tier answer beats the demo analysis
+            first, reasons, first_elapsed, full_started = cascade
+            result = escalated_result(first, {"success": False, "error": "All providers failed"}, reasons,
+                                      first_elapsed, time.monotonic() - full_started)
+            store_cached(cache_key, result, image_hash)
+            record_history(filename, image_bytes, result, time.monotonic() - stream_started)
+            yield sse_event("token", {"text": result["result"]})
+            yield sse_event("done", stream_done(result, screening, crops))
+            return
+        
+        print(f"🔄 Using demo analysis...")
+        metrics.DEMO_RESULTS.inc()
+        yield sse_event("token", {"text": create_mock_analysis(filename)["result"]})
+        yield sse_event("done", {"provider": None, "cached": False, "demo": True, "prescreen": screening})
+    
+    def generate():
+        # Headers are sent already, so a failure has to end the stream with an event
+        try:
+            yield from events()
+        except Exception as e:
+            print(f"❌ Streaming analysis failed for {filename}: {e}")
+            yield sse_event("error", {"error": f"Error processing image: {str(e)}"})
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def history_page_args():
+    """(limit, before) from the query string; raises ValueError on bad values"""
+    limit = min(int(request.args.get('limit', HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE_SIZE)
+    before = request.args.get('before')
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    return limit, int(before) if before else None
+
+def history_page(items, next_before, **extra):
+    if upload_store is not None:
+        for item in items:
+            # By content digest, so the thumbnail is served as immutable
+            item["thumbnail_url"] = f"/uploads/{item['image_hash']}?size={THUMBNAIL_SIZES[0]}"
+    page = {"success": True, "items": items, "next_before": next_before, **extra}
+    if next_before is not None:
+        args = {key: value for key, value in request.args.items() if key != 'before'}
+        args['before'] = next_before
+        page["next_url"] = f"{request.path}?{urlencode(args)}"
+    return jsonify(page)
+
+@app.route('/history')
+def analysis_history():
+    """Past provider analyses, newest first; `before` (keyset cursor) pages back, `hash`
+    (SHA-256 of the image) finds earlier analyses of the same file"""
+    if history_store is None:
+        return jsonify({"success": False, "error": "History is not enabled"}), 404
+    try:
+        limit, before = history_page_args()
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"Invalid paging parameters: {e}"}), 400
+    items, next_before = history_store.recent(limit, before, request.args.get('hash'))
+    return history_page(items, next_before)
+
+@app.route('/search')
+def search_history():
+    """Full-text search of past analyses (filename and result text), newest first"""
+    if history_store is None:
+        return jsonify({"success": False, "error": "History is not enabled"}), 404
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"success": False, "error": "Missing search query (q)"}), 400
+    try:
+        limit, before = history_page_args()
+    except ValueError as e:
+        return jsonify({"success": False, "error": f"Invalid paging parameters: {e}"}), 400
+    started = time.monotonic()
+    items, next_before = history_store.search(query, limit, before)
+    return history_page(items, next_before, query=query, elapsed=round(time.monotonic() - started, 4))
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """Serve a stored upload by blob name (<sha256>.<ext> or <sha256>) or upload filename, with a
+    SHA-256 ETag, If-None-Match and Range support; `size` (one of THUMBNAIL_SIZES) serves
+    a WebP (or, for clients that don't accept it, JPEG) thumbnail instead"""
+    blob = upload_store.lookup(filename) if upload_store is not None else None
+    if blob is None:
+        # Only indexed blobs and their upload names are served, never other files in the folder
+        return jsonify({"success": False, "error": "Unknown upload"}), 404
+    size = request.args.get('size')
+    if size is not None:
+        if not size.isdigit() or int(size) not in THUMBNAIL_SIZES:
+            return jsonify({"success": False, "error": f"size must be one of {', '.join(map(str, THUMBNAIL_SIZES))}"}), 400
+        mime = "image/webp" if request.accept_mimetypes["image/webp"] else "image/jpeg"
+        path = upload_store.derivative(blob, int(size), mime, THUMBNAIL_QUALITY)
+        if path is None:
+            return jsonify({"success": False, "error": "Upload cannot be resized"}), 415
+        response = send_file(path, mimetype=mime, etag=f"{blob['digest']}-{size}-{mime[6:]}", conditional=True,
+                             max_age=31536000 if blob["immutable"] else None)
+        response.vary.add('Accept')
+    else:
+        response = send_file(blob["path"], mimetype=blob["mime"], etag=blob["digest"], conditional=True,
+                             max_age=31536000 if blob["immutable"] else None)
+    if blob["immutable"]:
+        response.cache_control.immutable = True
+    else:
+        # An upload filename could be reused; revalidate against the ETag
+        response.cache_control.no_cache = True
+    return response
 
 @app.route('/health')
 def health_check():
@@ -381,6 +1642,35 @@ def health_check():
     app.logger.info("Health check endpoint was reached.")
     return 'OK', 200
 
+@app.route('/providers/latency')
+def provider_latency():
+    """Observed provider latency percentiles, the current hedge delay, and the cascade
+    and tag crop latency reports"""
+    return jsonify({
+        "hedge_mode": HEDGE_MODE,
+        "hedge_delay": {provider: current_hedge_delay(provider) for provider in PROVIDER_PREFERENCE},
+        "latency": latency_tracker.snapshot(),
+        "cascade": cascade_snapshot() if CASCADE_ENABLED else None,
+        "tag_crop": crop_snapshot() if TAG_CROP else None,
+    })
+
+@app.route('/providers/health')
+def provider_health():
+    """Circuit breaker state, rolling error rate and latency per provider, and the
+    resulting route order (as seen by this worker process)"""
+    return jsonify({
+        "pid": os.getpid(),
+        "route": route_providers(),
+        "providers": circuit_breaker.snapshot(),
+        "rate_limits": rate_limiter.snapshot() if rate_limiter is not None else {},
+    })
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics, aggregated across gunicorn workers"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 @app.route('/debug-keys')
 def debug_keys():
     """A secure debugging endpoint to verify API keys."""
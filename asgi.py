@@ -0,0 +1,387 @@
+"""
+ASGI Entry Point
+Asyncio analyze path: POST /analyze is served natively with an async HTTP client, so one
+worker process can hold hundreds of in-flight provider calls. Every other route (and
+/analyze in job mode) is served by the Flask app through asgiref.
+
+Run alongside the WSGI entry point (app:app) with:
+    uvicorn asgi:application --host 0.0.0.0 --port 8080 --workers 4
+"""
+
+import asyncio
+import io
+import json
+import os
+import time
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flask_app
+import metrics
+import provider_client
+
+ASYNC_MAX_CONNECTIONS = int(os.environ.get('ASYNC_MAX_CONNECTIONS', '500'))
+
+RESULT_BUILDERS = {
+    "xAI": flask_app.xai_result,
+    "OpenAI": flask_app.openai_result,
+    flask_app.CASCADE_PROVIDER: flask_app.cascade_result,
+}
+
+wsgi_application = WsgiToAsgi(flask_app.app)
+_client = None
+_flights = {}
+
+
+def get_client():
+    """Shared AsyncClient for this worker's event loop, created on first use"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS,
+                                max_keepalive_connections=ASYNC_MAX_CONNECTIONS),
+            timeout=30,
+        )
+    return _client
+
+
+async def post_with_retry(url, headers, body):
+    """Async counterpart of provider_client.post with the same retry policy"""
+    client = get_client()
+    started = time.monotonic()
+    timeout = client.timeout.read or 0
+    attempt = 0
+    while True:
+        try:
+            response = await client.post(url, headers=headers, content=body)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            # Nothing was sent yet; a dropped connection after that is not retried
+            if attempt >= provider_client.MAX_RETRIES:
+                raise
+            delay = provider_client.retry_delay(attempt)
+            if not provider_client.within_budget(started, delay, timeout):
+                raise
+        else:
+            if response.status_code not in provider_client.RETRY_STATUSES or attempt >= provider_client.MAX_RETRIES:
+                return response
+            delay = provider_client.retry_delay(attempt, response)
+            if delay is None or not provider_client.within_budget(started, delay, timeout):
+                return response
+            print(f"🔁 HTTP {response.status_code} from {response.url.host}, retrying in {delay:.2f}s...")
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def acquire_quota_async(provider):
+    """Async counterpart of app.acquire_quota: waits on the event loop, not a thread"""
+    limiter = flask_app.rate_limiter
+    if limiter is None:
+        return True
+    deadline = time.monotonic() + flask_app.RATE_LIMIT_MAX_WAIT_SECONDS
+    while True:
+        wait = await asyncio.to_thread(limiter.try_acquire, flask_app.quota_bucket(provider),
+                                       flask_app.RATE_LIMIT_TOKENS_PER_REQUEST)
+        if wait <= 0:
+            return True
+        if time.monotonic() + wait > deadline:
+            return False
+        await asyncio.sleep(wait)
+
+
+async def call_provider_async(provider, base64_image, mime_type):
+    """Async counterpart of app.call_provider"""
+    if not flask_app.circuit_breaker.allow(provider):
+        return flask_app.circuit_open_result(provider)
+    if not await acquire_quota_async(provider):
+        flask_app.circuit_breaker.release(provider)
+        return flask_app.shed_result(provider)
+    url, headers, model = flask_app.provider_request(provider)
+    body = flask_app.provider_chat_body(provider, model, base64_image, mime_type)
+    started = time.monotonic()
+    in_flight = metrics.PROVIDER_IN_FLIGHT.labels(provider)
+    in_flight.inc()
+    try:
+        print(f"🔍 Trying {provider} API call (async)...")
+        response = await post_with_retry(url, headers, body)
+        print(f"📡 {provider} Response Status: {response.status_code}")
+        metrics.PROVIDER_RESPONSES.labels(provider, response.status_code).inc()
+        result = RESULT_BUILDERS[provider](response)
+    except asyncio.CancelledError:
+        flask_app.circuit_breaker.release(provider)
+        raise
+    except httpx.TimeoutException:
+        print(f"❌ {provider}: Request timeout")
+        metrics.PROVIDER_RESPONSES.labels(provider, "timeout").inc()
+        result = {"success": False, "error": f"{provider} request timed out."}
+    except httpx.HTTPError as e:
+        print(f"❌ {provider}: Network error - {e}")
+        metrics.PROVIDER_RESPONSES.labels(provider, "network_error").inc()
+        result = {"success": False, "error": f"{provider} network error: {e}"}
+    except Exception as e:
+        print(f"❌ {provider}: Unexpected error - {e}")
+        result = {"success": False, "error": f"{provider} unexpected error: {e}"}
+    finally:
+        in_flight.dec()
+    if result.get("rate_limited"):
+        await asyncio.to_thread(flask_app.record_provider_outcome, provider, result, time.monotonic() - started)
+    else:
+        flask_app.record_provider_outcome(provider, result, time.monotonic() - started)
+    return result
+
+
+async def run_providers_async(base64_image, mime_type):
+    """Async counterpart of app.run_providers; a losing hedge is really cancelled here"""
+    order = flask_app.route_providers()
+    if not order:
+        print(f"🔴 All provider circuits are open")
+        return {"success": False, "error": "All providers are unavailable (circuits open)"}
+
+    if flask_app.HEDGE_MODE == 'off' or len(order) == 1:
+        result = await call_provider_async(order[0], base64_image, mime_type)
+        for previous, provider in zip(order, order[1:]):
+            if result["success"]:
+                break
+            print(f"❌ {previous} failed: {result['error']}")
+            print(f"🔄 Falling back to {provider}...")
+            result = await call_provider_async(provider, base64_image, mime_type)
+            if result["success"]:
+                metrics.FALLBACKS.labels(order[0], provider).inc()
+        return result
+
+    primary, secondary = order[:2]
+    started = time.monotonic()
+    delay = flask_app.current_hedge_delay(primary)
+    pending = {asyncio.ensure_future(call_provider_async(primary, base64_image, mime_type)): primary}
+    secondary_started = hedged = False
+
+    def start_secondary():
+        pending[asyncio.ensure_future(call_provider_async(secondary, base64_image, mime_type))] = secondary
+
+    if delay <= 0:
+        start_secondary()
+        secondary_started = hedged = True
+    else:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if not done:
+            print(f"⏱️ {primary} slower than {delay:.2f}s, hedging with {secondary}...")
+            start_secondary()
+            secondary_started = hedged = True
+
+    failure = None
+    failed = []
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            provider = pending.pop(task)
+            result = task.result()
+            if result["success"]:
+                for other in pending:
+                    other.cancel()
+                result["hedged"] = hedged
+                result["elapsed"] = round(time.monotonic() - started, 3)
+                flask_app.count_hedge_outcome(primary, result, failed)
+                return result
+            print(f"❌ {provider} failed: {result['error']}")
+            failure = result
+            failed.append(provider)
+            if not secondary_started:
+                print(f"🔄 {provider} failed, falling back to {secondary}...")
+                start_secondary()
+                secondary_started = True
+    return failure
+
+
+async def run_cascade_async(base64_image, mime_type):
+    """Async counterpart of app.run_cascade"""
+    started = time.monotonic()
+    first = await call_provider_async(flask_app.CASCADE_PROVIDER, base64_image, mime_type)
+    first_elapsed = time.monotonic() - started
+    reasons = flask_app.judge_first_tier(first, first_elapsed)
+    if not reasons:
+        return first
+
+    started = time.monotonic()
+    result = await run_providers_async(base64_image, mime_type)
+    return flask_app.escalated_result(first, result, reasons, first_elapsed, time.monotonic() - started)
+
+
+async def run_coalesced_async(cache_key, analyze):
+    """Async counterpart of app.run_coalesced: tasks of this worker await the leader's
+    future, other workers are coordinated through the shared lease table"""
+    flight = flask_app.single_flight
+    if flight is None:
+        return await analyze(), False
+    waiting = _flights.get(cache_key)
+    if waiting is not None:
+        result = await asyncio.shield(waiting)
+        if result is not None:
+            print(f"🔗 Coalesced with an in-flight analysis of the same upload")
+            metrics.COALESCED.inc()
+            return dict(result, coalesced=True), True
+        # the leader failed without a result: run it ourselves below
+
+    future = _flights[cache_key] = asyncio.get_running_loop().create_future()
+    result = None
+    try:
+        while True:
+            is_leader, result = await asyncio.to_thread(flight.acquire, cache_key)
+            if result is not None:
+                metrics.COALESCED.inc()
+                return dict(result, coalesced=True), True
+            if is_leader:
+                try:
+                    result = await analyze()
+                except BaseException:
+                    await asyncio.to_thread(flight.abandon, cache_key)
+                    raise
+                await asyncio.to_thread(flight.finish, cache_key, result)
+                return result, False
+            await asyncio.sleep(flight.poll_interval)
+    finally:
+        if _flights.get(cache_key) is future:
+            del _flights[cache_key]
+        future.set_result(result)
+
+
+async def analyze_image_async(filename, image_bytes, reuse_similar=True, screen=True, extra_photos=()):
+    """Async counterpart of app.analyze_image; blocking cache and image work runs in threads"""
+    started = time.monotonic()
+    photos = [image_bytes, *extra_photos]
+    cache_key = flask_app.analysis_cache_key(image_bytes, extra_photos)
+    cached, image_hash = await asyncio.to_thread(flask_app.lookup_analysis, cache_key,
+                                                 None if extra_photos else image_bytes, filename, reuse_similar)
+    if cached is not None:
+        return cached
+
+    screening = await asyncio.to_thread(flask_app.prescreen_photos, filename, photos) if screen else None
+    if screening is not None and screening["blocked"]:
+        return flask_app.prescreen_rejection(filename, screening)
+
+    async def analyze_with_providers():
+        base64_image, mime_type, crops = await asyncio.to_thread(flask_app.encode_photos, filename, photos)
+        print(f"🔄 Starting analysis for {filename}")
+        provider_started = time.monotonic()
+        if flask_app.CASCADE_ENABLED:
+            result = await run_cascade_async(base64_image, mime_type)
+        else:
+            result = await run_providers_async(base64_image, mime_type)
+        return flask_app.with_crop_report(result, crops, time.monotonic() - provider_started)
+
+    result, coalesced = await run_coalesced_async(cache_key, analyze_with_providers)
+
+    if not result["success"]:
+        print(f"🔄 Using demo analysis...")
+        result = flask_app.create_mock_analysis(filename)
+        result["demo"] = True
+        metrics.DEMO_RESULTS.inc()
+    else:
+        print(f"✅ {result['provider']} analysis successful")
+        if not coalesced:
+            await asyncio.to_thread(flask_app.store_cached, cache_key, result, image_hash)
+            flask_app.record_history(filename, image_bytes, result, time.monotonic() - started)
+
+    result["cached"] = False
+    result["filename"] = filename
+    if extra_photos:
+        result["photos"] = len(photos)
+    if screening is not None:
+        result["prescreen"] = screening
+    return result
+
+
+async def read_body(receive, limit):
+    """Read the whole request body, raising ValueError past `limit` bytes"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ConnectionError("Client disconnected")
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            raise ValueError(f"Upload larger than {limit} bytes")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def read_form_upload(scope, body):
+    """Parse the multipart body like Flask would and return read_item_upload()'s (filename,
+    bytes, extra photos) plus whether a near-duplicate's result may be reused (no `fresh=1`
+    field)"""
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+    environ = {
+        "REQUEST_METHOD": "POST",
+        "CONTENT_TYPE": headers.get("content-type", ""),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body),
+    }
+    form_request = flask_app.app.request_class(environ)
+    if 'file' not in form_request.files:
+        raise LookupError("No file uploaded")
+    files = [f for f in form_request.files.getlist('file') if f.filename]
+    if not files:
+        raise LookupError("No file selected")
+    if len(files) > flask_app.MAX_PHOTOS_PER_ITEM:
+        raise LookupError(f"Too many photos ({len(files)}); the limit is {flask_app.MAX_PHOTOS_PER_ITEM} per item")
+    filename, image_bytes, extra_photos = flask_app.read_item_upload(files)
+    return filename, image_bytes, extra_photos, form_request.form.get('fresh') != '1'
+
+
+async def send_json(send, body, status=200):
+    data = json.dumps(body).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(data)).encode())],
+    })
+    await send({"type": "http.response.body", "body": data})
+
+
+async def analyze_endpoint(scope, receive, send):
+    try:
+        body = await read_body(receive, flask_app.app.config['MAX_CONTENT_LENGTH'])
+    except ValueError as e:
+        await send_json(send, {"success": False, "error": str(e)}, status=413)
+        return
+    except ConnectionError:
+        return
+
+    try:
+        filename, image_bytes, extra_photos, reuse_similar = await asyncio.to_thread(read_form_upload, scope, body)
+    except LookupError as e:
+        await send_json(send, {"success": False, "error": str(e)})
+        return
+
+    try:
+        result = await analyze_image_async(filename, image_bytes, reuse_similar, screen=reuse_similar,
+                                           extra_photos=extra_photos)
+    except Exception as e:
+        result = {"success": False, "error": f"Error processing image: {str(e)}"}
+    await send_json(send, result)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _client is not None:
+                await _client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI application: async /analyze, everything else delegated to Flask"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if (scope["type"] == "http" and scope["path"] == "/analyze" and scope["method"] == "POST"
+            and not flask_app.JOB_MODE):
+        await analyze_endpoint(scope, receive, send)
+        return
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Async vs Sync Benchmark
+Requests/second of one worker process on the sync WSGI path (gunicorn app:app) and the
+asyncio ASGI path (uvicorn asgi:application), both against a local stub provider
+
+Usage: python bench_async.py --latency 1.0 --concurrency 200 --duration 15
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from stub_provider import start_stub_provider
+
+SERVERS = {
+    "sync (gunicorn app:app, 1 sync worker)": [
+        sys.executable, "-m", "gunicorn", "--workers", "1", "--timeout", "120", "--bind", "127.0.0.1:{port}",
+        "app:app",
+    ],
+    "async (uvicorn asgi:application, 1 worker)": [
+        sys.executable, "-m", "uvicorn", "--workers", "1", "--host", "127.0.0.1", "--port", "{port}",
+        "--log-level", "warning", "asgi:application",
+    ],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_health(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become healthy")
+
+
+async def drive(base_url, concurrency, duration):
+    """Run `concurrency` clients posting to /analyze for `duration` seconds"""
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        deadline = time.monotonic() + duration
+
+        async def client_loop(index):
+            nonlocal errors
+            sequence = 0
+            while time.monotonic() < deadline:
+                sequence += 1
+                started = time.monotonic()
+                try:
+                    response = await client.post(
+                        "/analyze", files={"file": (f"bench_{index}_{sequence}.jpg", os.urandom(2048), "image/jpeg")}
+                    )
+                    ok = response.status_code == 200 and response.json().get("success") and not response.json().get("demo")
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.monotonic() - started)
+                else:
+                    errors += 1
+
+        started = time.monotonic()
+        await asyncio.gather(*(client_loop(i) for i in range(concurrency)))
+        elapsed = time.monotonic() - started
+    return latencies, errors, elapsed
+
+
+def run_scenario(name, command, stub_url, args):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "XAI_API_URL": stub_url,
+        "OPENAI_API_URL": stub_url,
+        "XAI_API_KEY": "stub-key",
+        "OPENAI_API_KEY": "stub-key",
+        "HEDGE_MODE": "off",
+        "RESULT_CACHE": "off",
+        "UPLOAD_PERSIST_MODE": "off",
+        "IMAGE_PREPROCESS": "off",
+        "PROVIDER_POOL_SIZE": str(args.concurrency),
+    })
+    process = subprocess.Popen([part.format(port=port) for part in command], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_for_health(base_url)
+        latencies, errors, elapsed = asyncio.run(drive(base_url, args.concurrency, args.duration))
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    completed = len(latencies)
+    print(f"\n{name}")
+    print(f"   Completed: {completed} ({errors} errors) in {elapsed:.1f}s")
+    print(f"   Throughput: {completed / elapsed:.2f} req/s per worker")
+    if completed >= 2:
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"   Latency p50/p95: {quantiles[49]:.2f}s / {quantiles[94]:.2f}s")
+    return completed / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--latency", type=float, default=1.0, help="stub provider latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=200, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=15, help="seconds per scenario")
+    args = parser.parse_args()
+
+    stub = start_stub_provider(latency=args.latency)
+    print("🎯 ASYNC VS SYNC BENCHMARK")
+    print("=" * 50)
+    print(f"Stub latency {args.latency}s, {args.concurrency} concurrent clients, {args.duration}s per scenario")
+
+    throughput = {name: run_scenario(name, command, stub.url, args) for name, command in SERVERS.items()}
+    sync_rps, async_rps = throughput.values()
+    if sync_rps > 0:
+        print(f"\n📊 Async path: {async_rps / sync_rps:.1f}x the requests/second of the sync path per worker")
+    stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,476 @@
+"""
+Bulk Appraisal
+Deferred analyses through the OpenAI Batch API: uploads are staged on disk, packaged
+into JSONL batch files and submitted by a background thread, which also polls the
+batches and hands every answer back to the app to fan into the result cache and history
+"""
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+
+import provider_client
+
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+ITEM_COLUMNS = ("custom_id", "filename", "status", "result", "error", "created", "updated")
+
+
+class BatchAPIError(Exception):
+    """A files / batches API call that did not succeed"""
+
+
+class BatchClient:
+    """The files and batches endpoints of an OpenAI-compatible API under `base_url`
+    (e.g. https://api.openai.com/v1)"""
+
+    def __init__(self, base_url, api_key, timeout=300):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.timeout = timeout
+        # Runs on the bulk thread, not bound by the worker timeout like provider calls
+        self.retry_budget = 3 * timeout
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def _json(self, response, action):
+        if response.status_code != 200:
+            try:
+                message = response.json().get("error", {}).get("message", response.text)
+            except ValueError:
+                message = response.text or "no body"
+            raise BatchAPIError(f"{action} failed ({response.status_code}): {message}")
+        return response.json()
+
+    def upload(self, fileobj):
+        """Upload a JSONL batch input file and return its file id.
+
+        Not retried: the file object cannot be rewound by the retry loop, and the
+        caller records the batch as failed instead.
+        """
+        url = f"{self.base_url}/files"
+        response = provider_client.get_session(url).post(
+            url, headers=self._headers(), data={"purpose": "batch"},
+            files={"file": ("bulk.jsonl", fileobj, "application/jsonl")}, timeout=self.timeout,
+        )
+        return self._json(response, "File upload")["id"]
+
+    def create(self, input_file_id, completion_window="24h"):
+        response = provider_client.post(
+            f"{self.base_url}/batches", headers=self._headers(), timeout=self.timeout, retry_budget=self.retry_budget,
+            json={"input_file_id": input_file_id, "endpoint": "/v1/chat/completions",
+                  "completion_window": completion_window},
+        )
+        return self._json(response, "Batch creation")
+
+    def retrieve(self, batch_id):
+        return self._json(provider_client.get(f"{self.base_url}/batches/{batch_id}", headers=self._headers(),
+                                              timeout=self.timeout, retry_budget=self.retry_budget), "Batch status")
+
+    def content(self, file_id):
+        """Lines of a JSONL output or error file"""
+        response = provider_client.get(f"{self.base_url}/files/{file_id}/content", headers=self._headers(),
+                                       timeout=self.timeout, retry_budget=self.retry_budget)
+        if response.status_code != 200:
+            raise BatchAPIError(f"File download failed ({response.status_code}): {response.text}")
+        return [json.loads(line) for line in response.content.splitlines() if line.strip()]
+
+
+class BulkStore:
+    """Bulk jobs, their provider batches and items in a SQLite file shared by every
+    gunicorn worker.
+
+    Staged jobs are packaged and batches polled under a lease, so that only one worker
+    works on each at a time; finished bulk jobs are deleted after `retention_seconds`.
+    """
+
+    def __init__(self, path, lease_seconds=300, retention_seconds=7 * 24 * 3600):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.retention_seconds = retention_seconds
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS bulk_jobs (
+                id TEXT PRIMARY KEY, staging_dir TEXT NOT NULL, status TEXT NOT NULL,
+                created REAL NOT NULL, lease_until REAL
+            );
+            CREATE TABLE IF NOT EXISTS bulk_batches (
+                id TEXT PRIMARY KEY, bulk_id TEXT NOT NULL, status TEXT NOT NULL, error TEXT,
+                created REAL NOT NULL, updated REAL NOT NULL, next_poll REAL NOT NULL, lease_until REAL
+            );
+            CREATE INDEX IF NOT EXISTS bulk_batches_next_poll ON bulk_batches (status, next_poll);
+            CREATE TABLE IF NOT EXISTS bulk_items (
+                custom_id TEXT PRIMARY KEY, bulk_id TEXT NOT NULL, batch_id TEXT, filename TEXT NOT NULL,
+                staged_name TEXT NOT NULL, cache_key TEXT, image_sha256 TEXT, phash TEXT, status TEXT NOT NULL,
+                result TEXT, error TEXT, created REAL NOT NULL, updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS bulk_items_bulk_id ON bulk_items (bulk_id, status);
+            CREATE INDEX IF NOT EXISTS bulk_items_batch_id ON bulk_items (batch_id);
+        """)
+
+    def _connect(self):
+        """Per-thread autocommit connection; transactions are opened explicitly"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def stage(self, bulk_id, staging_dir, items):
+        """Record a bulk job whose uploads wait in `staging_dir`; `items` are (filename,
+        staged file name) pairs"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO bulk_jobs (id, staging_dir, status, created) VALUES (?, ?, 'staged', ?)",
+                         (bulk_id, staging_dir, now))
+            conn.executemany(
+                "INSERT INTO bulk_items (custom_id, bulk_id, filename, staged_name, status, created, updated)"
+                " VALUES (?, ?, ?, ?, 'staged', ?, ?)",
+                [(f"{bulk_id}-{index}", bulk_id, filename, staged_name, now, now)
+                 for index, (filename, staged_name) in enumerate(items)],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def claim_staged(self):
+        """Lease the oldest bulk job still waiting to be packaged; (bulk_id, staging_dir) or None"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, staging_dir FROM bulk_jobs WHERE status = 'staged'"
+                " AND (lease_until IS NULL OR lease_until < ?) ORDER BY created LIMIT 1", (now,)
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE bulk_jobs SET lease_until = ? WHERE id = ?", (now + self.lease_seconds, row[0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def extend_lease(self, bulk_id):
+        self._connect().execute("UPDATE bulk_jobs SET lease_until = ? WHERE id = ?",
+                                (time.time() + self.lease_seconds, bulk_id))
+
+    def staged_items(self, bulk_id):
+        """Items of a bulk job not packaged yet (a previous packager may have died midway)"""
+        rows = self._connect().execute(
+            "SELECT custom_id, filename, staged_name FROM bulk_items WHERE bulk_id = ? AND status = 'staged'"
+            " ORDER BY rowid", (bulk_id,)
+        ).fetchall()
+        return [dict(zip(("custom_id", "filename", "staged_name"), row)) for row in rows]
+
+    def packaged(self, bulk_id, items, batch_id=None, batch_status=None, poll_at=None):
+        """Record packaged item dicts (custom_id, status and whichever of cache_key,
+        image_sha256, phash, result and error they have) and, with `batch_id`, the
+        provider batch they were submitted in"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if batch_id is not None:
+                conn.execute(
+                    "INSERT INTO bulk_batches (id, bulk_id, status, created, updated, next_poll)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (batch_id, bulk_id, batch_status, now, now, poll_at or now),
+                )
+            conn.executemany(
+                "UPDATE bulk_items SET batch_id = ?, cache_key = ?, image_sha256 = ?, phash = ?, status = ?,"
+                " result = ?, error = ?, updated = ? WHERE custom_id = ?",
+                [(batch_id, item.get("cache_key"), item.get("image_sha256"),
+                  str(item["phash"]) if item.get("phash") is not None else None,  # 64-bit unsigned
+                  item["status"], json.dumps(item["result"]) if item.get("result") is not None else None,
+                  item.get("error"), now, item["custom_id"]) for item in items],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def unstage(self, bulk_id):
+        """Mark a bulk job as fully packaged"""
+        self._connect().execute("UPDATE bulk_jobs SET status = 'packaged', lease_until = NULL WHERE id = ?",
+                                (bulk_id,))
+
+    def purge(self):
+        """Delete bulk jobs whose last update is older than the retention period"""
+        cutoff = time.time() - self.retention_seconds
+        conn = self._connect()
+        conn.execute(
+            "DELETE FROM bulk_items WHERE bulk_id IN (SELECT bulk_id FROM bulk_items GROUP BY bulk_id"
+            " HAVING MAX(updated) < ? AND SUM(status IN ('staged', 'submitted')) = 0)", (cutoff,)
+        )
+        conn.execute("DELETE FROM bulk_batches WHERE status IN (?, ?, ?, ?) AND updated < ?",
+                     (*TERMINAL_STATUSES, cutoff))
+        conn.execute("DELETE FROM bulk_jobs WHERE status = 'packaged' AND created < ?", (cutoff,))
+
+    def claim_due(self):
+        """Lease the unfinished batch that is due for a poll soonest and return its id, or None"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"SELECT id FROM bulk_batches WHERE status NOT IN ({', '.join('?' * len(TERMINAL_STATUSES))})"
+                " AND next_poll <= ? AND (lease_until IS NULL OR lease_until < ?) ORDER BY next_poll LIMIT 1",
+                (*TERMINAL_STATUSES, now, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE bulk_batches SET lease_until = ? WHERE id = ?", (now + self.lease_seconds, row[0]))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row[0] if row else None
+
+    def reschedule(self, batch_id, status, poll_at):
+        self._connect().execute(
+            "UPDATE bulk_batches SET status = ?, next_poll = ?, lease_until = NULL, updated = ? WHERE id = ?",
+            (status, poll_at, time.time(), batch_id),
+        )
+
+    def pending_items(self, batch_id):
+        """{custom_id: item dict} of the batch's items still waiting for an answer"""
+        rows = self._connect().execute(
+            "SELECT custom_id, filename, cache_key, image_sha256, phash, created FROM bulk_items"
+            " WHERE batch_id = ? AND status = 'submitted'", (batch_id,)
+        ).fetchall()
+        columns = ("custom_id", "filename", "cache_key", "image_sha256", "phash", "created")
+        items = {row[0]: dict(zip(columns, row)) for row in rows}
+        for item in items.values():
+            item["phash"] = int(item["phash"]) if item["phash"] is not None else None
+        return items
+
+    def answer(self, custom_id, result):
+        """Record the result dict of one submitted item"""
+        self._connect().execute(
+            "UPDATE bulk_items SET status = ?, result = ?, error = ?, updated = ? WHERE custom_id = ?"
+            " AND status = 'submitted'",
+            ("done" if result["success"] else "failed", json.dumps(result) if result["success"] else None,
+             None if result["success"] else result["error"], time.time(), custom_id),
+        )
+
+    def finish(self, batch_id, status, error=None):
+        """Close a batch; its items still without an answer fail with `error`"""
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE bulk_items SET status = 'failed', error = ?, updated = ? WHERE batch_id = ? AND status = 'submitted'",
+                (error or f"No answer in the {status} batch", now, batch_id),
+            )
+            conn.execute("UPDATE bulk_batches SET status = ?, error = ?, lease_until = NULL, updated = ? WHERE id = ?",
+                         (status, error, now, batch_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, bulk_id):
+        """Status, per-status counts, batches and items of a bulk job, or None"""
+        conn = self._connect()
+        rows = conn.execute(
+            f"SELECT {', '.join(ITEM_COLUMNS)} FROM bulk_items WHERE bulk_id = ? ORDER BY rowid", (bulk_id,)
+        ).fetchall()
+        if not rows:
+            return None
+        items = []
+        counts = {"staged": 0, "submitted": 0, "done": 0, "failed": 0}
+        for row in rows:
+            item = dict(zip(ITEM_COLUMNS, row))
+            counts[item["status"]] += 1
+            item["result"] = json.loads(item["result"]) if item["result"] is not None else None
+            items.append({name: value for name, value in item.items() if value is not None})
+        batches = [
+            dict(zip(("id", "status", "error"), row))
+            for row in conn.execute("SELECT id, status, error FROM bulk_batches WHERE bulk_id = ?", (bulk_id,))
+        ]
+        return {
+            "bulk_id": bulk_id,
+            "status": "running" if counts["staged"] or counts["submitted"] else "done",
+            "counts": counts,
+            "batches": batches,
+            "items": items,
+        }
+
+
+class BulkRunner:
+    """Packages staged bulk jobs into provider batches and polls the batches, on a
+    background thread.
+
+    `prepare(filename, path)` turns one staged upload into (item fields, request body
+    bytes): the fields carry cache_key, image_sha256 and phash, or a final `status` with
+    its `result` / `error` and no body (answered from the cache, unreadable). `on_answer(item,
+    response, error)` turns one batch output line (`response` is {"status_code",
+    "body"}, or None with the line's `error`) into a result dict and stores it; the
+    runner keeps that result with the item.
+    """
+
+    def __init__(self, store, client, prepare, on_answer, staging_dir, poll_seconds=60,
+                 max_file_bytes=190 * 1024 * 1024, max_requests=50000):
+        self.store = store
+        self.client = client
+        self.prepare = prepare
+        self.on_answer = on_answer
+        self.staging_dir = staging_dir
+        self.poll_seconds = poll_seconds
+        self.max_file_bytes = max_file_bytes
+        self.max_requests = max_requests
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bulk-runner", daemon=True)
+        self._thread.start()
+
+    def stage(self, uploads):
+        """Save (filename, file storage) uploads to a staging directory and return the new
+        bulk job's id; packaging and submission happen on the runner thread"""
+        bulk_id = uuid.uuid4().hex
+        directory = os.path.join(self.staging_dir, bulk_id)
+        os.makedirs(directory)
+        try:
+            items = []
+            for index, (filename, file) in enumerate(uploads):
+                file.save(os.path.join(directory, str(index)))  # streamed, never read into memory whole
+                items.append((filename, str(index)))
+            self.store.stage(bulk_id, directory, items)
+        except Exception:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        self._wake.set()
+        return bulk_id
+
+    def package_once(self):
+        """Package and submit one staged bulk job; False when none was waiting.
+
+        Request bodies are spooled to JSONL files of at most `max_file_bytes` /
+        `max_requests` each; a file the provider rejects fails its items instead of the
+        whole job.
+        """
+        claimed = self.store.claim_staged()
+        if claimed is None:
+            return False
+        bulk_id, directory = claimed
+        self.store.purge()
+        finished, pending, size = [], [], 0
+        spool = tempfile.TemporaryFile()
+        try:
+            for item in self.store.staged_items(bulk_id):
+                self.store.extend_lease(bulk_id)
+                if len(finished) >= 100:
+                    self.store.packaged(bulk_id, finished)
+                    finished = []
+                try:
+                    fields, body = self.prepare(item["filename"], os.path.join(directory, item["staged_name"]))
+                except Exception as e:
+                    fields, body = {"status": "failed", "error": f"Error processing upload: {e}"}, None
+                item = dict(item, **fields)
+                if body is None:
+                    finished.append(item)
+                    continue
+                item["status"] = "submitted"
+                line = b"".join((
+                    b'{"custom_id": ', json.dumps(item["custom_id"]).encode("ascii"),
+                    b', "method": "POST", "url": "/v1/chat/completions", "body": ', body, b"}\n",
+                ))
+                if pending and (size + len(line) > self.max_file_bytes or len(pending) >= self.max_requests):
+                    self._submit_file(bulk_id, spool, pending)
+                    spool.close()
+                    spool, pending, size = tempfile.TemporaryFile(), [], 0
+                spool.write(line)
+                pending.append(item)
+                size += len(line)
+            if pending:
+                self._submit_file(bulk_id, spool, pending)
+        finally:
+            spool.close()
+        if finished:
+            self.store.packaged(bulk_id, finished)
+        self.store.unstage(bulk_id)
+        shutil.rmtree(directory, ignore_errors=True)
+        return True
+
+    def _submit_file(self, bulk_id, spool, items):
+        spool.seek(0)
+        try:
+            batch = self.client.create(self.client.upload(spool))
+        except (BatchAPIError, requests.exceptions.RequestException) as e:
+            print(f"❌ Bulk {bulk_id}: batch of {len(items)} requests not submitted: {e}")
+            self.store.packaged(bulk_id, [dict(item, status="failed", error=f"Batch not submitted: {e}") for item in items])
+            return
+        print(f"📦 Bulk {bulk_id}: submitted batch {batch['id']} with {len(items)} requests")
+        self.store.packaged(bulk_id, items, batch["id"], batch["status"], time.time() + self.poll_seconds)
+
+    def poll_once(self):
+        """Poll one due batch; False when none was due"""
+        batch_id = self.store.claim_due()
+        if batch_id is None:
+            return False
+        try:
+            batch = self.client.retrieve(batch_id)
+        except (BatchAPIError, requests.exceptions.RequestException) as e:
+            print(f"⚠️ Batch {batch_id} status unavailable: {e}")
+            self.store.reschedule(batch_id, "unknown", time.time() + self.poll_seconds)
+            return True
+        if batch["status"] not in TERMINAL_STATUSES:
+            self.store.reschedule(batch_id, batch["status"], time.time() + self.poll_seconds)
+            return True
+
+        items = self.store.pending_items(batch_id)
+        answered = succeeded = 0
+        error = None
+        try:
+            for file_id in (batch.get("output_file_id"), batch.get("error_file_id")):
+                for line in self.client.content(file_id) if file_id else []:
+                    item = items.pop(line.get("custom_id"), None)
+                    if item is None:
+                        continue
+                    result = self.on_answer(item, line.get("response"), line.get("error"))
+                    # Recorded at once: a retried download skips the items answered already
+                    self.store.answer(item["custom_id"], result)
+                    answered += 1
+                    succeeded += bool(result["success"])
+        except (BatchAPIError, requests.exceptions.RequestException) as e:
+            # Keep what was answered and try the download again on the next poll
+            print(f"⚠️ Batch {batch_id} results unavailable: {e}")
+            # Not its terminal status, which claim_due() would never pick up again
+            self.store.reschedule(batch_id, "finalizing", time.time() + self.poll_seconds)
+            return True
+        if batch["status"] != "completed":
+            error = f"Batch {batch['status']}"
+            errors = (batch.get("errors") or {}).get("data") or []
+            if errors:
+                error += f": {errors[0].get('message')}"
+        self.store.finish(batch_id, batch["status"], error)
+        print(f"📦 Batch {batch_id} {batch['status']}: {succeeded}/{answered + len(items)} analyses stored")
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                while self.package_once():
+                    pass
+                while self.poll_once():
+                    pass
+            except Exception as e:
+                print(f"⚠️ Bulk runner error: {e}")
+            self._wake.wait(min(self.poll_seconds, 5))
+            self._wake.clear()
@@ -0,0 +1,105 @@
+"""
+Model Cascade
+Short structured prompt for the cheap first-tier model, and the confidence check that
+decides whether its answer is kept or the analysis escalates to the full model
+"""
+
+import re
+
+CASCADE_PROMPT = """Identify this military or vintage tag. Answer with exactly these lines and nothing else:
+Item: <what the item is>
+Text: <the text on the tag, verbatim>
+Era: <estimated date or period>
+Context: <one or two sentences of historical context>
+Value: <current market value range in USD>
+Confidence: <0-100>%
+Write "unknown" for anything you cannot determine."""
+
+REQUIRED_FIELDS = ("Item", "Text", "Era", "Context", "Value")
+
+# Phrases that signal the model is guessing (cf. the "uncertain" check in image_analyzer.py)
+HEDGING_PHRASES = (
+    "uncertain", "not sure", "unsure", "unclear", "cannot determine", "can't determine",
+    "unable to", "hard to tell", "difficult to determine", "illegible", "cannot read", "can't read",
+)
+
+UNKNOWN_VALUES = {"", "unknown", "n/a", "na", "none", "-", "?", "not visible", "unreadable"}
+
+CONFIDENCE_WORDS = {"very high": 95, "high": 85, "medium": 60, "moderate": 60, "low": 30, "very low": 10}
+
+# Spaces only (not \s): an empty value must not run on into the next line
+FIELD_PATTERN = re.compile(r"^[ \t*#_-]*([A-Za-z ]+?)[ \t*_]*:[ \t*_]*(.*?)[ \t*_]*$", re.MULTILINE)
+
+
+def parse_fields(text):
+    """{field name: value} for the `Name: value` lines of a structured answer"""
+    fields = {}
+    for name, value in FIELD_PATTERN.findall(text):
+        fields.setdefault(name.strip().title(), value.strip())
+    return fields
+
+
+def reported_confidence(value):
+    """Self-reported confidence 0-100 from "85%", "0.85", "high", ... or None"""
+    if not value:
+        return None
+    match = re.search(r"\d+(?:\.\d+)?", value)
+    if match:
+        number = float(match.group())
+        if number <= 1 and "." in match.group() and "%" not in value:
+            return number * 100  # a fraction such as 0.85
+        return min(number, 100.0)
+    lowered = value.lower()
+    for word, number in sorted(CONFIDENCE_WORDS.items(), key=lambda item: -len(item[0])):
+        if word in lowered:
+            return float(number)
+    return None
+
+
+def assess(text, min_confidence=70):
+    """Confidence signals of a first-tier answer.
+
+    Returns {"confidence", "missing", "hedges", "reasons"}; an empty `reasons` list
+    means the answer is strong enough to keep.
+    """
+    fields = parse_fields(text)
+    missing = [name for name in REQUIRED_FIELDS if fields.get(name, "").lower() in UNKNOWN_VALUES]
+    lowered = text.lower()
+    hedges = [phrase for phrase in HEDGING_PHRASES if phrase in lowered]
+    confidence = reported_confidence(fields.get("Confidence"))
+
+    reasons = []
+    if missing:
+        reasons.append(f"missing {', '.join(missing)}")
+    if hedges:
+        reasons.append(f"hedging ({', '.join(hedges)})")
+    if confidence is None:
+        reasons.append("no self-reported confidence")
+    elif confidence < min_confidence:
+        reasons.append(f"confidence {confidence:.0f}% < {min_confidence:.0f}%")
+    return {"confidence": confidence, "missing": missing, "hedges": hedges, "reasons": reasons}
+
+
+def assess_structured(fields, min_confidence=70):
+    """assess() for the typed fields of a structured-output answer (OUTPUT_MODE=json)"""
+    present = {
+        "Item": fields["item"],
+        "Text": fields["text"],
+        "Era": fields["era"]["from"] is not None or fields["era"]["to"] is not None,
+        "Context": fields["context"],
+        "Value": fields["value_usd"]["low"] is not None or fields["value_usd"]["high"] is not None,
+    }
+    missing = [name for name in REQUIRED_FIELDS
+               if not present[name] or str(present[name]).lower() in UNKNOWN_VALUES]
+    lowered = " ".join(fields[name] or "" for name in ("item", "text", "context")).lower()
+    hedges = [phrase for phrase in HEDGING_PHRASES if phrase in lowered]
+    confidence = fields["confidence"]
+
+    reasons = []
+    if missing:
+        reasons.append(f"missing {', '.join(missing)}")
+    if hedges:
+        reasons.append(f"hedging ({', '.join(hedges)})")
+    if confidence < min_confidence:
+        reasons.append(f"confidence {confidence:.0f}% < {min_confidence:.0f}%")
+    return {"confidence": confidence, "missing": missing, "hedges": hedges, "reasons": reasons}
@@ -0,0 +1,23 @@
+"""
+Gunicorn hooks (loaded automatically from the working directory)
+Give every worker a shared Prometheus multiprocess directory so /metrics aggregates all
+workers, start each deployment with an empty one, and drop the live gauges of workers
+that exit
+"""
+
+import os
+import shutil
+
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join("cache", "metrics"))
+
+
+def on_starting(server):
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
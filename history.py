@@ -0,0 +1,164 @@
+"""
+Analysis History
+Every provider analysis persisted to SQLite with an FTS5 index over filename and result
+text, written by a background thread off the request path
+"""
+
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+COLUMNS = ("id", "created", "filename", "image_hash", "provider", "result", "elapsed", "hedged", "analysis")
+
+
+def fts_query(text):
+    """FTS5 MATCH expression for free text: every word must occur, as a prefix"""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return " ".join(f'"{term}"*' for term in terms if term)
+
+
+class HistoryStore:
+    """Append-only analyses table plus an external-content FTS5 index kept in sync by
+    triggers; pages are keyset-paginated on the row id (newest first)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS analyses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, filename TEXT NOT NULL,
+                image_hash TEXT NOT NULL, provider TEXT, result TEXT NOT NULL, elapsed REAL,
+                hedged INTEGER NOT NULL DEFAULT 0, analysis TEXT
+            );
+            CREATE INDEX IF NOT EXISTS analyses_image_hash ON analyses (image_hash);
+            CREATE VIRTUAL TABLE IF NOT EXISTS analyses_fts USING fts5(
+                filename, result, content='analyses', content_rowid='id'
+            );
+            CREATE TRIGGER IF NOT EXISTS analyses_fts_insert AFTER INSERT ON analyses BEGIN
+                INSERT INTO analyses_fts (rowid, filename, result) VALUES (new.id, new.filename, new.result);
+            END;
+            CREATE TRIGGER IF NOT EXISTS analyses_fts_delete AFTER DELETE ON analyses BEGIN
+                INSERT INTO analyses_fts (analyses_fts, rowid, filename, result)
+                VALUES ('delete', old.id, old.filename, old.result);
+            END;
+        """)
+        # Typed fields of structured-output analyses, added after the first release
+        if "analysis" not in {row[1] for row in conn.execute("PRAGMA table_info(analyses)")}:
+            conn.execute("ALTER TABLE analyses ADD COLUMN analysis TEXT")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add_many(self, entries):
+        """Insert entry dicts (filename, image_hash, provider, result, elapsed, hedged,
+        created and optionally analysis, a JSON string) in one transaction"""
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                "INSERT INTO analyses (created, filename, image_hash, provider, result, elapsed, hedged, analysis)"
+                " VALUES (:created, :filename, :image_hash, :provider, :result, :elapsed, :hedged, :analysis)",
+                [dict(entry, analysis=entry.get("analysis")) for entry in entries],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _page(self, sql, params, limit):
+        rows = self._connect().execute(sql, (*params, limit + 1)).fetchall()
+        items = [dict(zip(COLUMNS + ("snippet",), row)) for row in rows[:limit]]
+        for item in items:
+            item["hedged"] = bool(item["hedged"])
+            if item["analysis"] is None:
+                del item["analysis"]
+            else:
+                item["analysis"] = json.loads(item["analysis"])
+            if item.get("snippet") is None:
+                item.pop("snippet", None)
+        next_before = items[-1]["id"] if len(rows) > limit else None
+        return items, next_before
+
+    def recent(self, limit=20, before=None, image_hash=None):
+        """(items, next_before): newest analyses with id < `before`, optionally only those
+        of one image"""
+        where = ["id < ?"]
+        params = [before if before is not None else 2 ** 63 - 1]
+        if image_hash:
+            where.append("image_hash = ?")
+            params.append(image_hash)
+        return self._page(
+            f"SELECT {', '.join(COLUMNS)} FROM analyses WHERE {' AND '.join(where)} ORDER BY id DESC LIMIT ?",
+            params, limit,
+        )
+
+    def search(self, text, limit=20, before=None):
+        """(items, next_before): analyses whose filename or result text match every word
+        of `text`, newest first, each with a highlighted `snippet`"""
+        query = fts_query(text)
+        if not query:
+            return [], None
+        columns = ", ".join(f"analyses.{column}" for column in COLUMNS)
+        return self._page(
+            f"SELECT {columns}, snippet(analyses_fts, 1, '[', ']', '…', 12) FROM analyses_fts"
+            " JOIN analyses ON analyses.id = analyses_fts.rowid"
+            " WHERE analyses_fts MATCH ? AND analyses_fts.rowid < ? ORDER BY analyses_fts.rowid DESC LIMIT ?",
+            (query, before if before is not None else 2 ** 63 - 1), limit,
+        )
+
+
+class HistoryWriter:
+    """Background thread that batches history entries into the store.
+
+    Entries are dropped (with a warning) rather than written on the request thread when
+    the queue is full; pending entries are flushed at interpreter exit.
+    """
+
+    def __init__(self, store, max_pending=1024, batch_size=100):
+        self.store = store
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, entry):
+        entry.setdefault("created", time.time())
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            print(f"⚠️ History writer backlog full, dropping entry for {entry['filename']}")
+
+    def flush(self):
+        """Block until every queued entry has been written"""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.store.add_many(batch)
+            except sqlite3.Error as e:
+                print(f"❌ Failed to write {len(batch)} history entries: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
@@ -0,0 +1,177 @@
+"""
+Job Queue
+Persistent SQLite-backed analysis job queue with a local worker pool, so web workers
+only accept uploads and jobs survive restarts
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class JobQueue:
+    """Jobs table shared by every gunicorn worker on the host.
+
+    Jobs are claimed under a lease; a job whose worker died (lease expired) is picked
+    up again until it has been attempted `max_attempts` times.
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=3, retention_seconds=24 * 3600):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention_seconds = retention_seconds
+        self._local = threading.local()
+        self._enqueued = threading.Condition()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, filename TEXT NOT NULL, image BLOB,"
+            " result TEXT, error TEXT, attempts INTEGER NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL, updated REAL NOT NULL, lease_until REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created)")
+
+    def _connect(self):
+        """Per-thread autocommit connection; transactions are opened explicitly"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, filename, image_bytes):
+        """Store a new queued job and return its id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO jobs (id, status, filename, image, created, updated) VALUES (?, 'queued', ?, ?, ?, ?)",
+            (job_id, filename, sqlite3.Binary(image_bytes), now, now),
+        )
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?",
+            (now - self.retention_seconds,),
+        )
+        with self._enqueued:
+            self._enqueued.notify()
+        return job_id
+
+    def claim(self):
+        """Lease the oldest runnable job and return (job_id, filename, image_bytes), or None"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            while True:
+                row = conn.execute(
+                    "SELECT id, filename, image, attempts FROM jobs"
+                    " WHERE status = 'queued' OR (status = 'running' AND lease_until < ?)"
+                    " ORDER BY created LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                job_id, filename, image, attempts = row
+                if attempts >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, image = NULL, updated = ? WHERE id = ?",
+                        (f"Job abandoned after {attempts} attempts", now, job_id),
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated = ?"
+                    " WHERE id = ?",
+                    (now + self.lease_seconds, now, job_id),
+                )
+                conn.execute("COMMIT")
+                return job_id, filename, bytes(image)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def complete(self, job_id, result):
+        self._finish(job_id, "done", result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        self._finish(job_id, "failed", error=error)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, image = NULL, lease_until = NULL, updated = ?"
+            " WHERE id = ?",
+            (status, result, error, time.time(), job_id),
+        )
+
+    def get(self, job_id):
+        """Job status dict, or None for an unknown id"""
+        row = self._connect().execute(
+            "SELECT status, filename, result, error, attempts, created, updated FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        status, filename, result, error, attempts, created, updated = row
+        job = {
+            "job_id": job_id,
+            "status": status,
+            "filename": filename,
+            "attempts": attempts,
+            "created": created,
+            "updated": updated,
+        }
+        if result is not None:
+            job["result"] = json.loads(result)
+        if error is not None:
+            job["error"] = error
+        return job
+
+    def wait_for_work(self, timeout):
+        """Sleep until a job is enqueued by this process or `timeout` passes (other
+        processes' jobs are picked up on the next poll)"""
+        with self._enqueued:
+            self._enqueued.wait(timeout)
+
+
+class JobWorkerPool:
+    """Background threads that claim jobs and run `handler(filename, image_bytes)` on them"""
+
+    def __init__(self, job_queue, handler, workers=4, poll_interval=1.0):
+        self.job_queue = job_queue
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self._threads = [
+            threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                job = self.job_queue.claim()
+            except sqlite3.Error as e:
+                print(f"⚠️ Job queue unavailable: {e}")
+                job = None
+            if job is None:
+                self.job_queue.wait_for_work(self.poll_interval)
+                continue
+
+            job_id, filename, image_bytes = job
+            print(f"🧵 Running job {job_id} ({filename})")
+            try:
+                result = self.handler(filename, image_bytes)
+            except Exception as e:
+                print(f"❌ Job {job_id} failed: {e}")
+                self.job_queue.fail(job_id, f"Error processing image: {str(e)}")
+            else:
+                self.job_queue.complete(job_id, result)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Load Test
+Drives the real app:app under gunicorn with concurrent clients against local stub xAI /
+OpenAI providers, one scenario at a time, and reports throughput and latency
+percentiles. With --baseline it is a regression gate: exit status 1 when a scenario's
+throughput, p95 latency or success rate is worse than the baseline by more than the
+tolerance.
+
+Usage:
+    python load_test.py --save baseline.json
+    python load_test.py --baseline baseline.json --tolerance 0.15
+    python load_test.py --scenario steady --scenario outage --clients 64 --duration 20
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+from PIL import Image
+
+from bench_async import free_port, wait_for_health
+from stub_provider import start_stub_provider
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Provider profiles are StubProviderServer options; env overrides the app defaults below
+SCENARIOS = {
+    "steady": {
+        "description": "both providers healthy, 200 ms",
+        "xai": {"latency": 0.2},
+        "openai": {"latency": 0.2},
+    },
+    "slow_primary": {
+        "description": "xAI long-tailed (lognormal, median 1 s), OpenAI 200 ms",
+        "xai": {"latency": 1.0, "distribution": "lognormal", "spread": 0.6},
+        "openai": {"latency": 0.2},
+    },
+    "flaky_primary": {
+        "description": "30% of xAI calls fail with 500",
+        "xai": {"latency": 0.3, "distribution": "exponential", "error_rate": 0.3},
+        "openai": {"latency": 0.3, "distribution": "exponential"},
+    },
+    "throttle_bursts": {
+        "description": "xAI answers 429 (Retry-After 1 s) for 2 s out of every 5 s",
+        "xai": {"latency": 0.2, "burst_every": 5, "burst_length": 2, "retry_after": 1},
+        "openai": {"latency": 0.3},
+    },
+    "outage": {
+        "description": "xAI down (every call 500), OpenAI 300 ms",
+        "xai": {"latency": 0.05, "error_rate": 1.0},
+        "openai": {"latency": 0.3},
+    },
+    "repeat_uploads": {
+        "description": "8 distinct images uploaded over and over (result cache on)",
+        "xai": {"latency": 0.5},
+        "openai": {"latency": 0.5},
+        "images": 8,
+        "env": {"RESULT_CACHE": "on"},
+    },
+}
+
+APP_ENV = {
+    "RESULT_CACHE": "off",
+    "NEAR_DUPLICATES": "off",
+    "UPLOAD_PERSIST_MODE": "off",
+    "PROVIDER_BACKOFF_BASE_SECONDS": "0.1",
+}
+
+# Share of the OpenAI stub's answers with low confidence, so that with the cascade on
+# (the default) every scenario includes escalations to the full models
+WEAK_RATE = 0.3
+
+
+def make_images(count, size=(640, 480)):
+    """Distinct noise JPEGs, so uploads behave like photos in preprocessing"""
+    images = []
+    for _ in range(count):
+        output = io.BytesIO()
+        Image.effect_noise(size, 64).convert("RGB").save(output, "JPEG", quality=85)
+        images.append(output.getvalue())
+    return images
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def drive(base_url, clients, duration, images, unique):
+    """Run `clients` concurrent clients posting to /analyze for `duration` seconds.
+
+    With `unique` every upload gets random trailing bytes (ignored by decoders) so no
+    two requests share a cache key.
+    """
+    latencies = []
+    outcomes = {"ok": 0, "demo": 0, "error": 0}
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        deadline = time.monotonic() + duration
+
+        async def client_loop():
+            while time.monotonic() < deadline:
+                data = random.choice(images)
+                if unique:
+                    data += os.urandom(16)
+                started = time.monotonic()
+                try:
+                    response = await client.post("/analyze", files={"file": ("tag.jpg", data, "image/jpeg")})
+                    body = response.json()
+                except (httpx.HTTPError, ValueError):
+                    body = None
+                elapsed = time.monotonic() - started
+                if body is None or not body.get("success"):
+                    outcomes["error"] += 1
+                elif body.get("demo"):
+                    outcomes["demo"] += 1
+                else:
+                    outcomes["ok"] += 1
+                    latencies.append(elapsed)
+
+        started = time.monotonic()
+        await asyncio.gather(*(client_loop() for _ in range(clients)))
+        elapsed = time.monotonic() - started
+    return latencies, outcomes, elapsed
+
+
+def run_scenario(name, scenario, args):
+    xai = start_stub_provider(**scenario["xai"])
+    openai = start_stub_provider(**{"weak_rate": WEAK_RATE, **scenario["openai"]})
+    port = free_port()
+    env = dict(os.environ)
+    env.update(APP_ENV)
+    env.update({
+        "XAI_API_URL": xai.url,
+        "OPENAI_API_URL": openai.url,
+        "XAI_API_KEY": "stub-key",
+        "OPENAI_API_KEY": "stub-key",
+        "PROVIDER_POOL_SIZE": str(args.clients),
+    })
+    env.update(scenario.get("env", {}))
+    with tempfile.TemporaryDirectory(prefix=f"loadtest-{name}-") as workdir:
+        # Uploads, caches and metrics go to a scratch directory, not the checkout
+        env["PROMETHEUS_MULTIPROC_DIR"] = os.path.join(workdir, "metrics")
+        command = [
+            sys.executable, "-m", "gunicorn", "--config", os.path.join(ROOT, "gunicorn.conf.py"),
+            "--chdir", workdir, "--pythonpath", ROOT, "--workers", str(args.workers),
+            "--timeout", "120", "--bind", f"127.0.0.1:{port}", "app:app",
+        ]
+        process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            wait_for_health(base_url)
+            images = make_images(scenario.get("images", 16))
+            latencies, outcomes, elapsed = asyncio.run(
+                drive(base_url, args.clients, args.duration, images, unique="images" not in scenario)
+            )
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+            xai.shutdown()
+            openai.shutdown()
+
+    latencies.sort()
+    total = sum(outcomes.values())
+    return {
+        "requests": total,
+        "ok": outcomes["ok"],
+        "demo": outcomes["demo"],
+        "errors": outcomes["error"],
+        "success_rate": round(outcomes["ok"] / total, 4) if total else 0.0,
+        "throughput": round(outcomes["ok"] / elapsed, 3),
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "mean": statistics.fmean(latencies) if latencies else None,
+        "stub_calls": {"xAI": dict(xai.counts), "OpenAI": dict(openai.counts)},
+    }
+
+
+def print_report(name, scenario, result):
+    def seconds(value):
+        return f"{value:.3f}s" if value is not None else "-"
+
+    print(f"\n{name}: {scenario['description']}")
+    print(f"   Requests: {result['requests']} ({result['ok']} ok, {result['demo']} demo, {result['errors']} errors)")
+    print(f"   Throughput: {result['throughput']:.2f} req/s")
+    print(f"   Latency p50/p95/p99: {seconds(result['p50'])} / {seconds(result['p95'])} / {seconds(result['p99'])}")
+    calls = result["stub_calls"]
+    print("   Stub calls: " + ", ".join(
+        f"{provider} {c['ok']} ok / {c['errors']} 500 / {c['throttled']} 429" for provider, c in calls.items()
+    ))
+
+
+def compare(results, baseline, tolerance):
+    """Regression messages for every scenario worse than `baseline` beyond `tolerance`"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput']:.2f} < baseline {base['throughput']:.2f} req/s")
+        if base.get("p95") and result["p95"] and result["p95"] > base["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95']:.3f}s > baseline {base['p95']:.3f}s")
+        if result["success_rate"] < base["success_rate"] - tolerance:
+            regressions.append(f"{name}: success rate {result['success_rate']:.1%} < baseline {base['success_rate']:.1%}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable; default all)")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--save", help="write the results as JSON (a future --baseline)")
+    parser.add_argument("--baseline", help="JSON results to compare against; regressions exit with status 1")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    args = parser.parse_args()
+
+    names = args.scenario or list(SCENARIOS)
+    print("🎯 LOAD TEST")
+    print("=" * 50)
+    print(f"gunicorn app:app, {args.workers} workers, {args.clients} clients, {args.duration}s per scenario")
+
+    results = {}
+    for name in names:
+        results[name] = run_scenario(name, SCENARIOS[name], args)
+        print_report(name, SCENARIOS[name], results[name])
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Saved results to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\n❌ Performance regressions:")
+            for regression in regressions:
+                print(f"   {regression}")
+            sys.exit(1)
+        print(f"\n✅ No regressions beyond {args.tolerance:.0%} of the baseline")
+
+
+if __name__ == "__main__":
+    main()
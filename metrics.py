@@ -0,0 +1,88 @@
+"""
+Metrics
+Prometheus metrics for the analyzer. With PROMETHEUS_MULTIPROC_DIR set (gunicorn.conf.py
+does this) every worker process writes its samples to that directory and /metrics
+aggregates all of them
+"""
+
+import os
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+HTTP_REQUESTS = Counter(
+    "analyzer_http_requests_total", "HTTP requests by endpoint and status code", ["endpoint", "status"]
+)
+HTTP_IN_FLIGHT = Gauge(
+    "analyzer_http_requests_in_flight", "HTTP requests being served", ["endpoint"], multiprocess_mode="livesum"
+)
+PROVIDER_LATENCY = Histogram(
+    "analyzer_provider_request_seconds", "Provider call latency (retries included)", ["provider", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+PROVIDER_RESPONSES = Counter(
+    "analyzer_provider_responses_total",
+    "Provider responses by HTTP status code, or timeout / network_error / shed / circuit_open",
+    ["provider", "status"],
+)
+PROVIDER_IN_FLIGHT = Gauge(
+    "analyzer_provider_calls_in_flight", "Provider calls in progress", ["provider"], multiprocess_mode="livesum"
+)
+INVALID_OUTPUTS = Counter(
+    "analyzer_invalid_structured_outputs_total", "Provider answers rejected by the OUTPUT_MODE=json schema check",
+    ["provider"],
+)
+FALLBACKS = Counter(
+    "analyzer_fallbacks_total", "Analyses served by a provider after another one failed", ["from_provider", "to_provider"]
+)
+HEDGES = Counter("analyzer_hedged_requests_total", "Analyses for which a hedge request was started")
+COALESCED = Counter(
+    "analyzer_coalesced_requests_total", "Analyses answered with the result of an identical in-flight analysis"
+)
+CASCADE_TIER_LATENCY = Histogram(
+    "analyzer_cascade_tier_seconds", "Latency of each model cascade tier (mini, full)", ["tier"],
+    buckets=LATENCY_BUCKETS,
+)
+CASCADE_OUTCOMES = Counter(
+    "analyzer_cascade_total", "First-tier answers accepted or escalated to the full models", ["outcome"]
+)
+PRESCREEN_DECISIONS = Counter(
+    "analyzer_prescreen_decisions_total", "Local pre-screen decisions (tag or not_tag) by PRESCREEN_MODE",
+    ["decision", "mode"],
+)
+BULK_ITEMS = Counter(
+    "analyzer_bulk_items_total", "Bulk appraisal items by outcome (cached, submitted, done, failed)", ["status"]
+)
+DEMO_RESULTS = Counter("analyzer_demo_results_total", "Analyses answered with the demo result")
+CACHE_LOOKUPS = Counter(
+    "analyzer_cache_lookups_total", "Result cache lookups by result (memory, disk, similar or miss)", ["result"]
+)
+CROP_RATIO = Histogram(
+    "analyzer_tag_crop_ratio", "Share of the photo sent to providers after tag cropping (1 = not cropped)",
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.4, 0.6, 0.8, 1.0),
+)
+CROP_PROVIDER_LATENCY = Histogram(
+    "analyzer_tag_crop_provider_seconds", "Provider latency of cropped and uncropped (full) uploads", ["image"],
+    buckets=LATENCY_BUCKETS,
+)
+UPLOAD_BYTES = Histogram("analyzer_upload_bytes", "Size of uploaded images", buckets=SIZE_BUCKETS)
+ENCODED_BYTES = Histogram(
+    "analyzer_encoded_bytes", "Size of the image sent to providers after preprocessing", buckets=SIZE_BUCKETS
+)
+
+
+def render():
+    """(body, content_type) for a /metrics response, aggregated across worker processes
+    when PROMETHEUS_MULTIPROC_DIR is set"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,152 @@
+"""
+Near-Duplicate Index
+Perceptual (difference) hashes of analysed uploads, searchable by Hamming distance so a
+re-shot of the same tag can reuse the earlier analysis
+"""
+
+import io
+import os
+import sqlite3
+import threading
+import time
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from preprocessing import EXIF_ORIENTATION
+
+HASH_SIZE = 8  # 8x8 gradient bits = 64-bit hash
+CHUNKS = 4
+CHUNK_BITS = HASH_SIZE * HASH_SIZE // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def dhash(data):
+    """64-bit difference hash of an encoded image, or None when it cannot be decoded.
+
+    The image is reduced to 9x8 grey pixels and each bit records whether a pixel is
+    brighter than its right-hand neighbour, so small changes of angle, crop, lighting
+    or compression move only a few bits.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))  # JPEG: decode at reduced scale
+        if image.getexif().get(EXIF_ORIENTATION, 1) not in (0, 1):
+            image = ImageOps.exif_transpose(image)
+        pixels = list(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR).getdata())
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+        return None
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def split_hash(value):
+    """The hash's CHUNKS sub-strings, most significant first"""
+    return [(value >> (CHUNK_BITS * (CHUNKS - 1 - i))) & CHUNK_MASK for i in range(CHUNKS)]
+
+
+def join_hash(chunks):
+    value = 0
+    for chunk in chunks:
+        value = (value << CHUNK_BITS) | chunk
+    return value
+
+
+def neighbours(chunk, radius):
+    """Every CHUNK_BITS-bit value within Hamming `radius` of `chunk`"""
+    values = {chunk}
+    for _ in range(radius):
+        values |= {value ^ (1 << bit) for value in values for bit in range(CHUNK_BITS)}
+    return values
+
+
+class NearDuplicateIndex:
+    """Multi-index hashing over a SQLite table shared by every gunicorn worker.
+
+    Each 64-bit hash is stored as CHUNKS indexed 16-bit columns. Two hashes within
+    Hamming distance d agree to within d // CHUNKS bits on at least one chunk, so a
+    search only probes the indexed neighbours of each chunk and verifies the few
+    candidates, rather than scanning the table. Nothing is loaded at startup.
+
+    Every row carries a `scope` (the analysis configuration its result was produced
+    under) and a search only matches rows of the scope it is given.
+    """
+
+    def __init__(self, path, max_distance=6):
+        self.path = path
+        self.max_distance = max_distance
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        columns = ", ".join(f"c{i} INTEGER NOT NULL" for i in range(CHUNKS))
+        conn.execute(f"CREATE TABLE IF NOT EXISTS hashes (key TEXT PRIMARY KEY, {columns}, created REAL NOT NULL,"
+                     " scope TEXT NOT NULL DEFAULT '')")
+        if "scope" not in {row[1] for row in conn.execute("PRAGMA table_info(hashes)")}:
+            # Indexes from before scoping: their rows match no configuration's scope
+            conn.execute("ALTER TABLE hashes ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+        for i in range(CHUNKS):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS hashes_c{i} ON hashes (c{i})")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, value, key, scope=""):
+        """Index hash `value` for the cached result stored under `key`"""
+        self._connect().execute(
+            f"INSERT OR REPLACE INTO hashes (key, {', '.join(f'c{i}' for i in range(CHUNKS))}, created, scope)"
+            f" VALUES (?, {', '.join('?' * CHUNKS)}, ?, ?)",
+            (key, *split_hash(value), time.time(), scope),
+        )
+
+    def add_many(self, entries, scope=""):
+        """Bulk-index (value, key) pairs in one transaction"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN")
+        conn.executemany(
+            f"INSERT OR REPLACE INTO hashes (key, {', '.join(f'c{i}' for i in range(CHUNKS))}, created, scope)"
+            f" VALUES (?, {', '.join('?' * CHUNKS)}, ?, ?)",
+            ((key, *split_hash(value), now, scope) for value, key in entries),
+        )
+        conn.execute("COMMIT")
+
+    def remove(self, key):
+        self._connect().execute("DELETE FROM hashes WHERE key = ?", (key,))
+
+    def search(self, value, max_distance=None, scope=""):
+        """[(distance, key)] of hashes indexed in `scope` within `max_distance` bits,
+        nearest first"""
+        if max_distance is None:
+            max_distance = self.max_distance
+        radius = max_distance // CHUNKS
+        queries = []
+        params = []
+        for i, chunk in enumerate(split_hash(value)):
+            probes = sorted(neighbours(chunk, radius))
+            queries.append(
+                f"SELECT key, {', '.join(f'c{j}' for j in range(CHUNKS))} FROM hashes"
+                f" WHERE c{i} IN ({', '.join('?' * len(probes))}) AND scope = ?"
+            )
+            params.extend([*probes, scope])
+        rows = self._connect().execute(" UNION ".join(queries), params).fetchall()
+        matches = []
+        for key, *chunks in rows:
+            distance = bin(join_hash(chunks) ^ value).count("1")
+            if distance <= max_distance:
+                matches.append((distance, key))
+        matches.sort()
+        return matches
+
+    def count(self):
+        return self._connect().execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
@@ -9,6 +9,8 @@ import json
 import sys
 import os
 
+import provider_client
+
 # Your OpenAI API key
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
 
@@ -41,7 +43,7 @@ def analyze_with_openai(base64_image):
     
     try:
         print("🤖 Sending request to OpenAI...")
-        response = requests.post(url, headers=headers, json=payload, timeout=30)
+        response = provider_client.post(url, headers=headers, json=payload, timeout=30)
         
         if response.status_code == 200:
             result = response.json()["choices"][0]["message"]["content"]
@@ -0,0 +1,130 @@
+"""
+Image Preprocessing
+Normalises uploads before they are sent to a provider: EXIF orientation, optional
+cropping to the tag region, downscaling to the resolution the providers actually use,
+and re-encoding to JPEG/WebP
+"""
+
+import io
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from tag_region import find_tag_region
+
+EXIF_ORIENTATION = 0x0112
+
+FORMAT_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+}
+
+
+def sniff_mime_type(data):
+    """MIME type from the file signature, or None when unrecognised"""
+    header = bytes(data[:12])
+    if header.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    if header.startswith(b"RIFF") and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def target_size(width, height, max_long_side, max_short_side):
+    """Largest size within both limits that keeps the aspect ratio (never upscales).
+
+    The defaults mirror OpenAI high-detail vision: fit in 2048x2048, then shortest
+    side 768; anything larger is downscaled by the provider anyway.
+    """
+    scale = min(1.0, max_long_side / max(width, height), max_short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def flatten(image):
+    """RGB version of `image` for JPEG encoding, transparency composited onto white"""
+    if image.mode in ("RGBA", "LA", "P"):
+        rgba = image.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, (255, 255, 255))
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        return flat
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+
+def make_thumbnail(data, size, output_format="WEBP", quality=80):
+    """Return (bytes, mime_type) of an upload oriented and downscaled to fit in size x size
+    (never upscaled); raises OSError / ValueError / DecompressionBombError when Pillow
+    cannot decode it"""
+    image = Image.open(io.BytesIO(data))
+    if image.format == "JPEG":
+        image.draft("RGB", (size, size))  # decode at 1/2 to 1/8 scale directly
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((size, size), Image.LANCZOS, reducing_gap=3.0)
+    output = io.BytesIO()
+    options = {"method": 4} if output_format == "WEBP" else {"optimize": True}
+    flatten(image).save(output, format=output_format, quality=quality, **options)
+    return output.getvalue(), FORMAT_MIME_TYPES[output_format]
+
+
+def prepare_image(data, max_long_side=2048, max_short_side=768, output_format="JPEG", quality=85,
+                  crop_tag=False, min_crop_confidence=0.6, max_crop_ratio=0.6):
+    """Return (bytes, mime_type, info) ready to send to a provider.
+
+    With `crop_tag` the image is cropped to the detected label (see tag_region.py) before
+    downscaling, so the label keeps more of its resolution; `info["crop"]` reports the
+    detection. The original bytes are kept when they are already small enough, correctly
+    oriented, uncropped and in a provider-supported format, or when Pillow cannot decode
+    them.
+    """
+    original_mime = sniff_mime_type(data) or "image/jpeg"
+    info = {"original_bytes": len(data), "original_mime": original_mime}
+    try:
+        return _prepare(data, info, max_long_side, max_short_side, output_format, quality,
+                        crop_tag, min_crop_confidence, max_crop_ratio)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError) as e:
+        # Pillow decodes lazily, so a truncated file can fail at crop, resize or save
+        info.update({"processed": False, "error": str(e), "bytes": len(data), "mime": original_mime})
+        return data, original_mime, info
+
+
+def _prepare(data, info, max_long_side, max_short_side, output_format, quality,
+             crop_tag, min_crop_confidence, max_crop_ratio):
+    """prepare_image() for `data` that Pillow may fail to decode at any step"""
+    original_mime = info["original_mime"]
+    image = Image.open(io.BytesIO(data))
+    original_size = image.size
+    rotated = image.getexif().get(EXIF_ORIENTATION, 1) not in (0, 1)
+    oriented = ImageOps.exif_transpose(image) if rotated else image
+
+    cropped = False
+    if crop_tag:
+        region = find_tag_region(oriented, min_crop_confidence, max_crop_ratio)
+        info["crop"] = dict(region, box=list(region["box"]) if region["box"] else None)
+        if region["applied"]:
+            oriented = oriented.crop(region["box"])
+            cropped = True
+
+    size = target_size(oriented.width, oriented.height, max_long_side, max_short_side)
+    info.update({"original_size": list(original_size), "size": list(size)})
+    unchanged = size == oriented.size and not rotated and not cropped
+    if unchanged and original_mime in ("image/jpeg", "image/webp"):
+        info.update({"processed": False, "bytes": len(data), "mime": original_mime})
+        return data, original_mime, info
+
+    if size != oriented.size:
+        oriented = oriented.resize(size, Image.LANCZOS)
+    oriented = flatten(oriented)
+
+    output = io.BytesIO()
+    oriented.save(output, format=output_format, quality=quality, optimize=True)
+    encoded = output.getvalue()
+    if unchanged and original_mime == "image/png" and len(encoded) >= len(data):
+        info.update({"processed": False, "bytes": len(data), "mime": original_mime})
+        return data, original_mime, info
+    mime = FORMAT_MIME_TYPES[output_format]
+    info.update({"processed": True, "bytes": len(encoded), "mime": mime})
+    return encoded, mime, info
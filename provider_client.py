@@ -0,0 +1,147 @@
+"""
+Provider Client
+Pooled keep-alive HTTP sessions per provider host with jittered, Retry-After-aware retries
+"""
+
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+POOL_SIZE = int(os.environ.get('PROVIDER_POOL_SIZE', '10'))
+MAX_RETRIES = int(os.environ.get('PROVIDER_MAX_RETRIES', '2'))
+BACKOFF_BASE_SECONDS = float(os.environ.get('PROVIDER_BACKOFF_BASE_SECONDS', '0.5'))
+BACKOFF_MAX_SECONDS = float(os.environ.get('PROVIDER_BACKOFF_MAX_SECONDS', '8'))
+# Seconds one call may take including retries; serial fallbacks multiply it, so keep
+# (providers tried in a row) x budget below gunicorn's 120 s worker timeout
+RETRY_BUDGET_SECONDS = float(os.environ.get('PROVIDER_RETRY_BUDGET_SECONDS', '35'))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(url):
+    """Shared keep-alive session for the host of `url`, created on first use"""
+    host = urlsplit(url).netloc
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[host] = session
+        return session
+
+
+def parse_retry_after(value):
+    """Seconds from a Retry-After header (delta-seconds or HTTP date), or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def retry_delay(attempt, response=None):
+    """Seconds to sleep before retry number `attempt` (0-based), or None to give up.
+
+    A 429 with Retry-After waits exactly that long, and gives up when that is longer
+    than BACKOFF_MAX_SECONDS so the caller can fall back instead. Everything else uses
+    full-jitter exponential backoff.
+    """
+    if response is not None and response.status_code == 429:
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            return retry_after if retry_after <= BACKOFF_MAX_SECONDS else None
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def request_not_sent(error):
+    """Whether a requests ConnectionError happened before any of the request was sent
+    (connect timeout, refused connection, DNS failure). After that, e.g. "Connection
+    aborted" once the body is out, the provider may have run and billed the call."""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def attempt_seconds(timeout):
+    """Longest an attempt with a requests `timeout` (seconds or a (connect, read) pair)
+    can take before timing out; 0 when unbounded"""
+    if isinstance(timeout, tuple):
+        return sum(part or 0 for part in timeout)
+    return timeout or 0
+
+
+def within_budget(started, delay, timeout, budget=None):
+    """Whether a retry after `delay` seconds, taking up to `timeout` seconds, still ends
+    within `budget` (default RETRY_BUDGET_SECONDS) of `started` (time.monotonic())"""
+    if budget is None:
+        budget = RETRY_BUDGET_SECONDS
+    return time.monotonic() - started + delay + timeout <= budget
+
+
+def post(url, headers=None, json=None, data=None, timeout=30, max_retries=None, stream=False, retry_budget=None):
+    """POST through the pooled session for `url`, retrying 429/5xx and connection errors
+    that happened before the request was sent.
+
+    Returns the last response; read timeouts and other request errors are raised
+    to the caller, as with a bare `requests.post`.
+    """
+    return request("POST", url, headers=headers, json=json, data=data, timeout=timeout, max_retries=max_retries,
+                   stream=stream, retry_budget=retry_budget)
+
+
+def get(url, headers=None, timeout=30, max_retries=None, stream=False, retry_budget=None):
+    """GET with the same pooling and retries as post()"""
+    return request("GET", url, headers=headers, timeout=timeout, max_retries=max_retries, stream=stream,
+                   retry_budget=retry_budget)
+
+
+def request(method, url, max_retries=None, retry_budget=None, **kwargs):
+    """No retry starts unless it can finish within `retry_budget` seconds of the first
+    attempt (default RETRY_BUDGET_SECONDS)"""
+    if max_retries is None:
+        max_retries = MAX_RETRIES
+    session = get_session(url)
+    started = time.monotonic()
+    timeout = attempt_seconds(kwargs.get("timeout"))
+    attempt = 0
+    while True:
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            if attempt >= max_retries or not request_not_sent(e):
+                raise
+            delay = retry_delay(attempt)
+            if not within_budget(started, delay, timeout, retry_budget):
+                raise
+            print(f"🔁 Connection error to {urlsplit(url).netloc}, retrying in {delay:.2f}s...")
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt >= max_retries:
+                return response
+            delay = retry_delay(attempt, response)
+            if delay is None or not within_budget(started, delay, timeout, retry_budget):
+                return response
+            response.close()
+            print(f"🔁 HTTP {response.status_code} from {urlsplit(url).netloc}, retrying in {delay:.2f}s...")
+        time.sleep(delay)
+        attempt += 1
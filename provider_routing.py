@@ -0,0 +1,255 @@
+"""
+Provider Routing
+Latency tracking and hedged execution for the xAI / OpenAI analysis providers
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies (seconds) per provider"""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider, seconds):
+        with self._lock:
+            samples = self._samples.setdefault(provider, deque(maxlen=self.window))
+            samples.append(seconds)
+
+    def count(self, provider):
+        with self._lock:
+            return len(self._samples.get(provider, ()))
+
+    def percentile(self, provider, pct):
+        """Nearest-rank percentile of the recorded latencies, or None without samples"""
+        with self._lock:
+            samples = sorted(self._samples.get(provider, ()))
+        if not samples:
+            return None
+        rank = max(0, min(len(samples) - 1, int(round(pct / 100.0 * len(samples))) - 1))
+        return samples[rank]
+
+    def snapshot(self):
+        with self._lock:
+            providers = list(self._samples)
+        return {
+            provider: {
+                "count": self.count(provider),
+                "p50": self.percentile(provider, 50),
+                "p95": self.percentile(provider, 95),
+                "p99": self.percentile(provider, 99),
+            }
+            for provider in providers
+        }
+
+
+def hedge_delay(tracker, provider, percentile, default, min_delay, max_delay, min_samples=20):
+    """Seconds to wait on `provider` before hedging, derived from its latency percentile.
+
+    Falls back to `default` until `min_samples` successful calls have been observed.
+    """
+    if tracker.count(provider) < min_samples:
+        return default
+    observed = tracker.percentile(provider, percentile)
+    return max(min_delay, min(max_delay, observed))
+
+
+class HedgedRunner:
+    """Runs a primary provider call and hedges with a secondary one after a delay.
+
+    The first successful result wins. A losing call that is still in flight cannot be
+    interrupted mid-request, so it is abandoned: its result is discarded, but it still
+    finishes in the background and its latency is still observed.
+    """
+
+    def __init__(self, max_workers=8):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hedge")
+
+    def run(self, primary, secondary, delay):
+        """Run `primary` and `secondary` ((name, callable) pairs) and return (result, failures).
+
+        `secondary` starts once `primary` has failed or `delay` seconds have passed
+        without an answer; a delay of 0 starts both at once.
+        """
+        started = time.monotonic()
+        pending = {self._executor.submit(primary[1]): primary[0]}
+        secondary_started = False
+        hedged = False
+        failures = []
+
+        if delay <= 0:
+            pending[self._executor.submit(secondary[1])] = secondary[0]
+            secondary_started = hedged = True
+        else:
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                print(f"⏱️ {primary[0]} slower than {delay:.2f}s, hedging with {secondary[0]}...")
+                pending[self._executor.submit(secondary[1])] = secondary[0]
+                secondary_started = hedged = True
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                result = future.result()
+                if result["success"]:
+                    for other in pending:
+                        other.cancel()
+                    result["hedged"] = hedged
+                    result["elapsed"] = round(time.monotonic() - started, 3)
+                    return result, failures
+                failures.append((name, result))
+                if not secondary_started:
+                    print(f"🔄 {name} failed, falling back to {secondary[0]}...")
+                    pending[self._executor.submit(secondary[1])] = secondary[0]
+                    secondary_started = True
+
+        return None, failures
+
+
+class CircuitBreaker:
+    """Per-provider rolling error rate / latency with closed, open and half-open states.
+
+    A provider opens once at least `min_calls` calls in the last `window_seconds`
+    failed at `error_threshold` or more. After `open_seconds` it becomes half-open and
+    lets `half_open_probes` calls through: a successful probe closes it again, a
+    failed one re-opens it. State is per worker process; `clock` is injectable for
+    tests.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, window_seconds=60, min_calls=5, error_threshold=0.5, open_seconds=30, half_open_probes=1,
+                 clock=time.monotonic):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_threshold = error_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._clock = clock
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def _get(self, provider):
+        health = self._providers.get(provider)
+        if health is None:
+            health = self._providers[provider] = {
+                "state": self.CLOSED,
+                "calls": deque(),
+                "opened_at": None,
+                "probes": 0,
+                "transitions": 0,
+                "last_error": None,
+            }
+        return health
+
+    def _prune(self, health, now):
+        calls = health["calls"]
+        while calls and calls[0][0] < now - self.window_seconds:
+            calls.popleft()
+
+    def _refresh(self, health, now):
+        """Move an open circuit to half-open once its cool-down has passed"""
+        if health["state"] == self.OPEN and now - health["opened_at"] >= self.open_seconds:
+            self._transition(health, self.HALF_OPEN)
+            health["probes"] = 0
+
+    def _transition(self, health, state):
+        health["state"] = state
+        health["transitions"] += 1
+
+    def allow(self, provider):
+        """Whether a call to `provider` may start now (claims a probe slot when half-open)"""
+        now = self._clock()
+        with self._lock:
+            health = self._get(provider)
+            self._refresh(health, now)
+            if health["state"] == self.CLOSED:
+                return True
+            if health["state"] == self.HALF_OPEN and health["probes"] < self.half_open_probes:
+                health["probes"] += 1
+                return True
+            return False
+
+    def release(self, provider):
+        """Give back a probe slot claimed by allow() for a call that was cancelled"""
+        with self._lock:
+            health = self._get(provider)
+            health["probes"] = max(0, health["probes"] - 1)
+
+    def record(self, provider, success, latency, error=None):
+        now = self._clock()
+        with self._lock:
+            health = self._get(provider)
+            health["calls"].append((now, success, latency))
+            self._prune(health, now)
+            if not success:
+                health["last_error"] = error
+            if health["state"] == self.HALF_OPEN:
+                health["probes"] = max(0, health["probes"] - 1)
+                if success:
+                    print(f"🟢 {provider} circuit closed after a successful probe")
+                    self._transition(health, self.CLOSED)
+                    health["calls"].clear()
+                else:
+                    print(f"🔴 {provider} circuit re-opened after a failed probe")
+                    self._transition(health, self.OPEN)
+                    health["opened_at"] = now
+            elif health["state"] == self.CLOSED:
+                calls = health["calls"]
+                failures = sum(1 for _, ok, _ in calls if not ok)
+                if len(calls) >= self.min_calls and failures / len(calls) >= self.error_threshold:
+                    print(f"🔴 {provider} circuit opened ({failures}/{len(calls)} calls failed)")
+                    self._transition(health, self.OPEN)
+                    health["opened_at"] = now
+
+    def _stats(self, health, now):
+        self._prune(health, now)
+        calls = health["calls"]
+        failures = sum(1 for _, ok, _ in calls if not ok)
+        latencies = sorted(latency for _, ok, latency in calls if ok)
+        return {
+            "state": health["state"],
+            "calls": len(calls),
+            "error_rate": round(failures / len(calls), 3) if calls else 0.0,
+            "p50_latency": latencies[len(latencies) // 2] if latencies else None,
+        }
+
+    def route(self, providers):
+        """`providers` reordered by health (closed first, then lower error rate), without
+        those whose circuit is open; ties keep the given preference order"""
+        now = self._clock()
+        rank = {self.CLOSED: 0, self.HALF_OPEN: 1}
+        ranked = []
+        with self._lock:
+            for provider in providers:
+                health = self._get(provider)
+                self._refresh(health, now)
+                stats = self._stats(health, now)
+                if stats["state"] == self.OPEN:
+                    continue
+                ranked.append(((rank[stats["state"]], round(stats["error_rate"], 1)), provider))
+        ranked.sort(key=lambda item: item[0])
+        return [provider for _, provider in ranked]
+
+    def snapshot(self):
+        now = self._clock()
+        with self._lock:
+            snapshot = {}
+            for provider, health in self._providers.items():
+                self._refresh(health, now)
+                stats = self._stats(health, now)
+                stats["transitions"] = health["transitions"]
+                stats["last_error"] = health["last_error"]
+                if health["state"] == self.OPEN:
+                    stats["retry_in"] = round(max(0.0, self.open_seconds - (now - health["opened_at"])), 1)
+                snapshot[provider] = stats
+            return snapshot
@@ -0,0 +1,144 @@
+"""
+Rate Limiter
+Token buckets for provider requests-per-minute and tokens-per-minute quotas, kept in
+SQLite so every gunicorn worker on the host draws from the same budget
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class ProviderRateLimiter:
+    """Shared RPM / TPM token buckets per provider.
+
+    `limits` maps a provider to `(requests_per_minute, tokens_per_minute)`; 0 means
+    unlimited. Each bucket holds at most one minute of quota and refills continuously.
+    Buckets are read, refilled and debited inside one `BEGIN IMMEDIATE` transaction, so
+    concurrent workers never spend the same quota twice. `clock` (wall time, shared by
+    the workers) is injectable for tests.
+    """
+
+    def __init__(self, path, limits, clock=time.time):
+        self.path = path
+        self._clock = clock
+        self.limits = {provider: (float(rpm), float(tpm)) for provider, (rpm, tpm) in limits.items()}
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " provider TEXT PRIMARY KEY, requests REAL NOT NULL, tokens REAL NOT NULL,"
+            " updated REAL NOT NULL, blocked_until REAL NOT NULL DEFAULT 0)"
+        )
+
+    def _connect(self):
+        """Per-thread autocommit connection; transactions are opened explicitly"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def limited(self, provider):
+        return any(self.limits.get(provider, (0, 0)))
+
+    def _load(self, conn, provider, now):
+        """Current (requests, tokens, blocked_until) for `provider`, refilled up to `now`"""
+        rpm, tpm = self.limits[provider]
+        row = conn.execute(
+            "SELECT requests, tokens, updated, blocked_until FROM buckets WHERE provider = ?", (provider,)
+        ).fetchone()
+        if row is None:
+            return rpm, tpm, 0.0
+        requests, tokens, updated, blocked_until = row
+        elapsed = max(0.0, now - updated)
+        return (min(rpm, requests + elapsed * rpm / 60),
+                min(tpm, tokens + elapsed * tpm / 60),
+                blocked_until)
+
+    def _store(self, conn, provider, requests, tokens, now, blocked_until):
+        conn.execute(
+            "INSERT OR REPLACE INTO buckets (provider, requests, tokens, updated, blocked_until)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (provider, requests, tokens, now, blocked_until),
+        )
+
+    def try_acquire(self, provider, tokens=0):
+        """Take one request and `tokens` tokens from the buckets.
+
+        Returns 0 when the quota was taken, otherwise the seconds until it could be
+        (nothing is taken in that case).
+        """
+        if not self.limited(provider):
+            return 0.0
+        rpm, tpm = self.limits[provider]
+        tokens = min(tokens, tpm) if tpm else 0
+        conn = self._connect()
+        now = self._clock()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            available_requests, available_tokens, blocked_until = self._load(conn, provider, now)
+            waits = [blocked_until - now]
+            if rpm and available_requests < 1:
+                waits.append((1 - available_requests) * 60 / rpm)
+            if tpm and available_tokens < tokens:
+                waits.append((tokens - available_tokens) * 60 / tpm)
+            wait = max(waits)
+            if wait <= 0:
+                self._store(conn, provider, available_requests - 1 if rpm else 0,
+                            available_tokens - tokens, now, blocked_until)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return max(0.0, wait)
+
+    def acquire(self, provider, tokens=0, max_wait=0.0):
+        """Block for up to `max_wait` seconds for quota; False means the call should be
+        shed because the quota will not be there in time"""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self.try_acquire(provider, tokens)
+            if wait <= 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def penalize(self, provider, seconds):
+        """Hold every worker's calls to `provider` for `seconds` (after a 429 from it)"""
+        if not self.limited(provider):
+            return
+        conn = self._connect()
+        now = self._clock()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            requests, tokens, blocked_until = self._load(conn, provider, now)
+            self._store(conn, provider, requests, tokens, now, max(blocked_until, now + seconds))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def snapshot(self):
+        """Remaining quota per limited provider"""
+        conn = self._connect()
+        now = self._clock()
+        snapshot = {}
+        for provider, (rpm, tpm) in self.limits.items():
+            if not self.limited(provider):
+                continue
+            requests, tokens, blocked_until = self._load(conn, provider, now)
+            snapshot[provider] = {
+                "requests_per_minute": rpm,
+                "tokens_per_minute": tpm,
+                "requests_available": round(requests, 2) if rpm else None,
+                "tokens_available": round(tokens) if tpm else None,
+                "blocked_for": round(max(0.0, blocked_until - now), 1),
+            }
+        return snapshot
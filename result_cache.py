@@ -0,0 +1,122 @@
+"""
+Result Cache
+Content-addressed cache of analysis results: an in-process LRU tier in front of a
+SQLite tier that is shared by every gunicorn worker on the host
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_key(image_bytes, prompt, model):
+    """SHA-256 cache key over the uploaded bytes, the prompt and the model"""
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image_bytes).digest())
+    digest.update(b"\0" + prompt.encode("utf-8"))
+    digest.update(b"\0" + model.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory LRU + SQLite) result cache with TTL and size-based eviction"""
+
+    def __init__(self, path, memory_entries=256, ttl_seconds=7 * 24 * 3600, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL, size INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+    def _connect(self):
+        """Per-thread SQLite connection (WAL so workers can read while another writes)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return (result, tier) where tier is 'memory' or 'disk', or (None, None) on a miss"""
+        now = time.time()
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                result, created = entry
+                if now - created < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    return dict(result), "memory"
+                del self._memory[key]
+
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None, None
+                value, created = row
+                if now - created >= self.ttl_seconds:
+                    conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                    return None, None
+                conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+        except sqlite3.Error as e:
+            print(f"⚠️ Result cache read failed: {e}")
+            return None, None
+
+        result = json.loads(value)
+        self._remember(key, result, created)
+        return dict(result), "disk"
+
+    def set(self, key, result):
+        now = time.time()
+        self._remember(key, result, now)
+        value = json.dumps(result)
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO results (key, value, created, accessed, size) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, now, now, len(value)),
+                )
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            print(f"⚠️ Result cache write failed: {e}")
+
+    def _remember(self, key, result, created):
+        with self._memory_lock:
+            self._memory[key] = (result, created)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _evict(self, conn, now):
+        """Drop expired rows, then least-recently-accessed rows until under max_bytes"""
+        conn.execute("DELETE FROM results WHERE created < ?", (now - self.ttl_seconds,))
+        (total,) = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY accessed"):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM results WHERE key = ?", stale)
@@ -0,0 +1,114 @@
+import io
+import json
+import time
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from bulk import BatchAPIError, BatchClient, BulkRunner, BulkStore
+from stub_provider import start_stub_provider
+
+
+class FlakyClient(BatchClient):
+    """Drops the connection after the first line of the first download"""
+
+    failed = False
+
+    def content(self, file_id):
+        lines = super().content(file_id)
+        if not self.failed:
+            self.failed = True
+            yield lines[0]
+            raise BatchAPIError("File download failed: connection reset")
+        yield from lines
+
+
+@pytest.fixture
+def stub():
+    server = start_stub_provider(latency=0, batch_latency=0.2, error_rate=0.3, seed=4)
+    yield server
+    server.shutdown()
+
+
+def prepare(filename, path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if filename == "cached.jpg":
+        return {"status": "done", "result": {"success": True, "result": "from cache", "provider": "OpenAI"}}, None
+    if filename == "broken.jpg":
+        raise OSError("cannot read upload")
+    fields = {"cache_key": f"key-{filename}", "image_sha256": data.decode(), "phash": 2**64 - 1}
+    body = {"model": "stub", "messages": [{"role": "user", "content": data.decode()}]}
+    return fields, json.dumps(body).encode()
+
+
+def wait_until_done(store, bulk_id, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        bulk = store.get(bulk_id)
+        if bulk["status"] == "done":
+            return bulk
+        time.sleep(0.05)
+    raise AssertionError(f"bulk job still running: {store.get(bulk_id)['counts']}")
+
+
+def run_bulk(tmp_path, client, filenames):
+    answers = []
+
+    def on_answer(item, response, error=None):
+        answers.append(item["custom_id"])
+        assert item["phash"] == 2**64 - 1  # survives the round trip through SQLite
+        if response is None or response["status_code"] != 200:
+            return {"success": False, "error": f"HTTP {response['status_code'] if response else '-'}"}
+        content = response["body"]["choices"][0]["message"]["content"]
+        return {"success": True, "result": content, "provider": "OpenAI", "cache_key": item["cache_key"]}
+
+    store = BulkStore(str(tmp_path / "bulk.sqlite3"))
+    runner = BulkRunner(store, client, prepare, on_answer, str(tmp_path / "staging"),
+                        poll_seconds=0.05, max_requests=3)
+    uploads = [(name, FileStorage(io.BytesIO(name.encode()), filename=name)) for name in filenames]
+    bulk = wait_until_done(store, runner.stage(uploads))
+    return bulk, answers
+
+
+def test_submits_polls_and_fans_out_answers(tmp_path, stub):
+    filenames = [f"tag-{n}.jpg" for n in range(8)] + ["cached.jpg", "broken.jpg"]
+    bulk, answers = run_bulk(tmp_path, BatchClient(stub.url.rsplit("/chat/", 1)[0], "key"), filenames)
+
+    assert len(bulk["batches"]) == 3  # max_requests=3 splits the 8 requests
+    assert all(batch["status"] == "completed" for batch in bulk["batches"])
+    items = {item["filename"]: item for item in bulk["items"]}
+    assert items["cached.jpg"]["status"] == "done" and items["cached.jpg"]["result"]["result"] == "from cache"
+    assert "cannot read upload" in items["broken.jpg"]["error"]
+    submitted = [items[name] for name in filenames[:8]]
+    assert sorted(answers) == sorted(item["custom_id"] for item in submitted)  # one answer each
+    assert {item["status"] for item in submitted} == {"done", "failed"}  # error_rate=0.3
+    for item in submitted:
+        if item["status"] == "done":
+            assert item["result"]["cache_key"] == f"key-{item['filename']}"
+    assert bulk["counts"]["done"] + bulk["counts"]["failed"] == len(filenames)
+    assert not (tmp_path / "staging" / bulk["bulk_id"]).exists()
+
+
+def test_interrupted_download_does_not_answer_items_twice(tmp_path, stub):
+    filenames = [f"tag-{n}.jpg" for n in range(3)]
+    client = FlakyClient(stub.url.rsplit("/chat/", 1)[0], "key")
+    bulk, answers = run_bulk(tmp_path, client, filenames)
+
+    assert client.failed
+    assert sorted(answers) == sorted(item["custom_id"] for item in bulk["items"])
+    assert all(item["status"] in ("done", "failed") for item in bulk["items"])
+    assert bulk["batches"][0]["status"] == "completed"
+
+
+def test_rejected_batch_file_fails_only_its_items(tmp_path, stub):
+    class RejectingClient(BatchClient):
+        def upload(self, fileobj):
+            raise BatchAPIError("File upload failed (400): invalid file")
+
+    bulk, answers = run_bulk(tmp_path, RejectingClient(stub.url.rsplit("/chat/", 1)[0], "key"),
+                             ["tag-0.jpg", "cached.jpg"])
+    items = {item["filename"]: item for item in bulk["items"]}
+    assert items["tag-0.jpg"]["status"] == "failed" and "Batch not submitted" in items["tag-0.jpg"]["error"]
+    assert items["cached.jpg"]["status"] == "done"
+    assert answers == [] and bulk["batches"] == []
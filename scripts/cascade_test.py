@@ -0,0 +1,160 @@
+import importlib
+
+import pytest
+
+from cascade import CASCADE_PROMPT, assess, assess_structured, parse_fields, reported_confidence
+from stub_provider import stub_content
+
+STRONG = """Item: US Army M1 helmet liner tag
+Text: WESTINGHOUSE 1944
+Era: 1944
+Context: Liners of this maker were issued to US infantry in the second half of the war.
+Value: $150-300
+Confidence: 88%"""
+
+
+def answer(**changes):
+    fields = parse_fields(STRONG)
+    fields.update(changes)
+    return "\n".join(f"{name}: {value}" for name, value in fields.items())
+
+
+def test_strong_answer_is_kept():
+    assessment = assess(STRONG)
+    assert assessment == {"confidence": 88.0, "missing": [], "hedges": [], "reasons": []}
+
+
+def test_markdown_decorated_fields_are_parsed():
+    text = "**Item:** helmet liner\n- **Text**: WESTINGHOUSE\n## Era: 1944\n_Context_: issued\nValue: $150\nConfidence: 90%"
+    assert parse_fields(text) == {"Item": "helmet liner", "Text": "WESTINGHOUSE", "Era": "1944",
+                                  "Context": "issued", "Value": "$150", "Confidence": "90%"}
+    assert assess(text)["reasons"] == []
+
+
+@pytest.mark.parametrize("value", ["unknown", "Unknown", "N/A", "-", "?", "none", "not visible", ""])
+def test_unknown_fields_escalate(value):
+    assessment = assess(answer(Text=value, Value=value))
+    assert assessment["missing"] == ["Text", "Value"]
+    assert assessment["reasons"] == ["missing Text, Value"]
+
+
+def test_absent_field_escalates():
+    text = "\n".join(line for line in STRONG.splitlines() if not line.startswith("Era"))
+    assert assess(text)["missing"] == ["Era"]
+
+
+@pytest.mark.parametrize("phrase", ["uncertain", "Not sure", "hard to tell", "partly illegible", "I can't read"])
+def test_hedging_phrases_escalate(phrase):
+    assessment = assess(answer(Context=f"Possibly a liner, {phrase} about the maker."))
+    assert assessment["hedges"] and assessment["reasons"][0].startswith("hedging")
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("88%", 88.0), ("88", 88.0), ("0.88", 88.0), ("1.0", 100.0), ("1", 1.0), ("1%", 1.0),
+    ("150%", 100.0), ("about 75 percent", 75.0), ("High", 85.0), ("very low", 10.0),
+    ("moderate", 60.0), ("none given", None), ("", None), (None, None),
+])
+def test_reported_confidence(value, expected):
+    assert reported_confidence(value) == expected
+
+
+def test_confidence_threshold():
+    assert assess(answer(Confidence="70%"), min_confidence=70)["reasons"] == []
+    assert assess(answer(Confidence="69%"), min_confidence=70)["reasons"] == ["confidence 69% < 70%"]
+    assert assess(answer(Confidence="unsure"))["reasons"] == ["hedging (unsure)", "no self-reported confidence"]
+    text = "\n".join(line for line in STRONG.splitlines() if not line.startswith("Confidence"))
+    assert assess(text)["reasons"] == ["no self-reported confidence"]
+
+
+FIELDS = {
+    "item": "helmet liner tag", "materials": ["cotton"], "text": "WESTINGHOUSE 1944",
+    "era": {"from": 1943, "to": 1945}, "context": "Issued to US infantry.",
+    "value_usd": {"low": 150.0, "high": None}, "confidence": 88.0,
+}
+
+
+def test_structured_answer_is_kept():
+    assert assess_structured(FIELDS)["reasons"] == []
+
+
+def test_structured_missing_hedging_and_confidence():
+    fields = dict(FIELDS, text=None, era={"from": None, "to": None}, item="Unknown",
+                  context="Hard to tell which maker.", confidence=50.0)
+    assessment = assess_structured(fields)
+    assert assessment["missing"] == ["Item", "Text", "Era"]
+    assert assessment["hedges"] == ["hard to tell"]
+    assert assessment["reasons"][-1] == "confidence 50% < 70%"
+    assert assess_structured(dict(FIELDS, value_usd={"low": None, "high": None}))["missing"] == ["Value"]
+    assert assess_structured(dict(FIELDS, value_usd={"low": 0.0, "high": None}))["missing"] == []
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = importlib.import_module("app")
+    monkeypatch.setattr(app, "CASCADE_MIN_CONFIDENCE", 70)
+    return app
+
+
+def fake_calls(app, monkeypatch, first, full):
+    calls = []
+
+    def call_provider(provider, *args):
+        calls.append(provider)
+        return dict(first)
+
+    def run_providers(*args):
+        calls.append("full")
+        return dict(full)
+
+    monkeypatch.setattr(app, "call_provider", call_provider)
+    monkeypatch.setattr(app, "run_providers", run_providers)
+    return calls
+
+
+def test_run_cascade_keeps_a_strong_first_tier_answer(app, monkeypatch):
+    first = {"success": True, "result": STRONG, "provider": "OpenAI-mini"}
+    calls = fake_calls(app, monkeypatch, first, {})
+    result = app.run_cascade("image")
+    assert calls == [app.CASCADE_PROVIDER]
+    assert result["cascade"]["tier"] == "mini" and not result["cascade"]["escalated"]
+    assert result["cascade"]["confidence"] == 88.0
+
+
+def test_run_cascade_escalates_a_weak_answer(app, monkeypatch):
+    first = {"success": True, "result": answer(Confidence="40%"), "provider": "OpenAI-mini"}
+    full = {"success": True, "result": "full analysis", "provider": "xAI"}
+    calls = fake_calls(app, monkeypatch, first, full)
+    result = app.run_cascade("image")
+    assert calls == [app.CASCADE_PROVIDER, "full"]
+    assert result["provider"] == "xAI" and result["cascade"]["tier"] == "full"
+    assert result["cascade"]["reasons"] == ["confidence 40% < 70%"]
+
+
+def test_run_cascade_keeps_the_weak_answer_when_the_full_models_fail(app, monkeypatch):
+    first = {"success": True, "result": answer(Text="unknown"), "provider": "OpenAI-mini"}
+    fake_calls(app, monkeypatch, first, {"success": False, "error": "All providers failed"})
+    result = app.run_cascade("image")
+    assert result["success"] and result["provider"] == "OpenAI-mini"
+    assert result["cascade"]["tier"] == "mini" and result["cascade"]["escalated"]
+    assert result["full_error"] == "All providers failed"
+
+
+def test_run_cascade_escalates_a_failed_first_tier_and_structured_answers(app, monkeypatch):
+    fake_calls(app, monkeypatch, {"success": False, "error": "HTTP 500"}, {"success": True, "result": "x",
+                                                                         "provider": "OpenAI"})
+    assert app.run_cascade("image")["cascade"]["reasons"] == [f"{app.CASCADE_MODEL} failed: HTTP 500"]
+
+    structured = {"success": True, "result": "rendered", "provider": "OpenAI-mini",
+                  "analysis": dict(FIELDS, confidence=95.0)}
+    calls = fake_calls(app, monkeypatch, structured, {})
+    assert app.run_cascade("image")["cascade"]["confidence"] == 95.0
+    assert calls == [app.CASCADE_PROVIDER]  # the structured fields, not the rendering, were judged
+
+
+def test_stub_answers_the_cascade_prompt_in_its_format():
+    payload = {"messages": [{"role": "user", "content": [{"type": "text", "text": CASCADE_PROMPT},
+                                                         {"type": "image_url", "image_url": {"url": "data:"}}]}]}
+    assert assess(stub_content(payload))["reasons"] == []
+    assert assess(stub_content(payload, confidence=40))["reasons"] == ["confidence 40% < 70%"]
+    assert "ANALYSIS RESULT" in stub_content({"messages": [{"role": "user", "content": "Analyze"}]})
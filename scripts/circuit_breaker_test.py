@@ -0,0 +1,104 @@
+from provider_routing import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock, **options):
+    options = {"window_seconds": 60, "min_calls": 4, "error_threshold": 0.5, "open_seconds": 30, **options}
+    return CircuitBreaker(clock=clock, **options)
+
+
+def test_opens_at_error_threshold_after_min_calls():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    breaker.record("xAI", False, 0.1)
+    breaker.record("xAI", False, 0.1)
+    breaker.record("xAI", True, 0.1)
+    # 2/3 failed, but fewer than min_calls
+    assert breaker.snapshot()["xAI"]["state"] == CircuitBreaker.CLOSED
+    assert breaker.allow("xAI")
+
+    breaker.record("xAI", True, 0.1)  # 2/4 = threshold
+    assert breaker.snapshot()["xAI"]["state"] == CircuitBreaker.OPEN
+    assert not breaker.allow("xAI")
+    assert breaker.route(["xAI", "OpenAI"]) == ["OpenAI"]
+
+
+def test_stays_closed_below_threshold_and_forgets_old_calls():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        breaker.record("xAI", False, 0.1)
+    clock.now += 61  # the failures leave the window
+    for _ in range(3):
+        breaker.record("xAI", True, 0.1)
+    breaker.record("xAI", False, 0.1)
+    assert breaker.snapshot()["xAI"]["state"] == CircuitBreaker.CLOSED
+
+
+def open_breaker(clock, **options):
+    breaker = make_breaker(clock, **options)
+    for _ in range(4):
+        breaker.record("xAI", False, 0.1, "HTTP 500")
+    assert breaker.snapshot()["xAI"]["state"] == CircuitBreaker.OPEN
+    return breaker
+
+
+def test_half_open_after_cooldown_with_a_single_probe_slot():
+    clock = FakeClock()
+    breaker = open_breaker(clock)
+    clock.now += 29.9
+    assert not breaker.allow("xAI")
+    assert breaker.snapshot()["xAI"]["retry_in"] == 0.1
+
+    clock.now += 0.1
+    assert breaker.allow("xAI")  # the probe
+    assert breaker.snapshot()["xAI"]["state"] == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow("xAI")  # only one probe at a time
+
+    breaker.release("xAI")  # probe cancelled before it ran
+    assert breaker.allow("xAI")
+
+
+def test_successful_probe_closes_the_circuit():
+    clock = FakeClock()
+    breaker = open_breaker(clock)
+    clock.now += 30
+    assert breaker.allow("xAI")
+    breaker.record("xAI", True, 0.2)
+    snapshot = breaker.snapshot()["xAI"]
+    assert snapshot["state"] == CircuitBreaker.CLOSED
+    assert snapshot["calls"] == 0  # the failures that opened it are cleared
+    assert breaker.allow("xAI") and breaker.allow("xAI")
+
+
+def test_failed_probe_reopens_for_another_cooldown():
+    clock = FakeClock()
+    breaker = open_breaker(clock)
+    clock.now += 30
+    assert breaker.allow("xAI")
+    breaker.record("xAI", False, 0.2, "timeout")
+    snapshot = breaker.snapshot()["xAI"]
+    assert snapshot["state"] == CircuitBreaker.OPEN
+    assert snapshot["last_error"] == "timeout"
+    assert snapshot["retry_in"] == 30
+    assert snapshot["transitions"] == 3  # open, half-open, open
+
+    clock.now += 30
+    assert breaker.allow("xAI")
+
+
+def test_route_prefers_closed_then_lower_error_rate():
+    clock = FakeClock()
+    breaker = make_breaker(clock, min_calls=10)
+    breaker.record("xAI", False, 0.1)
+    breaker.record("xAI", True, 0.1)
+    breaker.record("OpenAI", True, 0.1)
+    assert breaker.route(["xAI", "OpenAI"]) == ["OpenAI", "xAI"]
+    assert breaker.route(["xAI", "Other"]) == ["Other", "xAI"]
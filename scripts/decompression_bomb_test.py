@@ -0,0 +1,34 @@
+import io
+
+import pytest
+from PIL import Image
+
+from near_duplicates import dhash
+from preprocessing import make_thumbnail, prepare_image
+from prescreen import image_features
+from upload_store import UploadStore
+
+
+@pytest.fixture
+def bomb(monkeypatch):
+    """A PNG over twice Pillow's pixel limit, which Image.open refuses to decode"""
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+    output = io.BytesIO()
+    Image.new("RGB", (100, 100), "white").save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_decode_failures_are_reported_not_raised(bomb):
+    assert image_features(bomb) is None
+    assert dhash(bomb) is None
+    data, mime, info = prepare_image(bomb)
+    assert data == bomb and mime == "image/png"
+    assert info["processed"] is False and "decompression bomb" in info["error"]
+    with pytest.raises(Image.DecompressionBombError):
+        make_thumbnail(bomb, 128)
+
+
+def test_bomb_upload_gets_no_thumbnail(bomb, tmp_path):
+    store = UploadStore(str(tmp_path / "uploads"))
+    store.put("tag.png", bomb)
+    assert store.derivative(store.lookup("tag.png"), 128) is None
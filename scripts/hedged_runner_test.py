@@ -0,0 +1,123 @@
+import importlib
+import threading
+
+import pytest
+
+from provider_routing import HedgedRunner, LatencyTracker, hedge_delay
+
+
+class FakeProvider:
+    """A provider call that answers `result` once released (immediately by default)"""
+
+    def __init__(self, name, success=True, release=True):
+        self.name = name
+        self.success = success
+        self.calls = 0
+        self.started = threading.Event()
+        self.released = threading.Event()
+        if release:
+            self.released.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        assert self.released.wait(10)
+        if self.success:
+            return {"success": True, "result": f"{self.name} answer", "provider": self.name}
+        return {"success": False, "error": f"{self.name} failed"}
+
+    def pair(self):
+        return self.name, self
+
+
+@pytest.fixture
+def runner():
+    runner = HedgedRunner(max_workers=4)
+    yield runner
+    runner._executor.shutdown(wait=True)
+
+
+def test_primary_answer_before_the_delay_is_not_hedged(runner):
+    primary, secondary = FakeProvider("xAI"), FakeProvider("OpenAI")
+    result, failures = runner.run(primary.pair(), secondary.pair(), delay=10)
+    assert result["provider"] == "xAI" and result["hedged"] is False
+    assert failures == [] and secondary.calls == 0
+
+
+def test_slow_primary_is_hedged_after_the_delay(runner):
+    primary, secondary = FakeProvider("xAI", release=False), FakeProvider("OpenAI")
+    result, failures = runner.run(primary.pair(), secondary.pair(), delay=0.05)
+    assert result["provider"] == "OpenAI" and result["hedged"] is True
+    assert failures == [] and primary.started.is_set()
+    primary.released.set()  # the abandoned call finishes in the background
+
+
+def test_hedged_primary_can_still_win(runner):
+    primary = FakeProvider("xAI", release=False)
+    secondary = FakeProvider("OpenAI", release=False)
+    threading.Thread(target=lambda: secondary.started.wait(10) and primary.released.set()).start()
+    result, _ = runner.run(primary.pair(), secondary.pair(), delay=0.05)
+    assert result["provider"] == "xAI" and result["hedged"] is True
+    secondary.released.set()
+
+
+def test_failed_primary_falls_back_without_waiting_for_the_delay(runner):
+    primary, secondary = FakeProvider("xAI", success=False), FakeProvider("OpenAI")
+    result, failures = runner.run(primary.pair(), secondary.pair(), delay=10)
+    assert result["provider"] == "OpenAI" and result["hedged"] is False
+    assert failures == [("xAI", {"success": False, "error": "xAI failed"})]
+
+
+def test_parallel_mode_starts_both_at_once(runner):
+    primary, secondary = FakeProvider("xAI", release=False), FakeProvider("OpenAI", release=False)
+    # the primary can only answer once the secondary is running alongside it
+    threading.Thread(target=lambda: secondary.started.wait(10) and primary.released.set()).start()
+    result, failures = runner.run(primary.pair(), secondary.pair(), delay=0)
+    assert result["provider"] == "xAI" and result["hedged"] is True
+    assert failures == [] and secondary.started.is_set()
+    secondary.released.set()
+
+
+def test_both_failing_returns_every_failure(runner):
+    primary, secondary = FakeProvider("xAI", success=False), FakeProvider("OpenAI", success=False)
+    result, failures = runner.run(primary.pair(), secondary.pair(), delay=10)
+    assert result is None
+    assert [name for name, _ in failures] == ["xAI", "OpenAI"]
+
+
+def test_hedge_delay_uses_the_default_below_min_samples():
+    tracker = LatencyTracker()
+    for _ in range(19):
+        tracker.record("xAI", 3.0)
+    assert hedge_delay(tracker, "xAI", 95, 8, 1, 20) == 8
+    tracker.record("xAI", 3.0)
+    assert hedge_delay(tracker, "xAI", 95, 8, 1, 20) == 3.0
+    assert hedge_delay(tracker, "xAI", 95, 8, 5, 20) == 5  # clamped to the bounds
+    assert hedge_delay(tracker, "xAI", 95, 8, 1, 2) == 2
+    assert hedge_delay(tracker, "OpenAI", 95, 8, 1, 20) == 8
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = importlib.import_module("app")
+    monkeypatch.setattr(app, "route_providers", lambda: ["xAI", "OpenAI"])
+    monkeypatch.setattr(app, "current_hedge_delay", lambda provider="xAI": 10)
+    return app
+
+
+@pytest.mark.parametrize("mode", ["delay", "off"])
+def test_run_providers_returns_the_last_failure(app, monkeypatch, mode):
+    providers = {"xAI": FakeProvider("xAI", success=False), "OpenAI": FakeProvider("OpenAI", success=False)}
+    monkeypatch.setattr(app, "HEDGE_MODE", mode)
+    monkeypatch.setattr(app, "call_provider", lambda provider, *args: providers[provider]())
+    assert app.run_providers("image") == {"success": False, "error": "OpenAI failed"}
+    assert providers["xAI"].calls == providers["OpenAI"].calls == 1
+
+
+@pytest.mark.parametrize("mode", ["delay", "off"])
+def test_run_providers_falls_back_to_the_secondary(app, monkeypatch, mode):
+    providers = {"xAI": FakeProvider("xAI", success=False), "OpenAI": FakeProvider("OpenAI")}
+    monkeypatch.setattr(app, "HEDGE_MODE", mode)
+    monkeypatch.setattr(app, "call_provider", lambda provider, *args: providers[provider]())
+    assert app.run_providers("image")["provider"] == "OpenAI"
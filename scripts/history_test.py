@@ -0,0 +1,157 @@
+import sqlite3
+import threading
+
+import pytest
+
+from history import HistoryStore, HistoryWriter, fts_query
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path / "history.sqlite3"))
+
+
+def entry(filename="tag.jpg", result="WWII dog tag, stainless steel", **fields):
+    return {"filename": filename, "image_hash": "hash", "provider": "xAI", "result": result,
+            "elapsed": 1.5, "hedged": False, "created": 1000.0, **fields}
+
+
+def ids(page):
+    items, next_before = page
+    return [item["id"] for item in items], next_before
+
+
+def test_fts_query_quotes_every_word_as_a_prefix():
+    assert fts_query("dog  tag") == '"dog"* "tag"*'
+    assert fts_query('say "hi" OR') == '"say"* """hi"""* "OR"*'
+    assert fts_query("   ") == ""
+
+
+def test_search_matches_every_word_as_a_prefix(store):
+    store.add_many([
+        entry("smith.jpg", "WWII dog tag, stainless steel"),
+        entry("medal.jpg", "Bronze service medal"),
+        entry("jones.jpg", "Korean War dog tag, aluminium"),
+    ])
+    assert [item["filename"] for item in store.search("dog")[0]] == ["jones.jpg", "smith.jpg"]
+    assert [item["filename"] for item in store.search("stain do")[0]] == ["smith.jpg"]
+    assert [item["filename"] for item in store.search("medal")[0]] == ["medal.jpg"]  # filename too
+    assert store.search("dog bronze") == ([], None)
+    assert store.search('"') == ([], None)  # quotes cannot break out of the MATCH expression
+    assert store.search("   ") == ([], None)
+
+    (item,), _ = store.search("korean")
+    assert item["snippet"] == "[Korean] War dog tag, aluminium"
+    assert item["hedged"] is False and "analysis" not in item
+
+
+def test_typed_analysis_round_trips(store):
+    store.add_many([entry(hedged=True, analysis='{"item": "dog tag", "era": {"from": 1941, "to": 1945}}')])
+    (item,), _ = store.recent()
+    assert item["analysis"] == {"item": "dog tag", "era": {"from": 1941, "to": 1945}}
+    assert item["hedged"] is True
+
+
+def test_triggers_keep_the_index_in_sync(store):
+    store.add_many([entry("first.jpg", "dog tag"), entry("second.jpg", "dog tag")])
+    conn = store._connect()
+    conn.execute("DELETE FROM analyses WHERE filename = 'first.jpg'")
+    assert [item["filename"] for item in store.search("dog")[0]] == ["second.jpg"]
+    # the external-content index still agrees with its table
+    conn.execute("INSERT INTO analyses_fts (analyses_fts, rank) VALUES ('integrity-check', 1)")
+
+
+def test_recent_pages_newest_first(store):
+    store.add_many([entry(f"{n}.jpg", image_hash="even" if n % 2 == 0 else "odd") for n in range(1, 6)])
+    assert ids(store.recent(limit=2)) == ([5, 4], 4)
+    assert ids(store.recent(limit=2, before=4)) == ([3, 2], 2)
+    assert ids(store.recent(limit=2, before=2)) == ([1], None)
+    assert ids(store.recent(limit=2, before=1)) == ([], None)
+    assert ids(store.recent(limit=5)) == ([5, 4, 3, 2, 1], None)  # a full last page has no next
+    assert ids(store.recent(limit=4)) == ([5, 4, 3, 2], 2)
+    assert ids(store.recent(limit=2, image_hash="even")) == ([4, 2], None)
+
+
+def test_search_pages_newest_first(store):
+    store.add_many([entry(result="dog tag" if n != 3 else "medal") for n in range(1, 6)])
+    assert ids(store.search("dog", limit=2)) == ([5, 4], 4)
+    assert ids(store.search("dog", limit=2, before=4)) == ([2, 1], None)
+
+
+def test_adds_the_analysis_column_to_an_old_table(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE analyses (id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL,"
+        " filename TEXT NOT NULL, image_hash TEXT NOT NULL, provider TEXT, result TEXT NOT NULL,"
+        " elapsed REAL, hedged INTEGER NOT NULL DEFAULT 0)"
+    )
+    conn.close()
+    store = HistoryStore(path)
+    store.add_many([entry(analysis='{"item": "dog tag"}')])
+    assert store.recent()[0][0]["analysis"] == {"item": "dog tag"}
+
+
+class RecordingStore:
+    """Stands in for the store: records batches, waits on `gate`, fails while `failing`"""
+
+    def __init__(self):
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.failing = False
+
+    def add_many(self, entries):
+        self.gate.wait(timeout=10)
+        if self.failing:
+            raise sqlite3.OperationalError("database is locked")
+        self.batches.append([item["filename"] for item in entries])
+
+
+def test_writer_flushes_everything_in_batches(store):
+    writer = HistoryWriter(store, batch_size=3)
+    for n in range(10):
+        writer.submit(entry(f"{n}.jpg"))
+    writer.flush()
+    items, _ = store.recent(limit=20)
+    assert [item["filename"] for item in items] == [f"{n}.jpg" for n in reversed(range(10))]
+
+
+def test_writer_batches_what_is_queued_and_stamps_created():
+    target = RecordingStore()
+    target.gate.clear()
+    writer = HistoryWriter(target, batch_size=3)
+    submitted = {"filename": "first.jpg"}
+    writer.submit(submitted)
+    assert "created" in submitted
+    for n in range(7):
+        writer.submit({"filename": f"{n}.jpg"})
+    target.gate.set()
+    writer.flush()
+    assert sum(target.batches, []) == ["first.jpg"] + [f"{n}.jpg" for n in range(7)]
+    assert max(len(batch) for batch in target.batches) == 3
+
+
+def test_writer_drops_entries_when_the_backlog_is_full(capsys):
+    target = RecordingStore()
+    target.gate.clear()
+    writer = HistoryWriter(target, max_pending=2, batch_size=1)
+    for n in range(5):
+        writer.submit({"filename": f"{n}.jpg"})
+    target.gate.set()
+    writer.flush()
+    # one entry was being written while the queue held two more
+    assert 2 <= len(sum(target.batches, [])) <= 3
+    assert "dropping entry for 4.jpg" in capsys.readouterr().out
+
+
+def test_writer_survives_a_failed_write():
+    target = RecordingStore()
+    target.failing = True
+    writer = HistoryWriter(target)
+    writer.submit({"filename": "lost.jpg"})
+    writer.flush()  # does not hang on the failed batch
+    target.failing = False
+    writer.submit({"filename": "kept.jpg"})
+    writer.flush()
+    assert target.batches == [["kept.jpg"]]
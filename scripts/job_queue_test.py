@@ -0,0 +1,122 @@
+import threading
+import time
+
+import pytest
+
+from job_queue import JobQueue, JobWorkerPool
+
+
+def make_queue(tmp_path, **options):
+    return JobQueue(str(tmp_path / "jobs.sqlite3"), **options)
+
+
+def wait_for_status(queue, job_id, statuses=("done", "failed"), timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job still {queue.get(job_id)['status']}")
+
+
+def test_jobs_are_claimed_once_in_order_and_their_results_kept(tmp_path):
+    queue = make_queue(tmp_path)
+    first = queue.enqueue("a.jpg", b"first")
+    second = queue.enqueue("b.jpg", b"second")
+    assert queue.get(first)["status"] == "queued"
+
+    assert queue.claim() == (first, "a.jpg", b"first")
+    assert queue.claim() == (second, "b.jpg", b"second")
+    assert queue.claim() is None  # both leased
+    assert queue.get(first)["status"] == "running" and queue.get(first)["attempts"] == 1
+
+    queue.complete(first, {"success": True, "result": "tag"})
+    queue.fail(second, "Error processing image: broken")
+    assert queue.get(first)["result"] == {"success": True, "result": "tag"}
+    assert queue.get(second)["status"] == "failed" and queue.get(second)["error"].endswith("broken")
+    assert "result" not in queue.get(second)
+    assert queue.claim() is None
+    assert queue.get("unknown") is None
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.05)
+    job_id = queue.enqueue("a.jpg", b"image")
+    assert queue.claim()[0] == job_id
+    assert queue.claim() is None  # lease still held
+    time.sleep(0.1)  # the worker died
+    assert queue.claim() == (job_id, "a.jpg", b"image")
+    assert queue.get(job_id)["attempts"] == 2
+
+
+def test_job_fails_after_max_attempts(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.05, max_attempts=2)
+    job_id = queue.enqueue("a.jpg", b"image")
+    later = queue.enqueue("b.jpg", b"image")
+    for _ in range(2):
+        assert queue.claim()[0] == job_id
+        assert queue.claim()[0] == later
+        time.sleep(0.1)
+    assert queue.claim() is None
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and job["error"] == "Job abandoned after 2 attempts"
+    assert queue._connect().execute("SELECT image FROM jobs WHERE id = ?", (job_id,)).fetchone() == (None,)
+
+
+def test_finished_jobs_are_purged_after_retention(tmp_path):
+    queue = make_queue(tmp_path, retention_seconds=0.05)
+    job_id = queue.enqueue("a.jpg", b"image")
+    queue.claim()
+    queue.complete(job_id, {"success": True})
+    time.sleep(0.1)
+    pending = queue.enqueue("b.jpg", b"image")  # purges on enqueue
+    assert queue.get(job_id) is None
+    assert queue.get(pending)["status"] == "queued"
+
+
+def test_concurrent_claimers_share_no_job(tmp_path):
+    queue = make_queue(tmp_path)
+    job_ids = {queue.enqueue(f"{n}.jpg", b"image") for n in range(40)}
+    claimed, lock = [], threading.Lock()
+
+    def claimer():
+        other = make_queue(tmp_path)  # another worker process's connection
+        while (job := other.claim()) is not None:
+            with lock:
+                claimed.append(job[0])
+
+    threads = [threading.Thread(target=claimer) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(job_ids)
+
+
+def test_worker_pool_runs_jobs_and_records_failures(tmp_path):
+    queue = make_queue(tmp_path)
+
+    def handler(filename, image_bytes):
+        if filename == "broken.jpg":
+            raise OSError("cannot identify image file")
+        return {"success": True, "result": image_bytes.decode()}
+
+    JobWorkerPool(queue, handler, workers=2, poll_interval=0.05)
+    ok = queue.enqueue("a.jpg", b"answer")
+    broken = queue.enqueue("broken.jpg", b"")
+    assert wait_for_status(queue, ok)["result"] == {"success": True, "result": "answer"}
+    job = wait_for_status(queue, broken)
+    assert job["status"] == "failed"
+    assert job["error"] == "Error processing image: cannot identify image file"
+
+
+@pytest.mark.parametrize("attempts", [1, 3])
+def test_attempts_are_counted_per_claim(tmp_path, attempts):
+    queue = make_queue(tmp_path, lease_seconds=0.02, max_attempts=attempts)
+    job_id = queue.enqueue("a.jpg", b"image")
+    for _ in range(attempts):
+        assert queue.claim()[0] == job_id
+        time.sleep(0.05)
+    assert queue.claim() is None
+    assert queue.get(job_id)["attempts"] == attempts
@@ -0,0 +1,151 @@
+import importlib
+import io
+import random
+import sqlite3
+
+import pytest
+from PIL import Image
+
+from near_duplicates import CHUNK_BITS, CHUNKS, NearDuplicateIndex, join_hash, split_hash
+from result_cache import ResultCache
+
+BITS = CHUNKS * CHUNK_BITS
+
+
+def flip(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+def brute_force(entries, value, max_distance):
+    matches = [(bin(stored ^ value).count("1"), key) for stored, key in entries]
+    return sorted(match for match in matches if match[0] <= max_distance)
+
+
+def spread_flips(rng, distance):
+    """`distance` bit positions dealt as evenly as possible over the chunks, the
+    hardest case for the pigeonhole lookup"""
+    chunks = list(range(CHUNKS))
+    rng.shuffle(chunks)
+    bits = []
+    for n in range(distance):
+        chunk = chunks[n % CHUNKS]
+        while True:
+            bit = chunk * CHUNK_BITS + rng.randrange(CHUNK_BITS)
+            if bit not in bits:
+                bits.append(bit)
+                break
+    return bits
+
+
+@pytest.fixture
+def index(tmp_path):
+    return NearDuplicateIndex(str(tmp_path / "hashes.sqlite3"))
+
+
+def test_split_and_join_round_trip():
+    rng = random.Random(1)
+    for value in [0, (1 << BITS) - 1, *(rng.getrandbits(BITS) for _ in range(100))]:
+        chunks = split_hash(value)
+        assert len(chunks) == CHUNKS
+        assert all(0 <= chunk < 1 << CHUNK_BITS for chunk in chunks)
+        assert join_hash(chunks) == value
+
+
+def test_search_matches_brute_force_scan(index):
+    rng = random.Random(7)
+    query = rng.getrandbits(BITS)
+    entries = [(rng.getrandbits(BITS), f"random-{n}") for n in range(300)]
+    for distance in range(0, 13):
+        for n in range(4):
+            entries.append((flip(query, spread_flips(rng, distance)), f"spread-{distance}-{n}"))
+            entries.append((flip(query, rng.sample(range(BITS), distance)), f"sampled-{distance}-{n}"))
+    index.add_many(entries)
+
+    for max_distance in range(0, 13):
+        expected = brute_force(entries, query, max_distance)
+        assert index.search(query, max_distance) == expected
+        assert any(distance == max_distance for distance, _ in expected)  # the edge is exercised
+
+
+def test_search_across_chunk_boundaries(index):
+    query = 0x0123_4567_89AB_CDEF
+    boundary_bits = [CHUNK_BITS * i + offset for i in range(1, CHUNKS) for offset in (-1, 0)]
+    entries = [
+        (flip(query, boundary_bits), "edges-6"),  # the bits either side of every boundary
+        (flip(query, [*boundary_bits, 1]), "edges-7"),
+        (flip(query, [0, BITS - 1]), "ends"),
+        (flip(query, [CHUNK_BITS - 1, CHUNK_BITS]), "straddle"),
+    ]
+    index.add_many(entries)
+    assert index.search(query, 6) == brute_force(entries, query, 6)
+    assert [key for _, key in index.search(query, 6)] == ["ends", "straddle", "edges-6"]
+    assert index.search(query, 7) == brute_force(entries, query, 7)
+    assert index.search(query, 7)[-1] == (7, "edges-7")
+
+
+def test_nothing_beyond_max_distance(index):
+    query = random.Random(3).getrandbits(BITS)
+    index.add(flip(query, range(0, 7 * 9, 9)), "seven-away")
+    assert index.search(query, 6) == []
+    assert index.search(query) == []  # default max_distance is 6
+    assert index.search(query, 7) == [(7, "seven-away")]
+
+
+def test_add_replaces_and_remove_forgets(index):
+    index.add(0xFFFF, "key")
+    index.add(0xFFFF << 48, "key")
+    assert index.count() == 1
+    assert index.search(0xFFFF, 6) == []
+    assert index.search(0xFFFF << 48, 0) == [(0, "key")]
+    index.remove("key")
+    assert index.search(0xFFFF << 48, 6) == []
+
+
+def test_search_only_matches_its_scope(index):
+    index.add(0xFFFF, "json-key", "json")
+    index.add(0xFFFF, "text-key", "text")
+    assert index.search(0xFFFF, scope="json") == [(0, "json-key")]
+    assert index.search(0xFFFF, scope="text") == [(0, "text-key")]
+    assert index.search(0xFFFF, scope="other") == []
+
+
+def test_rows_of_an_unscoped_index_match_no_scope(tmp_path):
+    path = str(tmp_path / "hashes.sqlite3")
+    conn = sqlite3.connect(path)
+    columns = ", ".join(f"c{i} INTEGER NOT NULL" for i in range(CHUNKS))
+    conn.execute(f"CREATE TABLE hashes (key TEXT PRIMARY KEY, {columns}, created REAL NOT NULL)")
+    conn.execute("INSERT INTO hashes VALUES ('old-key', 0, 0, 0, 65535, 0)")
+    conn.commit()
+    conn.close()
+
+    index = NearDuplicateIndex(path)
+    assert index.search(0xFFFF, scope="json") == []
+    index.add(0xFFFF, "new-key", "json")
+    assert index.search(0xFFFF, scope="json") == [(0, "new-key")]
+
+
+def test_app_reuses_near_duplicates_only_under_the_same_config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = importlib.import_module("app")
+    monkeypatch.setattr(app, "result_cache", ResultCache(str(tmp_path / "results.sqlite3")))
+    monkeypatch.setattr(app, "near_duplicates", NearDuplicateIndex(str(tmp_path / "hashes.sqlite3")))
+    monkeypatch.setattr(app, "STRUCTURED_OUTPUT", False)
+
+    def photo(shade):
+        image = Image.linear_gradient("L").resize((64, 64)).point(lambda v: min(255, v + shade))
+        buffer = io.BytesIO()
+        image.save(buffer, "PNG")
+        return buffer.getvalue()
+
+    original, reshot = photo(0), photo(3)  # different bytes, same perceptual hash
+    assert app.dhash(original) == app.dhash(reshot)
+    _, image_hash = app.lookup_analysis(app.analysis_cache_key(original), original, "tag.png")
+    app.store_cached(app.analysis_cache_key(original), {"result": "text answer", "provider": "xAI"}, image_hash)
+
+    similar, _ = app.lookup_analysis(app.analysis_cache_key(reshot), reshot, "reshot.png")
+    assert similar["result"] == "text answer" and similar["cache_tier"] == "similar"
+
+    monkeypatch.setattr(app, "STRUCTURED_OUTPUT", True)
+    assert app.lookup_analysis(app.analysis_cache_key(reshot), reshot, "reshot.png") == (None, image_hash)
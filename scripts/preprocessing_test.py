@@ -0,0 +1,36 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from preprocessing import prepare_image
+
+
+def jpeg(width, height, quality=90):
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(height // 3, 2 * height // 3, 12):
+        draw.rectangle((width // 3, y, 2 * width // 3, y + 4), fill="black")
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=quality)
+    return output.getvalue()
+
+
+def test_large_jpeg_is_downscaled():
+    data, mime, info = prepare_image(jpeg(3000, 2000), max_long_side=1500, max_short_side=1000)
+    assert mime == "image/jpeg" and info["processed"]
+    assert Image.open(io.BytesIO(data)).size == (1500, 1000)
+
+
+def test_small_jpeg_is_sent_unchanged():
+    original = jpeg(400, 300)
+    assert prepare_image(original)[0] == original
+
+
+@pytest.mark.parametrize("crop_tag", [False, True])
+def test_truncated_jpeg_is_passed_through(crop_tag):
+    # the header decodes, the pixels do not: Pillow only fails once they are needed
+    truncated = jpeg(3000, 2000)[:20_000]
+    data, mime, info = prepare_image(truncated, max_long_side=1500, crop_tag=crop_tag)
+    assert data == truncated and mime == "image/jpeg"
+    assert info["processed"] is False and "truncated" in info["error"]
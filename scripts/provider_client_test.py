@@ -0,0 +1,113 @@
+import socket
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import provider_client
+from provider_client import parse_retry_after, retry_delay
+from stub_provider import start_stub_provider
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff sleeps of provider_client, which are recorded instead of slept"""
+    sleeps = []
+    monkeypatch.setattr(provider_client, "time", SimpleNamespace(monotonic=time.monotonic, sleep=sleeps.append))
+    monkeypatch.setattr(provider_client, "BACKOFF_BASE_SECONDS", 0.5)
+    monkeypatch.setattr(provider_client, "BACKOFF_MAX_SECONDS", 8)
+    monkeypatch.setattr(provider_client, "RETRY_BUDGET_SECONDS", 35)
+    return sleeps
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("1.5") == 1.5
+    assert parse_retry_after("-2") == 0.0
+    assert parse_retry_after(None) is None and parse_retry_after("") is None
+    assert parse_retry_after("soon") is None
+    future = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 28 <= parse_retry_after(future) <= 30
+    past = format_datetime(datetime.now(timezone.utc) - timedelta(seconds=30), usegmt=True)
+    assert parse_retry_after(past) == 0.0
+
+
+def test_retry_delay_honours_retry_after_up_to_the_max(sleeps):
+    assert retry_delay(0, FakeResponse(429, {"Retry-After": "2"})) == 2.0
+    assert retry_delay(0, FakeResponse(429, {"Retry-After": "9"})) is None  # fall back instead
+    for attempt in range(6):  # full jitter, capped
+        for response in (None, FakeResponse(500), FakeResponse(429)):
+            delay = retry_delay(attempt, response)
+            assert 0 <= delay <= min(8, 0.5 * 2 ** attempt)
+
+
+def test_5xx_is_retried_up_to_max_retries(sleeps):
+    stub = start_stub_provider(latency=0, error_rate=1.0)
+    try:
+        response = provider_client.post(stub.url, json={}, timeout=1, max_retries=2)
+        assert response.status_code == 500
+        assert stub.counts["errors"] == 3 and len(sleeps) == 2
+    finally:
+        stub.shutdown()
+
+
+def test_retry_that_would_overrun_the_budget_is_not_started(sleeps, monkeypatch):
+    monkeypatch.setattr(provider_client, "RETRY_BUDGET_SECONDS", 5)
+    stub = start_stub_provider(latency=0, error_rate=1.0)
+    try:
+        # a retry with a 30 s timeout cannot end within 5 s
+        assert provider_client.post(stub.url, json={}, timeout=30, max_retries=2).status_code == 500
+        assert stub.counts["errors"] == 1 and sleeps == []
+        assert provider_client.post(stub.url, json={}, timeout=30, max_retries=2, retry_budget=100).status_code == 500
+        assert stub.counts["errors"] == 4
+    finally:
+        stub.shutdown()
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_refused_connection_is_retried(sleeps):
+    with pytest.raises(requests.exceptions.ConnectionError):
+        provider_client.post(f"http://127.0.0.1:{closed_port()}/v1/chat/completions", json={}, timeout=1,
+                             max_retries=2)
+    assert len(sleeps) == 2
+
+
+def test_connection_dropped_after_sending_is_not_retried(sleeps):
+    """The provider read the request, then the connection went away: it may have run it"""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    requests_seen = []
+
+    def accept():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            requests_seen.append(conn.recv(65536))
+            conn.close()
+
+    threading.Thread(target=accept, daemon=True).start()
+    try:
+        with pytest.raises(requests.exceptions.ConnectionError):
+            provider_client.post(f"http://127.0.0.1:{server.getsockname()[1]}/v1/chat/completions",
+                                 json={"model": "x"}, timeout=1, max_retries=2)
+        assert len(requests_seen) == 1 and sleeps == []
+    finally:
+        server.close()
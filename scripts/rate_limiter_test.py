@@ -0,0 +1,121 @@
+import importlib
+import multiprocessing
+import time
+
+import pytest
+
+from rate_limiter import ProviderRateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_limiter(tmp_path, clock=time.time, **limits):
+    limits = limits or {"xAI": (60, 0)}
+    return ProviderRateLimiter(str(tmp_path / "limits.sqlite3"), limits, clock=clock)
+
+
+def test_request_bucket_empties_and_refills(tmp_path):
+    clock = FakeClock()
+    limiter = make_limiter(tmp_path, clock)
+    for _ in range(60):
+        assert limiter.try_acquire("xAI") == 0
+    assert limiter.try_acquire("xAI") == pytest.approx(1.0)
+
+    clock.now += 0.5
+    assert limiter.try_acquire("xAI") == pytest.approx(0.5)  # nothing taken while waiting
+    clock.now += 0.5
+    assert limiter.try_acquire("xAI") == 0
+    assert limiter.try_acquire("xAI") == pytest.approx(1.0)
+
+    clock.now += 3600  # capped at one minute of quota
+    assert limiter.snapshot()["xAI"]["requests_available"] == 60
+
+
+def test_token_bucket_waits_for_the_shortfall(tmp_path):
+    clock = FakeClock()
+    limiter = make_limiter(tmp_path, clock, OpenAI=(0, 6000))
+    assert limiter.try_acquire("OpenAI", tokens=5000) == 0
+    assert limiter.try_acquire("OpenAI", tokens=2000) == pytest.approx(10.0)  # 1000 short at 100/s
+    assert limiter.try_acquire("OpenAI", tokens=1000) == 0
+    # a request larger than the whole bucket waits for a full bucket instead of forever
+    clock.now += 60
+    assert limiter.try_acquire("OpenAI", tokens=10_000) == 0
+
+
+def test_acquire_sheds_when_quota_is_beyond_the_wait_bound(tmp_path):
+    limiter = make_limiter(tmp_path, xAI=(60, 0))
+    for _ in range(60):
+        assert limiter.acquire("xAI")
+    started = time.monotonic()
+    assert not limiter.acquire("xAI", max_wait=0.5)  # next request is ~1s away
+    assert time.monotonic() - started < 0.5  # shed without sleeping
+    assert limiter.acquire("xAI", max_wait=2)
+    assert time.monotonic() - started >= 0.5
+
+
+def test_penalize_holds_calls_for_the_retry_after(tmp_path):
+    clock = FakeClock()
+    limiter = make_limiter(tmp_path, clock)
+    limiter.penalize("xAI", 20)
+    assert limiter.try_acquire("xAI") == pytest.approx(20)  # quota is there, but blocked
+    assert limiter.snapshot()["xAI"]["blocked_for"] == 20
+
+    limiter.penalize("xAI", 5)  # a shorter Retry-After does not cut the hold short
+    clock.now += 19
+    assert limiter.try_acquire("xAI") == pytest.approx(1)
+    clock.now += 1
+    assert limiter.try_acquire("xAI") == 0
+
+
+def test_penalize_is_shared_through_the_file(tmp_path):
+    clock = FakeClock()
+    first = make_limiter(tmp_path, clock)
+    second = make_limiter(tmp_path, clock)
+    first.penalize("xAI", 30)
+    assert second.try_acquire("xAI") == pytest.approx(30)
+
+
+def test_unregistered_and_unlimited_providers_are_not_limited(tmp_path):
+    clock = FakeClock()
+    limiter = make_limiter(tmp_path, clock, xAI=(1, 0), OpenAI=(0, 0))
+    limiter.penalize("OpenAI", 60)
+    limiter.penalize("Other", 60)
+    for _ in range(5):
+        assert limiter.try_acquire("OpenAI", tokens=10**6) == 0
+        assert limiter.try_acquire("Other") == 0
+    assert set(limiter.snapshot()) == {"xAI"}
+
+
+def test_every_app_provider_draws_from_a_configured_bucket(tmp_path, monkeypatch):
+    # a provider missing from RATE_LIMITS would silently bypass the quota
+    monkeypatch.chdir(tmp_path)
+    app = importlib.import_module("app")
+    for provider in app.PROVIDERS:
+        assert app.quota_bucket(provider) in app.RATE_LIMITS
+    assert app.quota_bucket(app.CASCADE_PROVIDER) == "OpenAI"
+
+
+def take_all(path, results):
+    limiter = ProviderRateLimiter(path, {"xAI": (10, 0)})
+    results.put(sum(limiter.try_acquire("xAI") == 0 for _ in range(10)))
+
+
+def test_processes_share_one_budget(tmp_path):
+    path = str(tmp_path / "limits.sqlite3")
+    ProviderRateLimiter(path, {"xAI": (10, 0)})  # create the table before the race
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [context.Process(target=take_all, args=(path, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    granted = [results.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join()
+    # 10 per minute between them; at most one more refills while the workers start
+    assert 10 <= sum(granted) <= 11
@@ -0,0 +1,97 @@
+import json
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+import result_cache as result_cache_module
+from result_cache import ResultCache, make_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(result_cache_module, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def make_cache(tmp_path, **options):
+    return ResultCache(str(tmp_path / "results.sqlite3"), **options)
+
+
+def stored_keys(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "results.sqlite3"))
+    try:
+        return {key for (key,) in conn.execute("SELECT key FROM results")}
+    finally:
+        conn.close()
+
+
+def test_key_covers_image_prompt_and_model():
+    key = make_key(b"image", "prompt", "model")
+    assert key == make_key(b"image", "prompt", "model")
+    assert len({key, make_key(b"other", "prompt", "model"), make_key(b"image", "other", "model"),
+                make_key(b"image", "prompt", "other")}) == 4
+
+
+def test_memory_tier_evicts_least_recently_used(tmp_path, clock):
+    cache = make_cache(tmp_path, memory_entries=2)
+    cache.set("a", {"result": "a"})
+    cache.set("b", {"result": "b"})
+    assert cache.get("a") == ({"result": "a"}, "memory")  # now b is the oldest
+    cache.set("c", {"result": "c"})
+
+    assert cache.get("b") == ({"result": "b"}, "disk")  # evicted from memory only
+    assert cache.get("c") == ({"result": "c"}, "memory")
+    assert cache.get("a") == ({"result": "a"}, "disk")  # pushed out by promoting b
+
+
+def test_disk_hit_is_promoted_to_memory(tmp_path, clock):
+    make_cache(tmp_path).set("key", {"result": "tag"})
+    cache = make_cache(tmp_path)  # another worker: empty memory tier, same file
+    assert cache.get("key") == ({"result": "tag"}, "disk")
+    assert cache.get("key") == ({"result": "tag"}, "memory")
+
+
+def test_returned_results_are_copies(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    cache.set("key", {"result": "tag"})
+    cache.get("key")[0].update(cached=True, filename="upload.jpg")
+    assert cache.get("key") == ({"result": "tag"}, "memory")
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl_seconds=60)
+    cache.set("key", {"result": "tag"})
+    clock.now += 59
+    assert cache.get("key")[1] == "memory"
+    assert make_cache(tmp_path, ttl_seconds=60).get("key")[1] == "disk"
+
+    clock.now += 1
+    assert cache.get("key") == (None, None)
+    assert stored_keys(tmp_path) == set()  # the expired row is deleted on read
+
+
+def test_writes_purge_expired_rows(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl_seconds=60)
+    cache.set("old", {"result": "old"})
+    clock.now += 61
+    cache.set("new", {"result": "new"})
+    assert stored_keys(tmp_path) == {"new"}
+
+
+def test_size_cap_evicts_least_recently_accessed_rows(tmp_path, clock):
+    size = len(json.dumps({"result": "a"}))
+    cache = make_cache(tmp_path, memory_entries=0, max_bytes=3 * size)
+    for key in "abc":
+        cache.set(key, {"result": key})
+        clock.now += 1
+    assert cache.get("a") == ({"result": "a"}, "disk")  # b is now the least recently read
+    clock.now += 1
+
+    cache.set("d", {"result": "d"})
+    assert stored_keys(tmp_path) == {"a", "c", "d"}
+    assert cache.get("b") == (None, None)
+
+    cache.set("big", {"result": "x" * size})  # about two rows: frees the two least recent
+    assert stored_keys(tmp_path) == {"d", "big"}  # c, then a
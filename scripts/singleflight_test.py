@@ -0,0 +1,173 @@
+import multiprocessing
+import os
+import threading
+import time
+
+from singleflight import SingleFlight
+
+
+def make_flight(tmp_path, **options):
+    options = {"poll_interval": 0.01, **options}
+    return SingleFlight(str(tmp_path / "flights.sqlite3"), **options)
+
+
+def run_threads(count, target):
+    """Start `count` threads on target(i) and return their results in order"""
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = target(i)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+        assert not thread.is_alive(), "a caller hung"
+    return results
+
+
+def test_threads_coalesce_onto_one_call(tmp_path):
+    flight = make_flight(tmp_path)
+    calls = []
+    started = threading.Event()
+
+    def analyse():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return {"analysis": "tag"}
+
+    def caller(i):
+        if i:
+            started.wait()
+        return flight.do("key", analyse)
+
+    results = run_threads(5, caller)
+    assert len(calls) == 1
+    assert results[0] == ({"analysis": "tag"}, False)
+    assert results[1:] == [({"analysis": "tag"}, True)] * 4
+
+
+def test_different_keys_do_not_coalesce(tmp_path):
+    flight = make_flight(tmp_path)
+    results = run_threads(3, lambda i: flight.do(f"key-{i}", lambda: i))
+    assert results == [(0, False), (1, False), (2, False)]
+
+
+def test_in_process_followers_get_the_leader_error(tmp_path):
+    flight = make_flight(tmp_path)
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("provider down")
+
+    def caller(i):
+        if i:
+            started.wait()
+            return flight.do("key", lambda: "unused")
+        return flight.do("key", fail)
+
+    results = run_threads(3, caller)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+    # the failure is not remembered: the next caller runs again
+    assert flight.do("key", lambda: "fresh") == ("fresh", False)
+
+
+def test_workers_coalesce_through_the_lease(tmp_path):
+    # two instances on one file stand in for two gunicorn workers
+    leader, follower = make_flight(tmp_path), make_flight(tmp_path)
+    started = threading.Event()
+
+    def analyse():
+        started.set()
+        time.sleep(0.2)
+        return "result"
+
+    def caller(i):
+        if i:
+            started.wait()
+            return follower.do("key", lambda: "follower ran")
+        return leader.do("key", analyse)
+
+    assert run_threads(2, caller) == [("result", False), ("result", True)]
+
+
+def test_follower_takes_over_when_the_leader_fails(tmp_path):
+    leader, follower = make_flight(tmp_path), make_flight(tmp_path)
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("provider down")
+
+    def caller(i):
+        if i:
+            started.wait()
+            return follower.do("key", lambda: "follower result")
+        return leader.do("key", fail)
+
+    failed, taken_over = run_threads(2, caller)
+    assert isinstance(failed, RuntimeError)
+    assert taken_over == ("follower result", False)  # ran its own call, not a stale result
+
+
+def test_expired_lease_of_a_dead_leader_is_taken_over(tmp_path):
+    dead = make_flight(tmp_path, lease_seconds=0.3)
+    assert dead.acquire("key") == (True, None)  # the holder never finishes
+
+    waiter = make_flight(tmp_path, lease_seconds=0.3)
+    started = time.monotonic()
+    assert waiter.do("key", lambda: "recovered") == ("recovered", False)
+    assert 0.2 < time.monotonic() - started < 5
+
+    dead.finish("key", "stale")  # a late finish from the old holder is ignored
+    assert waiter.acquire("key") == (False, "recovered")
+
+
+def test_finished_results_expire(tmp_path):
+    flight = make_flight(tmp_path, result_seconds=0.1)
+    assert flight.do("key", lambda: "first") == ("first", False)
+    assert flight.do("key", lambda: "second") == ("first", True)
+    time.sleep(0.15)
+    assert flight.do("key", lambda: "third") == ("third", False)
+
+
+def analyse_once(path, calls_dir, start, results):
+    flight = SingleFlight(path, poll_interval=0.01)
+    start.wait()
+
+    def analyse():
+        open(os.path.join(calls_dir, str(os.getpid())), "w").close()
+        time.sleep(0.5)
+        return {"pid": os.getpid()}
+
+    results.put(flight.do("key", analyse))
+
+
+def test_processes_coalesce_onto_one_call(tmp_path):
+    path = str(tmp_path / "flights.sqlite3")
+    SingleFlight(path)  # create the table before the race
+    context = multiprocessing.get_context("spawn")
+    start = context.Event()
+    results = context.Queue()
+    workers = [context.Process(target=analyse_once, args=(path, str(tmp_path), start, results))
+               for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    start.set()
+    outcomes = [results.get(timeout=60) for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    calls = [name for name in os.listdir(tmp_path) if name.isdigit()]
+    assert len(calls) == 1
+    assert {result["pid"] for result, _ in outcomes} == {int(calls[0])}
+    assert sorted(shared for _, shared in outcomes) == [False, True, True, True]
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+import requests
+
+from structured_output import InvalidAnalysis, format_analysis, parse_analysis
+from stub_provider import STUB_FIELDS, start_stub_provider
+
+VALID = {
+    "item": " WWII dog tag ", "materials": ["stainless steel", " "], "text": "SMITH JOHN",
+    "era": {"from": 1941, "to": 1945.0}, "context": "Issued to US Army personnel.",
+    "value_usd": {"low": 40, "high": 120.5}, "confidence": 85,
+}
+
+
+def answer(**changes):
+    return json.dumps({**VALID, **changes})
+
+
+def test_parses_valid_answer_into_typed_fields():
+    fields = parse_analysis(answer())
+    assert fields == {
+        "item": "WWII dog tag", "materials": ["stainless steel"], "text": "SMITH JOHN",
+        "era": {"from": 1941, "to": 1945}, "context": "Issued to US Army personnel.",
+        "value_usd": {"low": 40.0, "high": 120.5}, "confidence": 85.0,
+    }
+    assert isinstance(fields["era"]["to"], int)
+    assert "📅 Era: 1941–1945" in format_analysis(fields)
+    assert "💰 Value: $40–$120" in format_analysis(fields)
+
+
+def test_accepts_code_fences_and_nulls():
+    text = "```json\n" + answer(item=None, text="  ", era={"from": None, "to": 1918}) + "\n```"
+    fields = parse_analysis(text)
+    assert fields["item"] is None and fields["text"] is None
+    assert fields["era"] == {"from": None, "to": 1918}
+    assert "📅 Era: 1918" in format_analysis(fields)
+
+
+@pytest.mark.parametrize("text", [
+    "The tag is a WWII dog tag",
+    "[1, 2]",
+    json.dumps({key: value for key, value in VALID.items() if key != "confidence"}),
+    answer(materials="steel"),
+    answer(item=5),
+    answer(confidence=True),
+    answer(confidence=101),
+    answer(era={"from": 1945, "to": 1941}),
+    answer(era={"from": 1941.5, "to": 1945}),
+    answer(era=[1941, 1945]),
+    answer(value_usd={"low": "40", "high": 120}),
+])
+def test_rejects_answers_that_do_not_match_the_schema(text):
+    with pytest.raises(InvalidAnalysis):
+        parse_analysis(text)
+
+
+@pytest.mark.parametrize("field, value", [
+    ("confidence", "Infinity"),
+    ("confidence", "NaN"),
+    ("era", '{"from": Infinity, "to": null}'),
+    ("era", '{"from": NaN, "to": 1945}'),
+    ("era", '{"from": 1e400, "to": null}'),
+    ("value_usd", '{"low": -Infinity, "high": 10}'),
+    ("value_usd", '{"low": 0, "high": ' + "9" * 400 + "}"),
+])
+def test_rejects_non_finite_numbers(field, value):
+    # Python's json accepts these, so they must not reach int() / float()
+    text = answer(**{field: "PLACEHOLDER"}).replace('"PLACEHOLDER"', value)
+    with pytest.raises(InvalidAnalysis, match="finite"):
+        parse_analysis(text)
+
+
+def stream_text(url, response_format):
+    payload = {"model": "stub", "stream": True, "response_format": response_format}
+    response = requests.post(url, json=payload, stream=True, timeout=10)
+    text = ""
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith("data: ") and line != "data: [DONE]":
+            text += json.loads(line[len("data: "):])["choices"][0]["delta"]["content"]
+    return text
+
+
+def test_stub_streams_json_when_asked_for_structured_output():
+    server = start_stub_provider(latency=0)
+    try:
+        assert parse_analysis(stream_text(server.url, {"type": "json_schema"}))["item"] == STUB_FIELDS["item"]
+        assert "ANALYSIS RESULT" in stream_text(server.url, None)
+    finally:
+        server.shutdown()
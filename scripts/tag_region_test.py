@@ -0,0 +1,72 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from tag_region import find_tag_region
+
+LABEL = (600, 450, 1000, 750)
+
+
+def photo(*labels, size=(1600, 1200)):
+    """A plain background with white labels covered in rows of dark glyph-sized marks"""
+    image = Image.new("RGB", size, (120, 110, 100))
+    draw = ImageDraw.Draw(image)
+    for left, top, right, bottom in labels:
+        draw.rectangle((left, top, right, bottom), fill="white")
+        for y in range(top + 10, bottom - 10, 16):
+            for x in range(left + 10, right - 14, 14):
+                draw.rectangle((x, y, x + 7, y + 9), fill="black")
+    return image
+
+
+def contains(box, inner):
+    return box[0] <= inner[0] and box[1] <= inner[1] and box[2] >= inner[2] and box[3] >= inner[3]
+
+
+def test_text_block_is_cropped_with_a_margin():
+    region = find_tag_region(photo(LABEL))
+    assert region["applied"] and region["reason"] is None
+    assert region["confidence"] == 1.0
+    assert contains(region["box"], LABEL)
+    assert contains((0, 0, 1600, 1200), region["box"])
+    assert region["ratio"] < 0.3  # the label is 6% of the photo; the margin adds the rest
+
+
+def test_box_is_in_image_pixels_at_any_size():
+    full = find_tag_region(photo(LABEL))["box"]
+    half = find_tag_region(photo(LABEL).resize((800, 600), Image.LANCZOS))["box"]
+    assert all(abs(a - 2 * b) <= 16 for a, b in zip(full, half))
+
+
+@pytest.mark.parametrize("image", [
+    Image.new("RGB", (1600, 1200), (120, 110, 100)),
+    Image.linear_gradient("L").resize((1600, 1200)).convert("RGB"),
+])
+def test_plain_image_is_not_cropped(image):
+    region = find_tag_region(image)
+    assert not region["applied"]
+    assert region["box"] is None and region["ratio"] == 1.0
+    assert region["reason"] == "no text region found"
+
+
+def test_max_ratio_keeps_large_labels_whole():
+    assert find_tag_region(photo(LABEL), max_ratio=0.6)["applied"]
+    region = find_tag_region(photo(LABEL), max_ratio=0.1)
+    assert not region["applied"]
+    assert region["reason"].startswith("label fills")
+    assert region["box"] is not None  # still reported for the crop stats
+
+    region = find_tag_region(photo((100, 100, 1500, 1100)))
+    assert not region["applied"] and region["ratio"] > 0.6
+
+
+def test_min_confidence_keeps_scattered_text_whole():
+    labels = photo((100, 100, 500, 400), (1100, 800, 1500, 1100))
+    region = find_tag_region(labels, min_confidence=0.6)
+    assert not region["applied"]
+    assert 0.4 < region["confidence"] < 0.6  # two labels of the same size
+    assert region["reason"].startswith("text spread over several regions")
+
+    region = find_tag_region(labels, min_confidence=0.4)
+    assert region["applied"]
+    # the crop covers one label and leaves the other out
+    assert contains(region["box"], (100, 100, 500, 400)) != contains(region["box"], (1100, 800, 1500, 1100))
@@ -0,0 +1,48 @@
+import io
+import os
+
+from PIL import Image
+
+from upload_store import UploadStore
+
+
+def png(color, size=(64, 48)):
+    output = io.BytesIO()
+    Image.new("RGB", size, color).save(output, format="PNG")
+    return output.getvalue()
+
+
+def test_blob_paths_do_not_depend_on_the_cwd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = UploadStore("uploads")
+    name = store.put("tag.png", png("red"))
+    monkeypatch.chdir(tmp_path.parent)  # gunicorn --chdir elsewhere
+    blob = store.lookup("tag.png")
+    assert os.path.isabs(blob["path"]) and os.path.exists(blob["path"])
+    assert os.path.isabs(store.derivative(blob, 32))
+    assert store.lookup(name)["path"] == blob["path"]
+
+
+def test_lookup_by_blob_name_digest_or_alias(tmp_path):
+    store = UploadStore(str(tmp_path / "uploads"))
+    data = png("red")
+    name = store.put("first.png", data)
+    assert store.put("second.png", data) == name  # stored once
+    digest = name.split(".")[0]
+    assert store.lookup(name)["immutable"] and store.lookup(digest)["immutable"]
+    assert store.lookup("first.png")["digest"] == digest
+    assert not store.lookup("second.png")["immutable"]  # an upload name can be reused
+    assert store.lookup("missing.png") is None
+    assert store.stats()["blobs"] == 1
+
+
+def test_eviction_removes_blob_aliases_and_derivatives(tmp_path):
+    red, blue = png("red"), png("blue")
+    store = UploadStore(str(tmp_path / "uploads"), max_bytes=len(red) + len(blue) - 1)
+    store.put("red.png", red)
+    derivative = store.derivative(store.lookup("red.png"), 32)
+    assert os.path.exists(derivative)
+    store.put("blue.png", blue)
+    assert store.lookup("red.png") is None
+    assert not os.path.exists(derivative)
+    assert store.lookup("blue.png") is not None
@@ -0,0 +1,74 @@
+import importlib
+import io
+
+import pytest
+from PIL import Image
+
+import upload_store as upload_store_module
+from upload_store import UploadStore
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    app = importlib.import_module("app")
+    store = UploadStore("uploads")  # relative, like UPLOAD_FOLDER
+    (tmp_path / "elsewhere").mkdir()
+    monkeypatch.chdir(tmp_path / "elsewhere")  # gunicorn --chdir: cwd is not the app directory
+    monkeypatch.setattr(app, "upload_store", store)
+    return app.app.test_client(), store
+
+
+def jpeg(size=(1200, 800)):
+    output = io.BytesIO()
+    Image.new("RGB", size, "orange").save(output, format="JPEG")
+    return output.getvalue()
+
+
+def test_serves_blob_with_etag_304_and_range(client):
+    client, store = client
+    data = jpeg()
+    name = store.put("tag.jpg", data)
+    response = client.get(f"/uploads/{name}")
+    assert response.status_code == 200 and response.data == data
+    assert response.headers["ETag"].strip('"') == name.split(".")[0]
+    assert "immutable" in response.headers["Cache-Control"]
+
+    assert client.get(f"/uploads/{name}", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    partial = client.get(f"/uploads/{name}", headers={"Range": "bytes=0-99"})
+    assert partial.status_code == 206 and partial.data == data[:100]
+
+    by_alias = client.get("/uploads/tag.jpg")
+    assert by_alias.status_code == 200 and "no-cache" in by_alias.headers["Cache-Control"]
+    assert client.get("/uploads/unknown.jpg").status_code == 404
+
+
+def test_thumbnails_are_negotiated_validated_and_cached(client, monkeypatch):
+    client, store = client
+    name = store.put("tag.jpg", jpeg())
+    made = []
+    make_thumbnail = upload_store_module.make_thumbnail
+    monkeypatch.setattr(upload_store_module, "make_thumbnail",
+                        lambda *args: made.append(args[1]) or make_thumbnail(*args))
+
+    webp = client.get(f"/uploads/{name}?size=160", headers={"Accept": "image/webp,*/*"})
+    assert webp.status_code == 200 and webp.mimetype == "image/webp"
+    assert max(Image.open(io.BytesIO(webp.data)).size) == 160
+    assert "Accept" in webp.headers["Vary"] and "immutable" in webp.headers["Cache-Control"]
+    again = client.get(f"/uploads/{name}?size=160", headers={"Accept": "image/webp,*/*",
+                                                             "If-None-Match": webp.headers["ETag"]})
+    assert again.status_code == 304
+    assert client.get(f"/uploads/{name}?size=160", headers={"Accept": "image/webp"}).data == webp.data
+    assert made == [160]  # generated once, then served from disk
+
+    fallback = client.get(f"/uploads/{name}?size=160", headers={"Accept": "image/jpeg"})
+    assert fallback.mimetype == "image/jpeg" and fallback.headers["ETag"] != webp.headers["ETag"]
+
+    for size in ("161", "abc", "-160"):
+        assert client.get(f"/uploads/{name}?size={size}").status_code == 400
+
+
+def test_undecodable_upload_has_no_thumbnail(client):
+    client, store = client
+    name = store.put("tag.jpg", b"\xff\xd8\xff" + b"\0" * 100)
+    assert client.get(f"/uploads/{name}?size=160").status_code == 415
@@ -0,0 +1,132 @@
+"""
+Single Flight
+Coalesces concurrent identical analyses: the first caller for a key runs the provider call
+under a lease shared by every gunicorn worker, duplicates wait for its result
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class SingleFlight:
+    """Leases and finished results in a SQLite table shared across processes, plus an
+    in-process table so threads of one worker wait on an event instead of polling.
+
+    A lease whose holder died expires after `lease_seconds` and is taken over by a
+    waiter. Finished results (successes and failures) are kept for `result_seconds`
+    so that waiters polling at `poll_interval` see them.
+    """
+
+    def __init__(self, path, lease_seconds=90, result_seconds=5, poll_interval=0.05):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.result_seconds = result_seconds
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        self._calls = {}
+        self._calls_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS flights ("
+            " key TEXT PRIMARY KEY, owner TEXT NOT NULL, lease_until REAL NOT NULL,"
+            " result TEXT, finished REAL)"
+        )
+
+    def _connect(self):
+        """Per-thread autocommit connection; transactions are opened explicitly"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, key):
+        """One non-blocking attempt: (True, None) when the caller now holds the lease,
+        (False, result) when a recent flight has finished, (False, None) while another
+        caller's flight is still running"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM flights WHERE finished < ?", (now - self.result_seconds,))
+            row = conn.execute("SELECT lease_until, result, finished FROM flights WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                lease_until, result, finished = row
+                if finished is not None:
+                    conn.execute("COMMIT")
+                    return False, json.loads(result)
+                if lease_until > now:
+                    conn.execute("COMMIT")
+                    return False, None
+                print(f"⚠️ Taking over expired analysis lease {key[:12]}")
+            conn.execute(
+                "INSERT OR REPLACE INTO flights (key, owner, lease_until, result, finished) VALUES (?, ?, ?, NULL, NULL)",
+                (key, self.owner, now + self.lease_seconds),
+            )
+            conn.execute("COMMIT")
+            return True, None
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def finish(self, key, result):
+        """Publish the lease holder's result to the waiters"""
+        self._connect().execute(
+            "UPDATE flights SET result = ?, finished = ? WHERE key = ? AND owner = ?",
+            (json.dumps(result), time.time(), key, self.owner),
+        )
+
+    def abandon(self, key):
+        """Drop the lease after the holder failed without a result, so a waiter takes over"""
+        self._connect().execute("DELETE FROM flights WHERE key = ? AND owner = ? AND finished IS NULL",
+                                (key, self.owner))
+
+    def do(self, key, fn):
+        """Return (fn() result, shared): run `fn` once per key across all workers; callers
+        that arrive while it runs get the same result with shared=True"""
+        with self._calls_lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"event": threading.Event(), "result": None, "error": None}
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+
+        try:
+            result, shared = self._do_across_processes(key, fn)
+            call["result"] = result
+            return result, shared
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._calls_lock:
+                del self._calls[key]
+            call["event"].set()
+
+    def _do_across_processes(self, key, fn):
+        while True:
+            is_leader, result = self.acquire(key)
+            if result is not None:
+                return result, True
+            if is_leader:
+                try:
+                    result = fn()
+                except Exception:
+                    self.abandon(key)
+                    raise
+                self.finish(key, result)
+                return result, False
+            time.sleep(self.poll_interval)
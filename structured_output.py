@@ -0,0 +1,143 @@
+"""
+Structured Output
+JSON schema sent to the providers in OUTPUT_MODE=json, validation of their answers into
+typed fields, and the plain-text rendering kept as the result text
+"""
+
+import json
+import math
+import re
+
+STRUCTURED_PROMPT = (
+    "Analyze this image of a military or vintage tag and answer with JSON matching the schema: "
+    "the item, its materials, the text on the tag verbatim, the era as a range of years, one "
+    "sentence of historical context, the current market value range in USD and your confidence "
+    "(0-100). Use null or an empty list for anything you cannot determine."
+)
+
+NULLABLE_STRING = {"type": ["string", "null"]}
+
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "item": NULLABLE_STRING,
+        "materials": {"type": "array", "items": {"type": "string"}},
+        "text": NULLABLE_STRING,
+        "era": {
+            "type": "object",
+            "properties": {"from": {"type": ["integer", "null"]}, "to": {"type": ["integer", "null"]}},
+            "required": ["from", "to"],
+            "additionalProperties": False,
+        },
+        "context": NULLABLE_STRING,
+        "value_usd": {
+            "type": "object",
+            "properties": {"low": {"type": ["number", "null"]}, "high": {"type": ["number", "null"]}},
+            "required": ["low", "high"],
+            "additionalProperties": False,
+        },
+        "confidence": {"type": "number"},
+    },
+    "required": ["item", "materials", "text", "era", "context", "value_usd", "confidence"],
+    "additionalProperties": False,
+}
+
+# OpenAI-style strict structured output (xAI accepts the same parameter)
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "tag_analysis", "strict": True, "schema": ANALYSIS_SCHEMA},
+}
+
+CODE_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+
+class InvalidAnalysis(ValueError):
+    """A provider answer that does not match ANALYSIS_SCHEMA"""
+
+
+def _string(value, name):
+    if value is None:
+        return None
+    if not isinstance(value, str):
+        raise InvalidAnalysis(f"{name} must be a string or null")
+    return value.strip() or None
+
+
+def _number(value, name, integer=False):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise InvalidAnalysis(f"{name} must be a number or null")
+    try:
+        finite = math.isfinite(value)
+    except OverflowError:  # an int too large for a float
+        finite = False
+    if not finite:
+        raise InvalidAnalysis(f"{name} must be a finite number")
+    if integer:
+        if value != int(value):
+            raise InvalidAnalysis(f"{name} must be a whole year")
+        return int(value)
+    return float(value)
+
+
+def _range(value, name, low, high, integer):
+    if not isinstance(value, dict):
+        raise InvalidAnalysis(f"{name} must be an object with {low!r} and {high!r}")
+    start = _number(value.get(low), f"{name}.{low}", integer)
+    end = _number(value.get(high), f"{name}.{high}", integer)
+    if start is not None and end is not None and start > end:
+        raise InvalidAnalysis(f"{name}.{low} is greater than {name}.{high}")
+    return {low: start, high: end}
+
+
+def parse_analysis(text):
+    """Typed fields from a provider's JSON answer; raises InvalidAnalysis when it does not
+    match ANALYSIS_SCHEMA"""
+    try:
+        data = json.loads(CODE_FENCE.sub("", text.strip()))
+    except (json.JSONDecodeError, TypeError) as e:
+        raise InvalidAnalysis(f"not JSON ({e})") from None
+    if not isinstance(data, dict):
+        raise InvalidAnalysis("not a JSON object")
+    missing = [name for name in ANALYSIS_SCHEMA["required"] if name not in data]
+    if missing:
+        raise InvalidAnalysis(f"missing {', '.join(missing)}")
+
+    materials = data["materials"]
+    if not isinstance(materials, list) or not all(isinstance(material, str) for material in materials):
+        raise InvalidAnalysis("materials must be a list of strings")
+    confidence = _number(data["confidence"], "confidence")
+    if confidence is None or not 0 <= confidence <= 100:
+        raise InvalidAnalysis("confidence must be between 0 and 100")
+    return {
+        "item": _string(data["item"], "item"),
+        "materials": [material.strip() for material in materials if material.strip()],
+        "text": _string(data["text"], "text"),
+        "era": _range(data["era"], "era", "from", "to", integer=True),
+        "context": _string(data["context"], "context"),
+        "value_usd": _range(data["value_usd"], "value_usd", "low", "high", integer=False),
+        "confidence": confidence,
+    }
+
+
+def _format_range(start, end, fmt):
+    if start is None and end is None:
+        return "unknown"
+    if start is None or end is None or start == end:
+        return fmt(start if start is not None else end)
+    return f"{fmt(start)}–{fmt(end)}"
+
+
+def format_analysis(fields):
+    """Plain-text rendering of typed fields, used as the result text (UI, history search)"""
+    era, value = fields["era"], fields["value_usd"]
+    return "\n".join([
+        f"🔍 Item: {fields['item'] or 'unknown'}",
+        f"🧵 Materials: {', '.join(fields['materials']) or 'unknown'}",
+        f"📝 Text: {fields['text'] or 'none visible'}",
+        f"📅 Era: {_format_range(era['from'], era['to'], str)}",
+        f"🏛️ Context: {fields['context'] or 'unknown'}",
+        f"💰 Value: {_format_range(value['low'], value['high'], lambda amount: f'${amount:,.0f}')}",
+        f"📊 Confidence: {fields['confidence']:.0f}%",
+    ])
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Stub Provider
+Local stand-in for the xAI / OpenAI chat-completions endpoints and the OpenAI files /
+batches endpoints, for benchmarks and tests that must not spend real API money
+
+Usage: python stub_provider.py --port 9100 --latency 1.0 [--distribution lognormal --spread 0.5]
+                               [--error-rate 0.1] [--burst-every 10 --burst-length 2]
+                               [--batch-latency 30] [--weak-rate 0.3]
+Then point the app at it with XAI_API_URL / OPENAI_API_URL=http://127.0.0.1:9100/v1/chat/completions
+(bulk mode derives OPENAI_BATCH_BASE_URL=http://127.0.0.1:9100/v1 from OPENAI_API_URL)
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from email import message_from_bytes
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cascade import CASCADE_PROMPT
+
+STUB_ANALYSIS = """📋 ANALYSIS RESULT
+
+🔍 **Item Identification**: Stub provider response
+💰 **Market Value**: $0 (benchmark)"""
+
+# Answer to requests with a `response_format` (OUTPUT_MODE=json)
+STUB_FIELDS = {
+    "item": "Stub provider response", "materials": [], "text": None, "era": {"from": None, "to": None},
+    "context": None, "value_usd": {"low": 0, "high": 0}, "confidence": 90,
+}
+
+
+# Answer to the cascade's first-tier prompt, in the terse line format it asks for
+STUB_CASCADE_ANSWER = """Item: Stub provider response
+Text: STUB
+Era: 1940s
+Context: Benchmark answer from the stub provider.
+Value: $0-10
+Confidence: {confidence}%"""
+
+
+def prompt_text(payload):
+    """The text parts of a chat-completions request's messages"""
+    parts = []
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(part.get("text", "") for part in content or [] if part.get("type") == "text")
+    return "\n".join(parts)
+
+
+def stub_content(payload, confidence=90):
+    if payload.get("response_format"):
+        return json.dumps(dict(STUB_FIELDS, confidence=confidence))
+    if CASCADE_PROMPT in prompt_text(payload):
+        return STUB_CASCADE_ANSWER.format(confidence=confidence)
+    return STUB_ANALYSIS
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        data = self.rfile.read(length)
+        if self.path.endswith("/files"):
+            self._upload_file(data)
+            return
+        payload = json.loads(data or b"{}")
+        if self.path.endswith("/batches"):
+            self._send_json(200, self.server.create_batch(payload))
+            return
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        server = self.server
+        if server.in_burst():
+            server.count("throttled")
+            self._send_json(429, {"error": {"message": "Rate limit reached (stub burst)"}},
+                            {"Retry-After": f"{server.retry_after:g}"})
+            return
+        time.sleep(server.sample_latency())
+        if server.random() < server.error_rate:
+            server.count("errors")
+            self._send_json(500, {"error": {"message": "Internal error (stub)"}})
+            return
+        server.count("ok")
+        model = payload.get("model", "stub")
+        content = stub_content(payload, server.sample_confidence())
+        if payload.get("stream"):
+            self._send_stream(model, content)
+        else:
+            self._send_json(200, {
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+            })
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        server = self.server
+        if len(parts) == 3 and parts[1] == "batches" and parts[2] in server.batches:
+            self._send_json(200, server.retrieve_batch(parts[2]))
+        elif len(parts) == 4 and parts[1] == "files" and parts[3] == "content" and parts[2] in server.files:
+            data = server.files[parts[2]]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/jsonl")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _upload_file(self, data):
+        header = f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode("latin-1")
+        form = message_from_bytes(header + data, policy=HTTP)
+        fields = {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+                  for part in form.iter_parts()}
+        if fields.get("purpose") != b"batch" or "file" not in fields:
+            self._send_json(400, {"error": {"message": "Expected purpose=batch and a file"}})
+            return
+        self._send_json(200, {"id": self.server.add_file(fields["file"]), "object": "file", "purpose": "batch"})
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, model, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for token in content.split(" "):
+            chunk = {"model": model, "choices": [{"index": 0, "delta": {"content": token + " "}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubProviderServer(ThreadingHTTPServer):
+    """Stub with a configurable provider profile.
+
+    Latency is `fixed`, `uniform` (latency ± spread), `exponential` (mean latency) or
+    `lognormal` (median latency, sigma spread). A fraction `error_rate` of calls
+    answers 500, and every `burst_every` seconds all calls answer 429 with Retry-After
+    for `burst_length` seconds.
+
+    Batches are `validating`, then `in_progress`, and `completed` `batch_latency`
+    seconds after creation; each request in them fails with `error_rate` like a call.
+
+    Answers report 90% confidence, except a fraction `weak_rate` that report 40%, so
+    the cascade escalates them to the full models.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=1.0, distribution="fixed", spread=0.0, error_rate=0.0,
+                 burst_every=0.0, burst_length=0.0, retry_after=1.0, batch_latency=5.0, weak_rate=0.0, seed=None):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.distribution = distribution
+        self.spread = spread
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        self.batch_latency = batch_latency
+        self.weak_rate = weak_rate
+        self.files = {}
+        self.batches = {}
+        self.started = time.monotonic()
+        self.counts = {"ok": 0, "errors": 0, "throttled": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def random(self):
+        with self._lock:
+            return self._random.random()
+
+    def sample_latency(self):
+        with self._lock:
+            if self.distribution == "uniform":
+                return max(0.0, self._random.uniform(self.latency - self.spread, self.latency + self.spread))
+            if self.distribution == "exponential":
+                return self._random.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+            if self.distribution == "lognormal":
+                return self._random.lognormvariate(math.log(self.latency), self.spread) if self.latency > 0 else 0.0
+            return self.latency
+
+    def sample_confidence(self):
+        return 40 if self.weak_rate and self.random() < self.weak_rate else 90
+
+    def in_burst(self):
+        if self.burst_every <= 0 or self.burst_length <= 0:
+            return False
+        return (time.monotonic() - self.started) % self.burst_every >= self.burst_every - self.burst_length
+
+    def add_file(self, data):
+        file_id = f"file-{uuid.uuid4().hex}"
+        with self._lock:
+            self.files[file_id] = data
+        return file_id
+
+    def create_batch(self, payload):
+        batch = {"id": f"batch_{uuid.uuid4().hex}", "object": "batch", "status": "validating",
+                 "input_file_id": payload["input_file_id"], "endpoint": payload["endpoint"],
+                 "output_file_id": None, "error_file_id": None, "created_at": time.time()}
+        with self._lock:
+            self.batches[batch["id"]] = batch
+        return dict(batch)
+
+    def retrieve_batch(self, batch_id):
+        with self._lock:
+            batch = self.batches[batch_id]
+            elapsed = time.time() - batch["created_at"]
+            if batch["status"] != "completed":
+                if elapsed >= self.batch_latency:
+                    self._complete(batch)
+                elif elapsed >= self.batch_latency / 2:
+                    batch["status"] = "in_progress"
+            return dict(batch)
+
+    def _complete(self, batch):
+        """Answer every request of a batch into its output and error files (lock held)"""
+        output, errors = [], []
+        for line in self.files[batch["input_file_id"]].splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            if self._random.random() < self.error_rate:
+                self.counts["errors"] += 1
+                errors.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                               "response": {"status_code": 500, "body": {"error": {"message": "Internal error (stub)"}}},
+                               "error": None})
+                continue
+            self.counts["ok"] += 1
+            body = request["body"]
+            output.append({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"], "error": None,
+                           "response": {"status_code": 200, "body": {
+                               "model": body.get("model", "stub"),
+                               "choices": [{"index": 0, "finish_reason": "stop",
+                                            "message": {"role": "assistant", "content": stub_content(body)}}],
+                           }}})
+        for name, lines in (("output_file_id", output), ("error_file_id", errors)):
+            if lines:
+                file_id = f"file-{uuid.uuid4().hex}"
+                self.files[file_id] = "".join(json.dumps(entry) + "\n" for entry in lines).encode("utf-8")
+                batch[name] = file_id
+        batch["status"] = "completed"
+
+    def count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+
+def start_stub_provider(host="127.0.0.1", port=0, **options):
+    """Start a stub provider on a background thread and return the server"""
+    server = StubProviderServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, name="stub-provider", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the chat-completions and batch APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds before each response (mean/median)")
+    parser.add_argument("--distribution", choices=["fixed", "uniform", "exponential", "lognormal"], default="fixed")
+    parser.add_argument("--spread", type=float, default=0.0, help="uniform half-width or lognormal sigma")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 500")
+    parser.add_argument("--burst-every", type=float, default=0.0, help="seconds between 429 bursts (0 = none)")
+    parser.add_argument("--burst-length", type=float, default=0.0, help="seconds each 429 burst lasts")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After sent with 429s")
+    parser.add_argument("--batch-latency", type=float, default=5.0, help="seconds until a batch completes")
+    parser.add_argument("--weak-rate", type=float, default=0.0,
+                        help="fraction of answers with low confidence (escalated by the cascade)")
+    args = parser.parse_args()
+
+    server = StubProviderServer((args.host, args.port), latency=args.latency, distribution=args.distribution,
+                                spread=args.spread, error_rate=args.error_rate, burst_every=args.burst_every,
+                                burst_length=args.burst_length, retry_after=args.retry_after,
+                                batch_latency=args.batch_latency, weak_rate=args.weak_rate)
+    print(f"🧪 Stub provider listening on {server.url} (latency {args.latency}s {args.distribution})")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Tag Region Detection
+Finds the label in a photo (the densest cluster of text-like edge cells, see
+prescreen.py) so that only that region, with a margin, is sent to the providers
+"""
+
+from collections import deque
+
+from PIL import Image, ImageFilter
+
+from prescreen import CELL_SIZE, EDGE_LUT, TEXT_CELL_DENSITY
+
+ANALYSIS_SIZE = 256
+LINK_DISTANCE = 3  # text cells this many cells apart belong to the same region (gaps between words)
+MIN_REGION_CELLS = 6
+MARGIN = 0.25  # of the region's width / height, on every side
+
+
+def text_cells(image, size=ANALYSIS_SIZE):
+    """(set of (x, y) text-like cells, image pixels per thumbnail pixel)"""
+    gray = image.convert("L") if image.mode != "L" else image.copy()
+    gray.thumbnail((size, size), reducing_gap=2.0)
+    edges = gray.filter(ImageFilter.FIND_EDGES).crop((1, 1, gray.width - 1, gray.height - 1)).point(EDGE_LUT)
+    width, height = max(1, edges.width // CELL_SIZE), max(1, edges.height // CELL_SIZE)
+    densities = edges.resize((width, height), Image.BOX).tobytes()
+    threshold = round(TEXT_CELL_DENSITY * 255)
+    cells = {(i % width, i // width) for i, density in enumerate(densities) if density >= threshold}
+    return cells, image.width / gray.width
+
+
+def largest_region(cells):
+    """The biggest group of cells linked within LINK_DISTANCE of each other"""
+    remaining = set(cells)
+    best = set()
+    while remaining:
+        start = remaining.pop()
+        region = {start}
+        queue = deque([start])
+        while queue:
+            x, y = queue.popleft()
+            for dx in range(-LINK_DISTANCE, LINK_DISTANCE + 1):
+                for dy in range(-LINK_DISTANCE, LINK_DISTANCE + 1):
+                    neighbour = (x + dx, y + dy)
+                    if neighbour in remaining:
+                        remaining.remove(neighbour)
+                        region.add(neighbour)
+                        queue.append(neighbour)
+        if len(region) > len(best):
+            best = region
+    return best
+
+
+def find_tag_region(image, min_confidence=0.6, max_ratio=0.6):
+    """Where to crop `image` (an oriented PIL image) to its label.
+
+    Returns {"box": (left, top, right, bottom) in image pixels, "ratio": crop area /
+    image area, "confidence", "applied", "reason"}; `applied` is False (send the full
+    image) when the text is scattered over several regions (confidence = the largest
+    region's share of all text cells), too sparse, or fills most of the frame anyway.
+    """
+    cells, scale = text_cells(image)
+    region = largest_region(cells)
+    confidence = round(len(region) / len(cells), 3) if cells else 0.0
+    result = {"box": None, "ratio": 1.0, "confidence": confidence, "applied": False, "reason": None}
+    if len(region) < MIN_REGION_CELLS:
+        result["reason"] = "no text region found"
+        return result
+
+    xs = [x for x, _ in region]
+    ys = [y for _, y in region]
+    left, right = min(xs), max(xs) + 1
+    top, bottom = min(ys), max(ys) + 1
+    margin_x = max(1.0, (right - left) * MARGIN)
+    margin_y = max(1.0, (bottom - top) * MARGIN)
+
+    def to_image(cell):
+        # Cell n starts at thumbnail pixel n * CELL_SIZE + 1 (FIND_EDGES' border was cropped)
+        return round((cell * CELL_SIZE + 1) * scale)
+
+    box = (
+        max(0, to_image(left - margin_x)),
+        max(0, to_image(top - margin_y)),
+        min(image.width, to_image(right + margin_x)),
+        min(image.height, to_image(bottom + margin_y)),
+    )
+    ratio = round((box[2] - box[0]) * (box[3] - box[1]) / (image.width * image.height), 3)
+    result.update(box=box, ratio=ratio)
+    if confidence < min_confidence:
+        result["reason"] = f"text spread over several regions (confidence {confidence:.2f} < {min_confidence:.2f})"
+    elif ratio > max_ratio:
+        result["reason"] = f"label fills {ratio:.0%} of the photo"
+    else:
+        result["applied"] = True
+    return result
@@ -0,0 +1,226 @@
+"""
+Upload Store
+Content-addressed, size-capped store for uploaded images (sharded by SHA-256, deduplicated,
+least recently used evicted first), written synchronously or from a background writer
+"""
+
+import atexit
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+
+from preprocessing import make_thumbnail, sniff_mime_type
+
+MIME_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
+
+DERIVATIVE_FORMATS = {"image/webp": "WEBP", "image/jpeg": "JPEG"}
+
+
+def write_upload(folder, filename, data):
+    """Atomically write `data` to folder/filename"""
+    path = os.path.join(folder, filename)
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+class UploadStore:
+    """Blobs at folder/ab/cd/<sha256><ext>, indexed in a SQLite file shared by every
+    gunicorn worker.
+
+    Identical uploads are stored once; every upload name is an alias of its blob. When
+    the blobs exceed `max_bytes` the least recently stored or served ones are deleted
+    together with their aliases and derivatives (<sha256>.<size>.<ext> thumbnails next
+    to the blob, not counted against `max_bytes`).
+    """
+
+    def __init__(self, folder, max_bytes=512 * 1024 * 1024, index_path=None):
+        # Absolute, so the paths handed to send_file do not depend on the process cwd
+        self.folder = os.path.abspath(folder)
+        self.max_bytes = max_bytes
+        # Never inside `folder`: its files are served by name
+        self.index_path = index_path or f"{os.path.normpath(folder)}.sqlite3"
+        self._local = threading.local()
+        os.makedirs(self.folder, exist_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            " digest TEXT PRIMARY KEY, name TEXT NOT NULL, mime TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS blobs_accessed ON blobs (accessed)")
+        conn.execute("CREATE INDEX IF NOT EXISTS blobs_name ON blobs (name)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS aliases (filename TEXT PRIMARY KEY, digest TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS aliases_digest ON aliases (digest)")
+
+    def _connect(self):
+        """Per-thread autocommit connection; transactions are opened explicitly"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def blob_path(self, name):
+        return os.path.join(self.folder, name[:2], name[2:4], name)
+
+    def put(self, filename, data):
+        """Store `data` under the alias `filename` and return its blob name"""
+        digest = hashlib.sha256(data).hexdigest()
+        mime = sniff_mime_type(data) or "application/octet-stream"
+        name = digest + MIME_EXTENSIONS.get(mime, "")
+        path = self.blob_path(name)
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Written under the index lock so a concurrent eviction cannot unlink it
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                write_upload(os.path.dirname(path), name, data)
+            conn.execute(
+                "INSERT INTO blobs (digest, name, mime, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (digest) DO UPDATE SET accessed = excluded.accessed",
+                (digest, name, mime, len(data), now, now),
+            )
+            conn.execute("INSERT OR REPLACE INTO aliases (filename, digest) VALUES (?, ?)", (filename, digest))
+            self._evict(conn, keep=digest)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return name
+
+    def _evict(self, conn, keep):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute(
+            "SELECT digest, name, size FROM blobs WHERE digest != ? ORDER BY accessed", (keep,)
+        ).fetchall()
+        for digest, name, size in rows:
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            conn.execute("DELETE FROM aliases WHERE digest = ?", (digest,))
+            self._remove_files(name, digest)
+            total -= size
+            print(f"🧹 Evicted upload {name} ({size} bytes)")
+
+    def _remove_files(self, name, digest):
+        """Delete a blob and its derivatives"""
+        folder = os.path.dirname(self.blob_path(name))
+        try:
+            names = [entry for entry in os.listdir(folder) if entry == name or entry.startswith(f"{digest}.")]
+        except FileNotFoundError:
+            return
+        for entry in names:
+            try:
+                os.remove(os.path.join(folder, entry))
+            except FileNotFoundError:
+                pass
+
+    def derivative(self, blob, size, mime="image/webp", quality=80):
+        """Path of `blob` (a lookup() result) downscaled to fit in size x size as `mime`,
+        generated on first request; None when the blob cannot be decoded.
+
+        Derivatives are written atomically, so concurrent first requests at worst
+        generate the same file twice.
+        """
+        name = f"{blob['digest']}.{size}{MIME_EXTENSIONS[mime]}"
+        path = self.blob_path(name)
+        if os.path.exists(path):
+            return path
+        try:
+            with open(blob["path"], "rb") as f:
+                data, _ = make_thumbnail(f.read(), size, DERIVATIVE_FORMATS[mime], quality)
+        except FileNotFoundError:
+            return None  # evicted meanwhile
+        except (Image.DecompressionBombError, OSError, ValueError) as e:
+            print(f"⚠️ Cannot create a {size}px derivative of {blob['name']}: {e}")
+            return None
+        return write_upload(os.path.dirname(path), name, data)
+
+    def lookup(self, name):
+        """Blob info {"path", "digest", "mime", "size", "immutable"} for a blob name (with or
+        without its extension) or an upload alias, or None; marks the blob as recently used"""
+        conn = self._connect()
+        row = conn.execute("SELECT digest, name, mime, size FROM blobs WHERE name = ? OR digest = ?",
+                           (name, name)).fetchone()
+        immutable = row is not None
+        if row is None:
+            row = conn.execute(
+                "SELECT blobs.digest, blobs.name, blobs.mime, blobs.size FROM aliases"
+                " JOIN blobs ON blobs.digest = aliases.digest WHERE aliases.filename = ?",
+                (name,),
+            ).fetchone()
+        if row is None:
+            return None
+        digest, blob_name, mime, size = row
+        path = self.blob_path(blob_name)
+        if not os.path.exists(path):
+            return None
+        conn.execute("UPDATE blobs SET accessed = ? WHERE digest = ?", (time.time(), digest))
+        return {"path": path, "digest": digest, "name": blob_name, "mime": mime, "size": size,
+                "immutable": immutable}
+
+    def stats(self):
+        count, total = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        return {"blobs": count, "bytes": total, "max_bytes": self.max_bytes}
+
+
+class DeferredWriter:
+    """Background thread that writes uploads to disk off the request path.
+
+    When the queue is full the upload is written synchronously rather than dropped,
+    and pending writes are flushed at interpreter exit.
+    """
+
+    def __init__(self, store, max_pending=64):
+        self.store = store
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="upload-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def submit(self, filename, data):
+        try:
+            self._queue.put_nowait((filename, data))
+        except queue.Full:
+            print(f"⚠️ Upload writer backlog full, writing {filename} synchronously")
+            self._write(filename, data)
+
+    def flush(self):
+        """Block until every queued upload has been written"""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            filename, data = self._queue.get()
+            try:
+                self._write(filename, data)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, filename, data):
+        try:
+            self.store.put(filename, data)
+        except (OSError, sqlite3.Error) as e:
+            print(f"❌ Failed to persist upload {filename}: {e}")